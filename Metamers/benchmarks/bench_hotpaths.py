@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 17:05:48 2026
+
+Benchmark suite for the hot paths of metamer generation: steerable pyramid construction,
+the grayscale statistics, region pooling, autocorrelation, gaze warping, and a solver
+iteration.  Everything runs on synthetic images (on the cpu by default) so no sample
+images or gpu are required.
+
+Results are stored as json files (one per run, by default named by the git revision) in
+the results directory, and can be compared against an earlier run to spot regressions:
+
+    python bench_hotpaths.py                       # run everything and store results/<git-rev>.json
+    python bench_hotpaths.py -k pyramid -k pool    # only benchmarks whose names contain these substrings
+    python bench_hotpaths.py --compare results/abc1234.json --fail-on-regression 1.15
+    python bench_hotpaths.py --list
+
+@author: bw
+"""
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import os
+import sys
+import io
+import math
+import json
+import time
+import argparse
+import platform
+import statistics
+import contextlib
+import subprocess
+
+_bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(_bench_dir,'..','poolstatmetamer'))  # allow importing from the sibling poolstatmetamer directory
+
+import torch
+import spyramid as sp
+import poolingregions as pool
+import metamerstatistics as mstat
+import autocorrelation as acorr
+import fft_utils
+import gazewarp
+from metamersolver import make_solver
+
+PYRAMIDS = {'ps':'UBbbbL_6:Ori=4:RadK=cos',        # Portilla&Simoncelli-style pyramid
+            'ours':'UEeeeee_7_:Ori=6:RadK=gauss'}  # our default gaze-metamer style pyramid
+POOL_SIZE = 64
+_registry = []   # list of (name,factory) where factory(device) returns a function to time
+
+# Decorator to register a benchmark factory (optionally once for each of a list of parameters)
+def benchmark(name,params=(None,)):
+    def register(factory):
+        for p in params:
+            fullname = name if p is None else f'{name}[{p}]'
+            _registry.append((fullname,(lambda device,p=p: factory(device,p)) if p is not None else factory))
+        return factory
+    return register
+
+def _synthetic_image(size,channels=1,device='cpu'):
+    gen = torch.Generator().manual_seed(1234)
+    return torch.rand(1,channels,size,size,generator=gen).to(device)
+
+def _make_builder(image,pyramid,pooling):
+    min_spacing = pooling.min_stride_divisor()
+    max_downsample = math.gcd(math.gcd(64,min_spacing),math.gcd(image.size(-1),image.size(-2)))
+    pooling.configure_for_downsampling(max_downsample)
+    return sp.SPyramidFourierBuilder(image,sp.SPyramidParams.from_str(PYRAMIDS[pyramid]),downsample=True,max_downsample_factor=max_downsample).to(image.device)
+
+#---------------------- Benchmarks --------------------------------
+@benchmark('build_spyramid',params=[f'{pyr}-{size}' for pyr in PYRAMIDS for size in (256,512,1024,2048)])
+def bench_build_spyramid(device,param):
+    pyr,size = param.split('-')
+    image = _synthetic_image(int(size),device=device)
+    builder = _make_builder(image,pyr,pool.Trigezoid(POOL_SIZE))
+    return lambda: builder.build_spyramid(image)
+
+# Pyramid construction using FFTs for all levels ('fourier'), convolution for all levels ('spatial'), or chosen per level by cost ('auto')
+@benchmark('build_spyramid_method',params=[f'{pyr}-{size}-{method}' for pyr in PYRAMIDS for size in (512,2048) for method in ('fourier','auto','spatial')])
+def bench_build_spyramid_method(device,param):
+    pyr,size,method = param.split('-')
+    image = _synthetic_image(int(size),device=device)
+    pooling = pool.Trigezoid(POOL_SIZE)
+    max_downsample = math.gcd(math.gcd(64,pooling.min_stride_divisor()),int(size))
+    builder = sp.SPyramidConvolutionalBuilder(image,sp.SPyramidParams.from_str(PYRAMIDS[pyr]),max_downsample_factor=max_downsample,method=method).to(image.device)
+    return lambda: builder.build_spyramid(image)
+
+# FFT plus inverse FFT at the builder's padded size for some common photo sizes, with the minimal symmetric
+# padding ('-minimal') or with the padding enlarged to a size with only small prime factors ('-friendly')
+@benchmark('pyramid_fft',params=[f'{size}-{mode}' for size in ('768x1024','1080x1920','1200x1600','1077x1440') for mode in ('minimal','friendly')])
+def bench_pyramid_fft(device,param):
+    size,mode = param.split('-')
+    (h,w) = (int(x) for x in size.split('x'))
+    image = torch.rand(1,1,h,w,generator=torch.Generator().manual_seed(1234)).to(device)
+    builder = sp.SPyramidFourierBuilder(image,sp.SPyramidParams.from_str(PYRAMIDS['ours']),max_downsample_factor=math.gcd(64,math.gcd(h,w)),
+                                        fft_friendly_padding=(mode=='friendly'))
+    padded = torch.nn.functional.pad(image,builder.padding)
+    return lambda: fft_utils.irfft_shim2d(fft_utils.rfft_shim2d(padded))
+
+@benchmark('grayscale_statistics',params=['ps_all-256','ps_all-512','Full-256','Full-512','fs_all-512','fs_all-512-loop'])
+def bench_grayscale_statistics(device,param):
+    group,size,*mode = param.split('-')
+    image = _synthetic_image(int(size),device=device)
+    pooling = pool.Trigezoid(POOL_SIZE)
+    builder = _make_builder(image,'ps' if group=='ps_all' else 'ours',pooling)
+    pooling.to(device)
+    spyr = builder.build_spyramid(image)
+    stats = mstat.GrayscaleStatistics()
+    stats.set_all_stats(False)
+    stats.set_stat_group(group,True)
+    stats.set_mode('batch_orientations','loop' not in mode)   # '-loop' variants use the per-orientation loops
+    return lambda: stats(spyr,pooling,None)
+
+@benchmark('whole_image_statistics',params=['ps_all-512','ps_all-512-general','fs_all-512','fs_all-512-general'])
+def bench_whole_image_statistics(device,param):
+    group,size,*mode = param.split('-')
+    image = _synthetic_image(int(size),device=device)
+    pooling = pool.WholeImagePooling()
+    builder = _make_builder(image,'ps' if group=='ps_all' else 'ours',pooling)
+    spyr = builder.build_spyramid(image)
+    stats = mstat.GrayscaleStatistics()
+    stats.set_all_stats(False)
+    stats.set_stat_group(group,True)
+    stats.set_mode('global_fast_path','general' not in mode)   # '-general' variants pool each statistic image instead
+    return lambda: stats(spyr,pooling,None)
+
+@benchmark('color_statistics',params=[256,512])
+def bench_color_statistics(device,size):
+    import color_utils as color
+    transform = color.RGBToOpponentConeTransform().to(device)
+    image = transform(_synthetic_image(size,channels=3,device=device))
+    pooling = pool.Trigezoid(POOL_SIZE)
+    builder = _make_builder(image,'ours',pooling)
+    pooling.to(device)
+    stats = mstat.CrossColorStatistics()
+    def run():
+        spyrs = builder.build_spyramid_channels(image,transform.channel_names())
+        return stats(spyrs,pooling,None)
+    return run
+
+@benchmark('pool_stats',params=[f'{kern}-{stride}' for kern in ('Box','Trapezoid','Trigezoid') for stride in ('1/2','1/4')])
+def bench_pool_stats(device,param):
+    kern,stride = param.split('-')
+    num,den = stride.split('/')
+    pooling = getattr(pool,kern)(POOL_SIZE,stride_fraction=int(num)/int(den))
+    pooling.configure_for_downsampling(1)
+    pooling.to(device)
+    image = _synthetic_image(512,device=device)
+    return lambda: pooling.pool_stats(image,image.size())
+
+@benchmark('pool_stats_whole')
+def bench_pool_stats_whole(device):
+    pooling = pool.WholeImagePooling()
+    image = _synthetic_image(512,device=device)
+    return lambda: pooling.pool_stats(image,image.size())
+
+@benchmark('autocorrelation2d',params=[256,512,1024])
+def bench_autocorrelation2d(device,size):
+    image = _synthetic_image(size,channels=4,device=device)
+    offsets = acorr.generate_offset_list(7)
+    def run():
+        for shift in offsets: acorr.autocorrelation2d(image,shift,1)
+    return run
+
+@benchmark('gaze_warp',params=[256,512,1024])
+def bench_gaze_warp(device,size):
+    image = _synthetic_image(size,channels=3,device=device)
+    params = gazewarp.WarpParams(0.75,POOL_SIZE,anisotropy=2,azimuth_multiple=POOL_SIZE//4)
+    warper = gazewarp.GazeWarper(image.size(),params,device=device)
+    return lambda: warper.warp(image,make_mask=True)
+
+@benchmark('gaze_unwarp',params=[256,512,1024])
+def bench_gaze_unwarp(device,size):
+    image = _synthetic_image(size,channels=3,device=device)
+    params = gazewarp.WarpParams(0.75,POOL_SIZE,anisotropy=2,azimuth_multiple=POOL_SIZE//4)
+    warper = gazewarp.GazeWarper(image.size(),params,device=device)
+    warped,_ = warper.warp(image,make_mask=True)
+    return lambda: warper.unwarp(warped)
+
+def _quiet_solver(image,device):
+    with contextlib.redirect_stdout(io.StringIO()):
+        solver = make_solver(image,POOL_SIZE,outfile=None,pyramid_params=PYRAMIDS['ours'])
+    for mode in ('print_num_statistics','print_elapsed_time','print_loss','step_print_loss'):
+        solver.set_mode(mode,False)
+    solver.set_mode('device',device)
+    return solver
+
+# Solves with zero iterations (target statistics plus one evaluation) and with one L-BFGS iteration,
+# the difference between the two is the cost of a single optimizer step
+@benchmark('solver',params=['0iter-256','1iter-256'])
+def bench_solver(device,param):
+    iters,size = param.split('-')
+    iters = int(iters[0])
+    image = _synthetic_image(int(size),channels=3,device=device)
+    seed = _synthetic_image(int(size),channels=3,device=device).flip(-1)
+    solver = _quiet_solver(image,device)
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            solver.solve_for_metamer(image,iters,seed)
+    return run
+
+#---------------------- Runner --------------------------------
+def _sync(device):
+    if torch.device(device).type == 'cuda': torch.cuda.synchronize()
+
+# Time a function: one warmup call then repeat until min_time has elapsed (at least min_repeats calls)
+def time_function(func,device,min_time=1.0,min_repeats=3,max_repeats=100):
+    func()
+    _sync(device)
+    times = []
+    total = 0
+    while (len(times) < min_repeats or total < min_time) and len(times) < max_repeats:
+        start = time.perf_counter()
+        func()
+        _sync(device)
+        times.append(time.perf_counter()-start)
+        total += times[-1]
+    return {'median_s':statistics.median(times),'min_s':min(times),'mean_s':statistics.mean(times),'repeats':len(times)}
+
+def _git_revision():
+    try:
+        out = subprocess.run(['git','rev-parse','--short','HEAD'],cwd=_bench_dir,capture_output=True,text=True,check=True)
+        return out.stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(names=None,device='cpu',min_time=1.0):
+    results = {}
+    for name,factory in _registry:
+        if names and not any(n in name for n in names): continue
+        try:
+            func = factory(device)
+            res = time_function(func,device,min_time=min_time)
+        except Exception as e:     # report failing benchmarks without stopping the suite
+            res = {'error':f'{type(e).__name__}: {e}'}
+        results[name] = res
+        if 'error' in res: print(f'{name:<36} ERROR {res["error"]}')
+        else: print(f'{name:<36} {1000*res["median_s"]:10.2f} ms  (min {1000*res["min_s"]:.2f}, n={res["repeats"]})')
+    # derived result: cost of a single solver iteration
+    for size in (256,):
+        one,zero = results.get(f'solver[1iter-{size}]'),results.get(f'solver[0iter-{size}]')
+        if one and zero and 'error' not in one and 'error' not in zero:
+            results[f'lbfgs_step[{size}]'] = {'median_s':one['median_s']-zero['median_s'],'derived':True}
+    return results
+
+def environment_info(device):
+    return {'git_revision':_git_revision(),
+            'date':time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python':platform.python_version(),
+            'torch':torch.__version__,
+            'platform':platform.platform(),
+            'processor':platform.processor(),
+            'torch_threads':torch.get_num_threads(),
+            'device':str(device)}
+
+def compare_results(current,baseline,threshold):
+    regressions = []
+    print(f'\n{"benchmark":<36}{"baseline ms":>14}{"current ms":>14}{"ratio":>9}')
+    for name,res in current.items():
+        base = baseline.get(name)
+        if base is None or 'median_s' not in base or 'median_s' not in res: continue
+        ratio = res['median_s']/base['median_s'] if base['median_s'] > 0 else float('inf')
+        flag = '  REGRESSION' if ratio > threshold else ''
+        if flag: regressions.append(name)
+        print(f'{name:<36}{1000*base["median_s"]:14.2f}{1000*res["median_s"]:14.2f}{ratio:9.2f}{flag}')
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks for the pyramid/statistics/pooling hot paths')
+    parser.add_argument('-k',dest='names',action='append',help='only run benchmarks whose name contains this substring (can be repeated)')
+    parser.add_argument('--device',default='cpu')
+    parser.add_argument('--min-time',type=float,default=1.0,help='minimum total timing per benchmark in seconds')
+    parser.add_argument('--threads',type=int,default=None,help='number of torch cpu threads')
+    parser.add_argument('--label',default=None,help='name for stored results (default is the git revision)')
+    parser.add_argument('--results-dir',default=os.path.join(_bench_dir,'results'))
+    parser.add_argument('--no-save',action='store_true',help='do not store the results')
+    parser.add_argument('--compare',default=None,help='earlier results file to compare against')
+    parser.add_argument('--fail-on-regression',type=float,default=None,metavar='RATIO',
+                        help='exit with an error if any benchmark is slower than the comparison by more than this ratio')
+    parser.add_argument('--list',action='store_true',help='list the available benchmarks')
+    args = parser.parse_args(argv)
+    if args.list:
+        for name,_ in _registry: print(name)
+        return 0
+    if args.threads: torch.set_num_threads(args.threads)
+    results = run_benchmarks(args.names,args.device,args.min_time)
+    record = {'environment':environment_info(args.device),'results':results}
+    if not args.no_save:
+        os.makedirs(args.results_dir,exist_ok=True)
+        label = args.label or record['environment']['git_revision'] or time.strftime('%Y%m%d-%H%M%S')
+        filename = os.path.join(args.results_dir,f'{label}.json')
+        with open(filename,'w') as f: json.dump(record,f,indent=1)
+        print(f'Results written to {filename}')
+    if args.compare:
+        with open(args.compare) as f: baseline = json.load(f)['results']
+        threshold = args.fail_on_regression if args.fail_on_regression else 1.1
+        regressions = compare_results(results,baseline,threshold)
+        if regressions and args.fail_on_regression:
+            print(f'{len(regressions)} benchmark(s) regressed by more than {threshold}x')
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 15:02:11 2026
+
+Startup-time benchmark: measures how long a fresh (headless) python process takes to
+"import metamerconfig" and reports which heavy optional libraries (plotting, movie I/O,
+GUI) were pulled in as a side effect.  Short-lived batch workers pay this cost on every
+launch, so none of those libraries should be loaded until they are actually used.
+
+Usage:  python bench_startup.py [--repeats N] [--module metamerconfig]
+
+@author: bw
+"""
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+_package_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','poolstatmetamer')
+
+# Libraries that headless workers should not need to import at startup
+HEAVY_MODULES = ('matplotlib','matplotlib.pyplot','mpl_toolkits.axes_grid1','torchvision','imageio','PIL','cv2')
+
+# Code run in each child process: time the import and report which heavy modules ended up loaded
+_CHILD_CODE = """
+import sys, time, json
+t0 = time.perf_counter()
+import torch
+t1 = time.perf_counter()
+import {module}
+t2 = time.perf_counter()
+print(json.dumps({{'torch':t1-t0, 'package':t2-t1, 'loaded':[m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+# Run one import measurement in a fresh interpreter and return its result dictionary
+def time_import_once(module='metamerconfig'):
+    env = dict(os.environ)
+    env['MPLBACKEND'] = 'Agg'     # emulate a headless machine (no display)
+    env.pop('DISPLAY',None)
+    env['PYTHONPATH'] = os.path.abspath(_package_dir) + os.pathsep + env.get('PYTHONPATH','')
+    code = _CHILD_CODE.format(module=module,heavy=HEAVY_MODULES)
+    out = subprocess.run([sys.executable,'-c',code],env=env,check=True,capture_output=True,text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def bench_startup(module='metamerconfig',repeats=5):
+    runs = [time_import_once(module) for _ in range(repeats)]
+    result = {'module':module,
+              'repeats':repeats,
+              'torch_import_s':statistics.median(r['torch'] for r in runs),
+              'package_import_s':statistics.median(r['package'] for r in runs),
+              'heavy_modules_loaded':runs[-1]['loaded']}
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure headless import time of the metamer package')
+    parser.add_argument('--repeats',type=int,default=5,help='number of fresh interpreters to time (median is reported)')
+    parser.add_argument('--module',default='metamerconfig',help='module to import')
+    parser.add_argument('--json',action='store_true',help='print result as json')
+    args = parser.parse_args()
+    res = bench_startup(args.module,args.repeats)
+    if args.json:
+        print(json.dumps(res,indent=2))
+    else:
+        print(f"import torch:        {1000*res['torch_import_s']:8.1f} ms (median of {res['repeats']})")
+        print(f"import {res['module']}: {1000*res['package_import_s']:8.1f} ms (excluding torch)")
+        loaded = res['heavy_modules_loaded']
+        print('heavy modules loaded at startup: ' + (', '.join(loaded) if loaded else 'none'))
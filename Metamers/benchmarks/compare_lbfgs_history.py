@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 23:58:16 2026
+
+Compares L-BFGS history storage formats (see compactlbfgs.CompactLBFGS) on the sample images.
+Each image is solved from the same random seed with each history format and the report lists
+the optimizer's device memory (predicted), the actual peak memory (cuda only), the solve time,
+and the final loss relative to the default float32 history (the json output also includes
+the loss at every step).
+
+    python compare_lbfgs_history.py --device cuda --iterations 100
+    python compare_lbfgs_history.py --images ../sampleimages/bigben.jpg --formats float32,bfloat16 --out lbfgs.json
+
+@author: bw
+"""
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import contextlib
+
+_bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(_bench_dir,'..','poolstatmetamer'))  # allow importing from the sibling poolstatmetamer directory
+
+import torch
+from image_utils import load_image_rgb
+from metamersolver import make_solver
+
+SAMPLE_IMAGES = [os.path.join(_bench_dir,'..','sampleimages',name) for name in ('Einstein.jpg','bigben.jpg','Shakespeare.jpg')]
+# History formats as name -> (history dtype, history device)
+FORMATS = {'float32':(None,None),
+           'bfloat16':('bfloat16',None),
+           'float16':('float16',None),
+           'offload':(None,'cpu'),
+           'offload-bfloat16':('bfloat16','cpu')}
+
+# Solve for one image with one history format and return a dictionary of its memory, time, and losses
+def solve_with_format(image,seed,history_format,iterations,pooling,device):
+    (dtype,hdevice) = FORMATS[history_format]
+    with contextlib.redirect_stdout(io.StringIO()):
+        solver = make_solver(image,pooling,outfile=None)
+    for mode in ('print_num_statistics','print_elapsed_time','print_loss','step_print_loss'):
+        solver.set_mode(mode,False)
+    solver.set_mode('device',device)
+    solver.set_mode('print_memory_estimate',True)   # records the predicted (and on cuda the actual) peak memory
+    if dtype is not None or hdevice is not None:
+        solver.set_mode('lbfgs_history_dtype',dtype)
+        solver.set_mode('lbfgs_history_device',hdevice)
+    if torch.device(device).type == 'cuda': torch.cuda.empty_cache()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = solver.solve_for_metamer(image,iterations,seed_image=seed.clone())
+    elapsed = time.perf_counter() - start
+    usage = result.memory_usage or {}
+    estimate = usage.get('estimate',{})
+    return {'optimizer_bytes':estimate.get('optimizer'),
+            'actual_peak_bytes':usage.get('actual_peak'),
+            'time_s':elapsed,
+            'final_loss':result.loss_value,
+            'loss_history':result.loss_history}
+
+def print_report(results):
+    mb = 2**20
+    print(f'\n{"image":<18}{"format":<18}{"optimizer MB":>14}{"peak MB":>10}{"time s":>9}{"final loss":>13}{"vs float32":>12}')
+    for name,runs in results.items():
+        base = runs.get('float32',{}).get('final_loss')
+        for fmt,r in runs.items():
+            peak = f"{r['actual_peak_bytes']/mb:10.0f}" if r['actual_peak_bytes'] is not None else f'{"-":>10}'
+            opt = f"{r['optimizer_bytes']/mb:14.1f}" if r['optimizer_bytes'] is not None else f'{"-":>14}'
+            ratio = f"{r['final_loss']/base:12.3f}" if base else f'{"-":>12}'
+            print(f'{name:<18}{fmt:<18}{opt}{peak}{r["time_s"]:9.1f}{r["final_loss"]:13.5g}{ratio}')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare memory and convergence of L-BFGS history storage formats')
+    parser.add_argument('--images',nargs='+',default=SAMPLE_IMAGES)
+    parser.add_argument('--formats',default=','.join(FORMATS),help=f'comma separated list from: {",".join(FORMATS)}')
+    parser.add_argument('--iterations',type=int,default=50)
+    parser.add_argument('--pooling',type=int,default=64,help='pooling region size')
+    parser.add_argument('--device',default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--out',default=None,help='also write the results (including loss histories) to this json file')
+    args = parser.parse_args(argv)
+    formats = args.formats.split(',')
+    for fmt in formats:
+        if fmt not in FORMATS: raise ValueError(f'Unrecognized history format: {fmt}')
+    results = {}
+    for filename in args.images:
+        image = load_image_rgb(filename)
+        seed = torch.rand(image.size(),generator=torch.Generator().manual_seed(1234))
+        name = os.path.basename(filename)
+        results[name] = {}
+        for fmt in formats:
+            if FORMATS[fmt][1] is not None and torch.device(args.device).type != 'cuda': continue   # offloading only matters for gpus
+            print(f'Solving {name} with {fmt} history')
+            results[name][fmt] = solve_with_format(image,seed,fmt,args.iterations,args.pooling,args.device)
+    print_report(results)
+    if args.out:
+        with open(args.out,'w') as f: json.dump(results,f,indent=1)
+        print(f'Results written to {args.out}')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
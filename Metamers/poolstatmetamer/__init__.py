@@ -0,0 +1,12 @@
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+# The modules in this package import each other by their bare module names (eg "import spyramid as sp"), so they
+# are used with the package directory on the module search path.  Importing the package does not change sys.path,
+# only the command line interface (cli) adds the directory, and scripts can add it explicitly using package_dir.
+# Nothing else is imported here so that "import poolstatmetamer" stays cheap for short-lived workers.
+import os as _os
+
+__version__ = '0.2.0'
+
+package_dir = _os.path.dirname(_os.path.abspath(__file__))   # directory containing the package's modules
@@ -0,0 +1,8 @@
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+# Allows running the command line interface as "python -m poolstatmetamer ..."
+import sys
+from poolstatmetamer.cli import main
+
+sys.exit(main())
@@ -13,6 +13,7 @@ Computes autocorrelation for a single specified offset vector and assumes
 # Released under an open-source MIT license, see LICENSE file for details
 
 import torch
+from fft_utils import rfft_shim2d, irfft_shim2d
 
 # This version formats the result as an image in pytorch's preferred 4d format but accepts 2d, 3d, or 4d images
 def autocorrelation2d(stack, offset, offset_scale=1, center=True):
@@ -144,6 +145,32 @@ def offsetcorrelation_image(imageA, imageB, offset, offset_scale=1, center=True)
             res[:,:,-c0-d0:s0-c0,-c1-d1:s1-c1] = imageA[:,:,-d0:,-d1:] * imageB[:,:,:s0+d0,:s1+d1]   
     return res
 
+# Sums of the autocorrelation products for all offsets at once, computed from the power spectrum (Wiener-Khinchin theorem)
+def autocorrelation_sums(image):
+    """
+    Computes the sum of the autocorrelation image for every offset using a single FFT and inverse FFT.
+    
+    The image is zero padded to twice its size so the result matches the zero boundary condition
+    (ie no wraparound) used by autocorrelation_image().
+    
+    Args:
+        image: input image in 4d format
+    Return:
+        Tensor R of size (batch,channel,2*height,2*width) where R[:,:,d0 % 2*height,d1 % 2*width] is the
+        sum of autocorrelation_image(image,(d0,d1)) for any offset with |d0|<height and |d1|<width
+    """
+    if image.dim() != 4: raise ValueError(f'Expected 4 dimensional image but got: {image.size()}')
+    padded = torch.nn.functional.pad(image,(0,image.size(-1),0,image.size(-2)))
+    power = rfft_shim2d(padded).pow(2).sum(-1,keepdim=True)
+    return irfft_shim2d(torch.cat((power,torch.zeros_like(power)),-1))
+
+# Select the autocorrelation sum for one offset from the result of autocorrelation_sums (returns tensor of size batch x channel)
+def autocorrelation_sum_at(sums, offset, offset_scale=1):
+    d0 = offset[0]*offset_scale
+    d1 = offset[1]*offset_scale
+    if abs(d0) >= sums.size(-2)//2 or abs(d1) >= sums.size(-1)//2: return torch.zeros_like(sums[:,:,0,0])  # no overlap with shifted version
+    return sums[:,:,d0 % sums.size(-2),d1 % sums.size(-1)]
+
 def generate_offset_list(window_size=7,include_zero_offset=False):
     """ 
     Generates a list of unique offsets within the specified window size.
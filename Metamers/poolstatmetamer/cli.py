@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 15:40:52 2026
+
+Command line interface for batch generation of metamers.  It runs a metamer configuration
+(specified using the same parameter strings as MetamerConfig, eg 'UBbbbL_6:Ori=4:RadK=cos:Bound=wrap'
+for the pyramid or '128:Kern=Trig:mesa=1/2:stride=1/2:Bound=wrap_x' for the pooling) over a list of images
+given directly on the command line and/or in manifest files.  The named settings used in the sample scripts
+(eg PS_pyr, FS_gaze_pool, FS_gaze_warp) can also be used in place of the parameter strings.
+
+A manifest is a text file with one image per line:
+    image_path [basename] [gaze ...]
+where each gaze is a normalized point "x,y" (0 to 1) or a pixel point "x,y px".  Supplying several gaze points
+generates the metamers for all of them together as a batch.  Blank lines and lines starting with # are ignored
+and relative image paths are relative to the manifest's directory.
+
+Examples:
+    poolstatmetamer cat.png bigben.jpg --pyramid PS_pyr --pooling whole --stats ps_all
+    poolstatmetamer --manifest images.txt --pooling FS_gaze_pool --pyramid FS_gaze_pyr --warping FS_gaze_warp \\
+                    --stats fs_all --workers 4 --device cuda:0,cuda:1 --resume
+
+@author: bw
+"""
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import os
+import sys
+import time
+import argparse
+import traceback
+from typing import NamedTuple, Optional
+
+# The package modules import each other by their bare names, so the command line entry point puts their directory on the search path
+_package_dir = os.path.dirname(os.path.abspath(__file__))
+if _package_dir not in sys.path: sys.path.append(_package_dir)
+
+# Named parameter strings (as used in the sample scripts) that can be given in place of an explicit parameter string
+PRESETS = {
+    # Portilla&Simoncelli-style pyramid and whole-image pooling
+    'PS_pyr': 'UBbbbL_6:Ori=4:RadK=cos:Bound=wrap',
+    'PS_pool': 'whole',
+    # Freeman&Simoncelli-style gaze-centric settings
+    'FS_gaze_pool': '128:Kern=Trig:mesa=1/2:stride=1/2:Bound=wrap_x',
+    'FS_gaze_pyr': 'UBbbbbbL_8_:Ori=4:Bound=wrap_x',
+    'FS_gaze_warp': 'warp=0.75:anisotropy=2',
+    # Our gaze-centric settings
+    'gaze_over4_pool': '128:Kern=Trig:mesa=1/2:stride=1/4:Bound=wrap_x',
+    'gaze_over2_pool': '128:Kern=Trig:mesa=0:stride=1/2:Bound=wrap_x',
+    'better_gaze_pyr': 'UEeeeee_7_:Ori=6:RadK=gauss:Bound=wrap_x',
+}
+
+# Seed image generators that can be selected by name (names map to functions in metamerconfig)
+SEEDS = {
+    'random': 'seed_random',
+    'half': 'seed_const_half',
+    'zero': 'seed_const_zero',
+    'rotate180': 'seed_rotate180',
+    'target': 'seed_copy_target',
+}
+
+# A single unit of work: one target image and the gaze point(s) to generate its metamer(s) for
+class Job(NamedTuple):
+    image : str
+    basename : str
+    gazes : Optional[tuple] = None   # None for uniform metamers, otherwise a tuple of (x,y,is_pixel) points
+""#END-CLASS------------------------------------
+
+# Replace a preset name by its parameter string (any other string is returned unchanged)
+def resolve_preset(value):
+    if value is None: return None
+    return PRESETS.get(value,value)
+
+# Parse a gaze point string "x,y" (normalized coordinates) or "x,y px" / "x,ypx" (pixel coordinates)
+def parse_gaze(desc:str):
+    desc = desc.strip()
+    is_pixel = desc.endswith('px')
+    if is_pixel: desc = desc[:-2]
+    parts = desc.split(',')
+    if len(parts) != 2: raise ValueError(f'Could not parse gaze point "{desc}", expected "x,y" or "x,y px"')
+    return (float(parts[0]),float(parts[1]),is_pixel)
+
+def _default_basename(image):
+    return os.path.splitext(os.path.basename(image))[0]
+
+# Read a manifest file and return its list of jobs
+def read_manifest(filename):
+    jobs = []
+    basedir = os.path.dirname(os.path.abspath(filename))
+    with open(filename,'r') as f:
+        for linenum,line in enumerate(f,1):
+            line = line.strip()
+            if not line or line.startswith('#'): continue
+            tokens = line.split()
+            # rejoin pixel gaze specifications that were written with a space before the "px"
+            merged = []
+            for tok in tokens:
+                if tok == 'px' and merged: merged[-1] += 'px'
+                else: merged.append(tok)
+            image = os.path.join(basedir,os.path.expanduser(merged[0]))
+            basename = None
+            gazes = []
+            for tok in merged[1:]:
+                if ',' in tok:
+                    try:
+                        gazes.append(parse_gaze(tok))
+                    except ValueError as e:
+                        raise ValueError(f'{filename}:{linenum}: {e}') from None
+                elif basename is None:
+                    basename = tok
+                else:
+                    raise ValueError(f'{filename}:{linenum}: unexpected field "{tok}"')
+            if basename is None: basename = _default_basename(image)
+            jobs.append(Job(image,basename,tuple(gazes) if gazes else None))
+    return jobs
+
+# Construct the schedule of MetamerConfig's described by the (parsed) command line options
+def build_schedule(options):
+    import metamerconfig as mc
+    schedule = []
+    if options['copy_original']:
+        # the copy uses the same pyramid and warping as the metamers so it takes the same (eg multi-gaze) path
+        schedule.append(mc.MetamerConfig('_original',copy_original=True,
+                                         pyramid=resolve_preset(options['pyramid']),
+                                         pooling=resolve_preset(options['pooling']),
+                                         warping=resolve_preset(options['warping']),
+                                         device=options['device']))
+    solver_modes = {'print_num_statistics':options['verbose']}
+    if options['device'] is not None: solver_modes['use_gpu_if_available'] = options['device'].startswith('cuda')
+    schedule.append(mc.MetamerConfig(options['suffix'],
+                                     stats=options['stats'],
+                                     pyramid=resolve_preset(options['pyramid']),
+                                     pooling=resolve_preset(options['pooling']),
+                                     warping=resolve_preset(options['warping']),
+                                     image_seed=getattr(mc,SEEDS[options['seed']]),
+                                     randseed=options['randseed'],
+                                     solver_modes=solver_modes,
+                                     device=options['device']))
+    return schedule
+
+# Returns the output files that the schedule will produce for a job (used to skip finished jobs when resuming)
+def expected_outputs(job,schedule,outdir):
+    outputs = []
+    suffix = ''
+    for config in schedule:
+        suffix = config.update_namesuffix(suffix)
+        if job.gazes is not None and len(job.gazes) > 1:
+            outputs += [os.path.join(outdir,f'{job.basename}{suffix}_gaze{k}.png') for k in range(len(job.gazes))]
+        else:
+            outputs.append(os.path.join(outdir,job.basename+suffix+'.png'))
+    return outputs
+
+def _make_gaze_points(gazes):
+    import poolingregions as pool
+    if gazes is None: return None
+    points = [pool.ImagePoint(x,y) if is_pixel else pool.NormalizedPoint(x,y) for (x,y,is_pixel) in gazes]
+    if len(points) == 1: return points[0]
+    return points
+
+# Generate the metamers for a single job.  Runs either in the main process or in a worker process
+def run_job(job,options,device=None,threads=None):
+    import torch
+    import metamerconfig as mc
+    if threads is not None: torch.set_num_threads(threads)
+    options = dict(options)
+    if device is not None: options['device'] = device
+    mc.MetamerConfig.set_default_output_dir(options['outdir'])
+    schedule = build_schedule(options)
+    start = time.time()
+    mc.generate_image_schedule(job.image,schedule,color=options['color'],max_iters=options['iters'],
+                               basename=job.basename,gaze_point=_make_gaze_points(job.gazes))
+    return time.time()-start
+
+def _run_job_logged(job,options,device,threads):
+    try:
+        return (job,run_job(job,options,device,threads),None)
+    except Exception:
+        return (job,None,traceback.format_exc())
+
+def make_argument_parser():
+    parser = argparse.ArgumentParser(prog='poolstatmetamer',description='Batch generation of pooled statistics metamers',
+                                     epilog='Named presets: '+', '.join(PRESETS))
+    parser.add_argument('images',nargs='*',help='target image files')
+    parser.add_argument('-m','--manifest',action='append',default=[],help='manifest file listing target images (can be repeated)')
+    parser.add_argument('-o','--outdir',default='./pmetamer_output',help='directory where output images are written')
+    parser.add_argument('--pyramid',default=None,help='steerable pyramid parameter string or preset name (eg PS_pyr)')
+    parser.add_argument('--pooling',default=None,help='pooling parameter string or preset name (eg FS_gaze_pool)')
+    parser.add_argument('--warping',default=None,help='gaze warping parameter string or preset name (eg FS_gaze_warp)')
+    parser.add_argument('--stats',default='',help='statistics string, eg "Metamer" or "fs_all" or "+edge_mean-mean"')
+    parser.add_argument('--suffix',default='_pmet',help='suffix appended to the basename of output files')
+    parser.add_argument('--seed',default='random',choices=sorted(SEEDS),help='initial image for the solver')
+    parser.add_argument('--randseed',type=int,default=49832475,help='random number seed')
+    parser.add_argument('--iters',type=int,default=300,help='maximum solver iterations per metamer')
+    parser.add_argument('--gaze',action='append',default=None,help='gaze point "x,y" (normalized) or "x,ypx" (pixels) for images without one in the manifest')
+    parser.add_argument('--gray',action='store_true',help='generate grayscale metamers (default is color)')
+    parser.add_argument('--copy-original',action='store_true',help='also write a copy of each target image (with suffix _original)')
+    parser.add_argument('-j','--workers',type=int,default=1,help='number of worker processes')
+    parser.add_argument('--device',default=None,
+                        help='device(s) for the solver, eg cpu, cuda, or a comma separated list such as cuda:0,cuda:1 which is assigned round-robin to the jobs')
+    parser.add_argument('--resume',action='store_true',help='skip jobs whose output files already exist')
+    parser.add_argument('-v','--verbose',action='store_true',help='print more information during solving')
+    return parser
+
+def main(argv=None):
+    args = make_argument_parser().parse_args(argv)
+    default_gazes = tuple(parse_gaze(g) for g in args.gaze) if args.gaze else None
+    jobs = [Job(os.path.expanduser(img),_default_basename(img),default_gazes) for img in args.images]
+    for manifest in args.manifest:
+        jobs += [job if job.gazes is not None else job._replace(gazes=default_gazes) for job in read_manifest(manifest)]
+    if not jobs:
+        print('No target images were given (use image arguments or --manifest)',file=sys.stderr)
+        return 2
+    options = {'outdir':os.path.expanduser(args.outdir),'pyramid':args.pyramid,'pooling':args.pooling,'warping':args.warping,
+               'stats':args.stats,'suffix':args.suffix,'seed':args.seed,'randseed':args.randseed,'iters':args.iters,
+               'color':not args.gray,'copy_original':args.copy_original,'device':None,'verbose':args.verbose}
+    devices = args.device.split(',') if args.device else [None]
+
+    if args.resume:
+        schedule = build_schedule(dict(options,device=devices[0]))
+        remaining = [job for job in jobs if not all(os.path.exists(f) for f in expected_outputs(job,schedule,options['outdir']))]
+        if len(remaining) < len(jobs): print(f'Resuming: skipping {len(jobs)-len(remaining)} finished job(s)')
+        jobs = remaining
+    os.makedirs(options['outdir'],exist_ok=True)
+
+    failures = []
+    start = time.time()
+    if args.workers <= 1:
+        for i,job in enumerate(jobs):
+            (job,elapsed,error) = _run_job_logged(job,options,devices[i % len(devices)],None)
+            if error: failures.append((job,error))
+    else:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        # Split the cpu threads between the workers so they don't oversubscribe the machine
+        threads = max(1,(os.cpu_count() or 1)//args.workers)
+        # Use spawn so that worker processes can safely initialize cuda
+        with ProcessPoolExecutor(max_workers=args.workers,mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(_run_job_logged,job,options,devices[i % len(devices)],threads) for i,job in enumerate(jobs)]
+            for fut in as_completed(futures):
+                (job,elapsed,error) = fut.result()
+                if error: failures.append((job,error))
+                else: print(f'finished {job.image} in {elapsed:.1f} seconds')
+    for job,error in failures:
+        print(f'FAILED {job.image}:\n{error}',file=sys.stderr)
+    print(f'Completed {len(jobs)-len(failures)} of {len(jobs)} job(s) in {time.time()-start:.1f} seconds')
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
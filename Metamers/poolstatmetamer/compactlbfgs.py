@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 23:41:07 2026
+
+L-BFGS optimizer with compact storage for its history.  For large metamers the s/y history
+vectors (two per history entry, each the size of the trainable image) can take several GB
+of device memory, eg 30 entries for a 3x2048x2048 image is about 3 GB in float32.
+CompactLBFGS can store the history in a smaller floating point format (eg bfloat16 halves
+it) and/or offload it to pinned host memory, from where each pair is copied back to the
+device (one pair ahead of its use, on a side stream) during the two-loop recursion.
+The recursion itself, the direction, and the gradients are always computed in float32.
+
+It otherwise follows torch.optim.LBFGS without a line search (including its state names,
+such as 't' and 'n_iter', which the solver adjusts when it retries a step).
+
+@author: bw
+"""
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import torch
+
+class CompactLBFGS(torch.optim.Optimizer):
+
+    def __init__(self,params,lr=1,max_iter=20,max_eval=None,tolerance_grad=1e-7,tolerance_change=1e-9,history_size=100,*,
+                 history_dtype=None,       # Floating point type for storing the history (eg torch.bfloat16 or 'bfloat16'), None means same as parameters
+                 history_device=None,      # Device for storing the history (eg 'cpu' to offload it from the gpu), None means same as parameters
+                 chunk_size=2**22):        # Reduced precision history is converted to float32 in chunks of this many elements
+        if max_eval is None: max_eval = max_iter*5//4
+        defaults = dict(lr=lr,max_iter=max_iter,max_eval=max_eval,tolerance_grad=tolerance_grad,
+                        tolerance_change=tolerance_change,history_size=history_size)
+        super().__init__(params,defaults)
+        if len(self.param_groups) != 1: raise ValueError("CompactLBFGS doesn't support per-parameter options (parameter groups)")
+        self._params = self.param_groups[0]['params']
+        if isinstance(history_dtype,str): history_dtype = getattr(torch,history_dtype)
+        self.history_dtype = history_dtype
+        self.history_device = None if history_device is None else torch.device(history_device)
+        self.chunk_size = chunk_size
+        self._prefetch_stream = None
+
+    def _param_device(self):
+        return self._params[0].device
+
+    # Is the history stored on a different device than the parameters?
+    def _offloading(self):
+        return self.history_device is not None and self.history_device != self._param_device()
+
+    # Bytes per history element stored in the parameters' device memory (zero if offloaded)
+    @property
+    def device_history_element_size(self):
+        if self._offloading(): return 0
+        dtype = self.history_dtype or self._params[0].dtype
+        return torch.empty((),dtype=dtype).element_size()
+
+    def _gather_flat_grad(self):
+        views = []
+        for p in self._params:
+            if p.grad is None:
+                view = p.new_zeros(p.numel())
+            elif p.grad.is_sparse:
+                view = p.grad.to_dense().view(-1)
+            else:
+                view = p.grad.view(-1)
+            views.append(view)
+        return torch.cat(views,0)
+
+    def _add_grad(self,step_size,update):
+        offset = 0
+        for p in self._params:
+            numel = p.numel()
+            p.add_(update[offset:offset+numel].view_as(p),alpha=step_size)
+            offset += numel
+
+    # Convert a history vector to its storage format (and device)
+    def _store(self,vec):
+        dtype = self.history_dtype or vec.dtype
+        if self._offloading():
+            stored = torch.empty(vec.shape,dtype=dtype,device=self.history_device,
+                                 pin_memory=(self.history_device.type == 'cpu' and vec.is_cuda))
+            stored.copy_(vec)
+            return stored
+        return vec.to(dtype)
+
+    # Dot product of a stored history vector with a float32 vector (computed in float32)
+    def _dot(self,stored,vec):
+        if stored.dtype == vec.dtype: return stored.dot(vec)
+        total = vec.new_zeros(())
+        for start in range(0,vec.numel(),self.chunk_size):
+            total += stored[start:start+self.chunk_size].to(vec.dtype).dot(vec[start:start+self.chunk_size])
+        return total
+
+    # Add a multiple of a stored history vector to a float32 vector in place (computed in float32)
+    def _add_scaled(self,vec,stored,alpha):
+        if stored.dtype == vec.dtype:
+            vec.add_(stored,alpha=alpha)
+            return
+        for start in range(0,vec.numel(),self.chunk_size):
+            vec[start:start+self.chunk_size].add_(stored[start:start+self.chunk_size].to(vec.dtype),alpha=alpha)
+
+    # Iterate over the history as (index,s,y) in the given order, with the vectors on the computation device
+    # Offloaded pairs are copied on a side stream one pair ahead of their use so the transfers overlap the computations
+    def _history_pairs(self,old_stps,old_dirs,order):
+        order = list(order)
+        if not self._offloading():
+            for i in order: yield (i,old_stps[i],old_dirs[i])
+            return
+        device = self._param_device()
+        if device.type != 'cuda':
+            for i in order: yield (i,old_stps[i].to(device),old_dirs[i].to(device))
+            return
+        if self._prefetch_stream is None: self._prefetch_stream = torch.cuda.Stream(device)
+        stream = self._prefetch_stream
+        def fetch(i):
+            with torch.cuda.stream(stream):
+                pair = (old_stps[i].to(device,non_blocking=True),old_dirs[i].to(device,non_blocking=True))
+                event = torch.cuda.Event()
+                event.record(stream)
+            return (pair,event)
+        pending = fetch(order[0]) if order else None
+        for k,i in enumerate(order):
+            ((s,y),event) = pending
+            if k+1 < len(order): pending = fetch(order[k+1])
+            current = torch.cuda.current_stream(device)
+            current.wait_event(event)
+            s.record_stream(current)   # the tensors were allocated on the side stream but are used on the current one
+            y.record_stream(current)
+            yield (i,s,y)
+
+    # Perform a single optimization step (closure reevaluates the model and returns the loss)
+    @torch.no_grad()
+    def step(self,closure):
+        closure = torch.enable_grad()(closure)
+        group = self.param_groups[0]
+        lr = group['lr']
+        max_iter = group['max_iter']
+        max_eval = group['max_eval']
+        tolerance_grad = group['tolerance_grad']
+        tolerance_change = group['tolerance_change']
+        history_size = group['history_size']
+
+        # NOTE: L-BFGS has only global state, but we register it as state for the first param (like torch.optim.LBFGS)
+        state = self.state[self._params[0]]
+        state.setdefault('func_evals',0)
+        state.setdefault('n_iter',0)
+
+        # evaluate initial f(x) and df/dx
+        orig_loss = closure()
+        loss = float(orig_loss)
+        current_evals = 1
+        state['func_evals'] += 1
+        flat_grad = self._gather_flat_grad()
+        opt_cond = flat_grad.abs().max() <= tolerance_grad
+        if opt_cond: return orig_loss   # optimal condition
+
+        # tensors cached in state (for tracing)
+        d = state.get('d')
+        t = state.get('t')
+        old_dirs = state.get('old_dirs')
+        old_stps = state.get('old_stps')
+        ro = state.get('ro')
+        H_diag = state.get('H_diag')
+        prev_flat_grad = state.get('prev_flat_grad')
+        prev_loss = state.get('prev_loss')
+
+        n_iter = 0
+        while n_iter < max_iter:
+            n_iter += 1
+            state['n_iter'] += 1
+            # compute the search direction
+            if state['n_iter'] == 1:
+                d = flat_grad.neg()
+                old_dirs = []
+                old_stps = []
+                ro = []
+                H_diag = 1
+            else:
+                # update the history (the curvature values come from the float32 vectors before they are compressed)
+                y = flat_grad.sub(prev_flat_grad)
+                s = d.mul(t)
+                ys = y.dot(s)   # y*s
+                if ys > 1e-10:
+                    while len(old_dirs) >= history_size:   # shift the history
+                        old_dirs.pop(0)
+                        old_stps.pop(0)
+                        ro.pop(0)
+                    H_diag = ys / y.dot(y)   # (y*y)
+                    old_dirs.append(self._store(y))
+                    old_stps.append(self._store(s))
+                    ro.append(1.0 / ys)
+                del y,s
+                # compute the approximate (L-BFGS) inverse Hessian multiplied by the gradient (in float32)
+                num_old = len(old_dirs)
+                if 'al' not in state: state['al'] = [None]*history_size
+                al = state['al']
+                if len(al) < num_old: al.extend([None]*(num_old-len(al)))
+                q = flat_grad.neg()
+                for (i,s_i,y_i) in self._history_pairs(old_stps,old_dirs,range(num_old-1,-1,-1)):
+                    al[i] = self._dot(s_i,q) * ro[i]
+                    self._add_scaled(q,y_i,-al[i])
+                # multiply by initial Hessian, r/d is the final direction
+                d = r = torch.mul(q,H_diag)
+                for (i,s_i,y_i) in self._history_pairs(old_stps,old_dirs,range(num_old)):
+                    be_i = self._dot(y_i,r) * ro[i]
+                    self._add_scaled(r,s_i,al[i] - be_i)
+                del q
+
+            if prev_flat_grad is None:
+                prev_flat_grad = flat_grad.clone(memory_format=torch.contiguous_format)
+            else:
+                prev_flat_grad.copy_(flat_grad)
+            prev_loss = loss
+
+            # compute step length, reset initial guess for step size
+            if state['n_iter'] == 1:
+                t = min(1.0, 1.0 / flat_grad.abs().sum()) * lr
+            else:
+                t = lr
+            # directional derivative
+            gtd = flat_grad.dot(d)   # g * d
+            if gtd > -tolerance_change: break   # directional derivative is below tolerance
+
+            # no line search, simply move with fixed-step
+            ls_func_evals = 0
+            self._add_grad(t,d)
+            if n_iter != max_iter:
+                # re-evaluate function only if not in last iteration (in a stochastic setting there is no use re-evaluating that function here)
+                loss = float(closure())
+                flat_grad = self._gather_flat_grad()
+                opt_cond = flat_grad.abs().max() <= tolerance_grad
+                ls_func_evals = 1
+            current_evals += ls_func_evals
+            state['func_evals'] += ls_func_evals
+
+            # check conditions
+            if n_iter == max_iter: break
+            if current_evals >= max_eval: break
+            if opt_cond: break   # optimal condition
+            if d.mul(t).abs().max() <= tolerance_change: break   # lack of progress
+            if abs(loss - prev_loss) < tolerance_change: break
+
+        state['d'] = d
+        state['t'] = t
+        state['old_dirs'] = old_dirs
+        state['old_stps'] = old_stps
+        state['ro'] = ro
+        state['H_diag'] = H_diag
+        state['prev_flat_grad'] = prev_flat_grad
+        state['prev_loss'] = prev_loss
+        return orig_loss
+
+""#END-CLASS------------------------------------
@@ -123,6 +123,20 @@ def freq_upsample2d(freqimage,factor):
     img = ifftshift2d(img)
     return img;
     
+# Returns true if all the prime factors of n are in the given list of primes
+def has_only_prime_factors(n,primes=(2,3,5,7)):
+    if n < 1: return False
+    for p in primes:
+        while n % p == 0: n //= p
+    return n == 1
+
+# Returns the smallest size >= minsize whose prime factors are all small (FFT libraries are much faster for such sizes)
+# The size is also restricted to minsize plus a multiple of step (eg so the extra padding keeps the size divisible by a downsampling factor)
+def fft_friendly_size(minsize,step=1,primes=(2,3,5,7)):
+    size = minsize
+    while not has_only_prime_factors(size,primes): size += step
+    return size
+
 #-----FFT-Migration-Shim-Functions----------------------------------
 
 def rfft_shim2d(image):
@@ -27,6 +27,7 @@ import torch
 import torch.nn.functional as F
 import os
 import time
+import collections
 from fractions import Fraction
 from typing import Optional
 import imageblends as blend
@@ -104,6 +105,10 @@ class WarpParams():
 #            return self.target_pooling_size/self.scaling - self.target_pooling_size/2
         return self._min_radius    
     
+    # Tuple of all the values that affect the warp (used as the key when caching precomputed warps)
+    def _cache_key(self):
+        return (self.scaling,self.target_pooling_size,self.anisotropy,self.get_min_radius(),self.azimuth_multiple,self.gamma,self.clamp_range)
+    
     def __str__(self):
         retval = f'warp={self.self.ecc_scaling}'
         if self.anisotropy != self.DEFAULT_ANISOTROPY_RATIO or self.VERBOSE_PARAMS:
@@ -228,171 +233,240 @@ def _preblur_image(image,level,gamma=None):
         res = res.pow(1/gamma)
     return res
 
-def _make_mipmap_filter2d(level,filter_type):
-    if filter_type == 'box':
-        # simple box filter centered on the pixel with width equal to 2^level
-        if level <= 0: return torch.ones(1,1)
-        filt1d = torch.ones(2**level+1)
-        filt1d[0] = filt1d[-1] = 0.5  # box filter extends halfway into the filter's end pixels
-        filt1d = filt1d/filt1d.sum() # normalize filter
-        return torch.outer(filt1d,filt1d) # create 2d separable filter from 1d version
-    else:
-        raise ValueError('Unrecognized mipmap filter type {filter_type}')
-        
-# Build a mipmap-style pyramid of increasingly blurred images
-# Note: all levels use the same image resolution, unlike a traditional mipmap where images would decrease (shrink) with increasing level
-# Filtering is imperfect and there can still be undersampling errors, especially at higher levels where filter shape could be further optimized
-def _build_mipmap(image,level_count,mode='box'):
+# Downsample an image by a factor of two using a separable [1,3,3,1]/8 filter 
+# Each output pixel is centered on a 2x2 block of input pixels, odd sizes are padded (by replication) at the end
+def _mip_downsample2x(image):
+    (height,width) = image.shape[-2:]
+    channels = image.size(1)
+    image = F.pad(image,(1,1+width%2,1,1+height%2),mode='replicate')
+    filt1d = torch.tensor([1.,3.,3.,1.],dtype=image.dtype,device=image.device)/8
+    image = F.conv2d(image,filt1d.view(1,1,1,4).expand(channels,-1,-1,-1),stride=(1,2),groups=channels)
+    return F.conv2d(image,filt1d.view(1,1,4,1).expand(channels,-1,-1,-1),stride=(2,1),groups=channels)
+
+# Build a mipmap of increasingly blurred and downsampled images (level k is downsampled by 2^k)
+# Total cost is only a small constant factor times the image size, regardless of the number of levels
+def _build_mip_chain(image,level_count):
     if image.dim() != 4: raise ValueError(f'expected 4d tensor {image.size()}')
-    mipmap = [None]*level_count
-    mipmap[0] = image #image forms first level of mip map
-    ones = torch.ones(1,1,image.size(2),image.size(3), device=image.device)
+    mipmap = [image]  #image forms first level of mip map
     for level in range(1,level_count):
-        filt = _make_mipmap_filter2d(level,mode)
-        if image.is_cuda: filt = filt.cuda()
-#        plot_image(filt,title=f'mipmap filter for level {level}')
-        filt = filt[None,None,:,:] # convert 2d tensor for standard 4d format
-        filt = filt.expand(image.size(1),-1,-1,-1)  # expand (repeat) filter to have the same number of channels as the input image
-        if filt.size(-1) != filt.size(-2) or (filt.size(-1) % 2 != 1): raise ValueError(f'filter must be squared and size must be odd {filt.size()}')
-        pad = (filt.size(-1)-1)//2   #we need to add padding so the convolution does not change its size
-        blurred = F.conv2d(image, filt, padding=pad, groups=image.size(1))
-        norm = F.conv2d(ones, filt.narrow(1,0,1), padding=pad)  #normalization factor to correct boundary darkening
-        mipmap[level] = blurred / norm
-#        plot_image(mipmap[level],f'mipmap level {level}')
+        mipmap.append(_mip_downsample2x(mipmap[-1]))
     return mipmap
-       
-#TODO: Test better mipmap construction filters (jinc?) and dynamic number of levels
-def _preblur_image_mipmap(image,level_map):
-#    num_levels = 5
-    num_levels = math.ceil(level_map.max())
-#    print(f"num mipmap levels {num_levels}")
-    mipmap = _build_mipmap(image,num_levels)  
-    retval = mipmap[0]
-    for lvl in range(1,num_levels):
-        blend = (level_map-(lvl-1)).clamp(min=0,max=1)
-        retval = torch.lerp(retval,mipmap[lvl],blend)
-#        from image_utils import plot_image
-#        plot_image(blend,title=f'blend level {lvl}')
-#        plot_image(retval,title=f'blurred level{lvl}')
-#    plot_image(level_map,title='mipmap level map')
-    return retval
     
+# Precomputes the sampling grids, support mask, and preblur mipmap sampling for a log-polar gaze warp with a fixed image size, 
+# gaze point, and warp parameters.  These are then reused to warp and unwarp all images with that same geometry (eg both
+# target and seed images, successive movie frames, or a dataset of same-sized images).  See get_gaze_warper() for a cached version
+# The gaze can also be a list of gaze points, in which case the image is warped to all of them as a single batch (one batch entry
+# per gaze point).  All gazes then share the same warped size (using the largest rmax), so their warped images can be solved together
 # Note: using supersampling is now deprecated and will be removed eventually (adds extra expense and blurring, using preblur is better and faster)
-# Note: preblur is still somewhat prmitive and could be improved with multiple levels, better blur kernel, etc.
-def _gaze_warp_image_logpolar(image, params, gaze=None, 
-                    mode='bicubic',rmax=None,preblur=True,make_mask=True):    
-    width = image.size(-1)
-    height = image.size(-2)
-    if gaze is None: gaze = (height/2,width/2)
-    eccentricity_scaling = params.scaling
-    target_pooling_size = params.target_pooling_size
-    anisotropy_ratio = params.anisotropy
-    rmin = params.get_min_radius()
-    # calculate # of distinct angles to use in the polar space
-#    if params.round_azimuth:  # force the azimuthal rsesolution to be a multiple of the pooling size (important to avoid possible artifacts at 0/360 boundary)
-#        thetasize = target_pooling_size*round(anisotropy_ratio*2*math.pi / eccentricity_scaling + 0.5)
-    if params.azimuth_multiple: # ensure azimuth size is a multiple of the specified value (typically the pooling stride)
-        thetasize = _ceil_multiple(target_pooling_size*anisotropy_ratio*2*math.pi / eccentricity_scaling, params.azimuth_multiple)
-    else:
-        thetasize = _ceil_multiple(target_pooling_size*anisotropy_ratio*2*math.pi / eccentricity_scaling, 8)
+# Note: preblur is still somewhat prmitive and could be improved with a better (eg jinc) mipmap filter
+class GazeWarper():
     
-#    if rmin is None: rmin = target_pooling_size/eccentricity_scaling - target_pooling_size/2
-    if rmax is None: rmax = _max_radius(image, gaze)
-    a = target_pooling_size/eccentricity_scaling
-    b = -a*math.log(rmin)
-    smin = 0
-    smax = _ceil_multiple(a*math.log(rmax) + b, 8)
-#    print(f'thetasize {thetasize}  rmin{rmin} rmax{rmax} smin{smin} smax{smax}')
-    # start with a uniform spacing in theta
-    thalfstep = math.pi/thetasize
-    theta = torch.linspace(-math.pi+thalfstep,math.pi-thalfstep,thetasize,device=image.device)
-    # and convert to cos and sin
-    cost = torch.cos(theta)
-    sint = torch.sin(theta)
-    # start with a uniform spacing in s
-    simg = torch.arange(smin,smax,device=image.device).flip(-1)
-    # convert to the radius values that would generate these s value
-    rimg = torch.exp((simg-b)*(1/a))
-    x = torch.outer(rimg,cost) + (gaze[1] + 0.5)    # grid sample uses coordinates where pixel centers are at the half positions
-    y = torch.outer(rimg,sint) + (gaze[0] + 0.5)
+    def __init__(self,image_size,params,gaze=None,*,device=None,mode='bicubic',rmax=None,preblur=True):
+        if torch.is_tensor(image_size): image_size = image_size.size()
+        width = image_size[-1]
+        height = image_size[-2]
+        if gaze is None: gaze = (height/2,width/2)
+        gazes = list(gaze) if isinstance(gaze,list) else [gaze]
+        self.image_size = (height,width)
+        self.gaze = gaze
+        self.gaze_count = len(gazes)
+        self.device = device
+        self.mode = mode
+        self.gamma = params.gamma
+        self.clamp_range = params.clamp_range
+        self.min_radius = params.get_min_radius()
+        eccentricity_scaling = params.scaling
+        target_pooling_size = params.target_pooling_size
+        anisotropy_ratio = params.anisotropy
+        rmin = self.min_radius
+        # calculate # of distinct angles to use in the polar space
+        if params.azimuth_multiple: # ensure azimuth size is a multiple of the specified value (typically the pooling stride)
+            thetasize = _ceil_multiple(target_pooling_size*anisotropy_ratio*2*math.pi / eccentricity_scaling, params.azimuth_multiple)
+        else:
+            thetasize = _ceil_multiple(target_pooling_size*anisotropy_ratio*2*math.pi / eccentricity_scaling, 8)
+        if rmax is None: rmax = max(_max_radius(image_size, g) for g in gazes)
+        a = target_pooling_size/eccentricity_scaling
+        b = -a*math.log(rmin)
+        smin = 0
+        smax = _ceil_multiple(a*math.log(rmax) + b, 8)
+        self.thetasize = thetasize
+        self.smax = smax
+#        print(f'thetasize {thetasize}  rmin{rmin} rmax{rmax} smin{smin} smax{smax}')
+        
+        #--Forward warp: position in the original image to sample for each warped pixel
+        # start with a uniform spacing in theta
+        thalfstep = math.pi/thetasize
+        theta = torch.linspace(-math.pi+thalfstep,math.pi-thalfstep,thetasize,device=device)
+        # and convert to cos and sin
+        cost = torch.cos(theta)
+        sint = torch.sin(theta)
+        # start with a uniform spacing in s
+        simg = torch.arange(smin,smax,device=device).flip(-1)
+        # convert to the radius values that would generate these s value
+        rimg = torch.exp((simg-b)*(1/a))
+        gazex = torch.tensor([g[1] for g in gazes],dtype=torch.float32,device=device).view(-1,1,1)
+        gazey = torch.tensor([g[0] for g in gazes],dtype=torch.float32,device=device).view(-1,1,1)
+        x = torch.outer(rimg,cost) + (gazex + 0.5)    # grid sample uses coordinates where pixel centers are at the half positions
+        y = torch.outer(rimg,sint) + (gazey + 0.5)
+        # convert to grid_samples' normalized coordinates
+        x = (2/(width))*x - 1
+        y = (2/(height))*y - 1
+        self.warp_grid = torch.stack((x,y),-1)     # one grid per gaze point (gaze_count x height x width x 2)
+        # Preblur reduces aliasing in regions where the warp is compressive.  The mipmap level to sample is log2 of the warp's 
+        # compression which only depends on the radius and hence is constant along each warped row.  We sample the two nearest
+        # levels (trilinear-style) and only for the rows that use them, storing (level,first_row,end_row,row_weights,level_grid)
+        self.mip_samples = None
+        if preblur:
+            levels = torch.log2(rimg/a)
+            self.mip_level_count = max(1,math.ceil(levels.max().item()))
+            levels = levels.clamp(min=0,max=self.mip_level_count-1)
+            self.mip_samples = []
+            (levheight,levwidth) = (height,width)
+            for level in range(self.mip_level_count):
+                weights = (1 - (levels-level).abs()).clamp(min=0)   # hat function, so weights of neighboring levels sum to one
+                rows = weights.nonzero()
+                if len(rows) > 0:   #levels are monotonic in the rows so the non-zero weights form a contiguous range
+                    (first,end) = (rows.min().item(),rows.max().item()+1)
+                    # map coordinates to this level (level covers a possibly padded region of levwidth*2^level original pixels)
+                    scale = torch.tensor([width/(levwidth*2**level),height/(levheight*2**level)],device=device)
+                    levgrid = (self.warp_grid[:,first:end]+1)*scale - 1
+                    self.mip_samples.append((level,first,end,weights[first:end].view(1,1,-1,1),levgrid))
+                (levheight,levwidth) = (math.ceil(levheight/2),math.ceil(levwidth/2))
+        # mask of unneeded pixels outside of warped image's region
+        mask = F.grid_sample(torch.ones(self.gaze_count,1,height,width,device=device),self.warp_grid,align_corners=False,mode=mode)
+        mask = F.max_pool2d(mask,3,stride=1,padding=1) # Expand support region by 1 pixel in all directions (needed to get edge pixels fully covered during unwarp)
+        self.support_mask = mask<0.0001
+        
+        #--Inverse warp: position in the warped image to sample for each original pixel
+        distances = [_make_distance_image(image_size,g,device=device) for g in gazes]
+        radius = torch.stack([d[0] for d in distances])
+        dx = torch.stack([d[1] for d in distances])
+        dy = torch.stack([d[2] for d in distances])
+        theta = (torch.atan2(dy,dx) + math.pi)*(thetasize/(2*math.pi))
+        s = a*torch.log(radius) + b + 0.5
+        nx = (2/(thetasize))*theta - 1
+        ny = 1 - (2/smax)*s
+        self.unwarp_padding = 0
+        if mode != 'nearest':
+            self.unwarp_padding = 2   #add values just beyond theta=-pi and theta=pi for interpolation
+            nx = (thetasize/(thetasize+2*self.unwarp_padding))*nx
+        self.unwarp_grid = torch.stack((nx,ny),-1)
+        self.gazes = gazes
+        self._blend_kernel = None
+        
+    # Size of the warped images (height,width)
+    def warped_size(self):
+        return (self.smax,self.thetasize)
+        
+    # Warps an image (batch x channels x height x width) into log-polar space and optionally returns the mask of unsupported warped pixels
+    # With multiple gazes, a single image is warped to each gaze point, or else the batch size must match the number of gazes
+    def warp(self,image,make_mask=True):
+        batch = max(image.size(0),self.gaze_count)
+        def batch_grid(grid): return grid.expand(batch,-1,-1,-1) if grid.size(0)==1 else grid
+        def batch_image(img): return img.expand(batch,-1,-1,-1) if img.size(0)==1 else img
+        if self.gamma:
+            image = image.pow(self.gamma)  # Convert image to "linear" space if it was in a nonlinear gamma encoding 
+        # use grid_sample to fetch each pixel's value from its warped position
+        if self.mip_samples is None:
+            retval = F.grid_sample(batch_image(image),batch_grid(self.warp_grid),align_corners=False,mode=self.mode,padding_mode='border')
+        else:
+            # sample from the preblurred mipmap levels (used to reduce aliasing in regions where the warp is compressive)
+            mipmap = _build_mip_chain(image,self.mip_level_count)
+            retval = image.new_zeros(batch,image.size(1),*self.warped_size())
+            for (level,first,end,weights,levgrid) in self.mip_samples:
+                sampled = F.grid_sample(batch_image(mipmap[level]),batch_grid(levgrid),align_corners=False,mode=self.mode,padding_mode='border')
+                retval[...,first:end,:] += weights*sampled
+        mask = None
+        if make_mask:
+            mask = self.support_mask.expand(batch,retval.size(1),-1,-1)
+            retval = retval.masked_fill(mask,0)  # force pixels outside of image's warped support to zero
+        if self.clamp_range:
+            retval = torch.clamp(retval,min=0,max=1)
+        if self.gamma:
+            retval = retval.pow(1/self.gamma)  # convert back to same gamma encoding as the input used
+        return retval,mask
     
-    # convert to grid_samples' normalized coordinates
-    x = (2/(width))*x - 1
-    y = (2/(height))*y - 1
-    grid = torch.stack((x,y),2).unsqueeze(0)
-    if params.gamma:
-        image = image.pow(params.gamma)  # Convert image to "linear" space if it was in a nonlinear gamma encoding 
-    source = image
-    # compute preblur if needed (used to reduce aliasing in regions where the warp is compressive)
-    if preblur:
-        radius,dx,dy = _make_distance_image(image,gaze,device=image.device)
-        compression = radius/a
-        source = _preblur_image_mipmap(image, compression.log2())
-
-    # use grid_sample to fetch each pixel's value from its warped position
-    retval = torch.nn.functional.grid_sample(source,grid,align_corners=False,mode=mode,padding_mode='border')
+    # Inverse of warp (though there is some loss of information/blurring)
+    def unwarp(self,warped):
+        if warped.shape[-2:] != self.warped_size(): raise ValueError(f' size mismatch {tuple(warped.shape[-2:])} vs {self.warped_size()}')
+        source = warped
+        if self.unwarp_padding > 0:
+            source = F.pad(source,[self.unwarp_padding,self.unwarp_padding,0,0],'circular') 
+        grid = self.unwarp_grid
+        if grid.size(0) == 1: grid = grid.expand(source.size(0),-1,-1,-1)
+        if self.gamma:
+            source = source.pow(self.gamma)  # Convert image to "linear" space if it was in a nonlinear gamma encoding 
+        # use grid_sample to fetch each pixel's value from its warped position
+        retval = F.grid_sample(source,grid,align_corners=False,mode=self.mode,padding_mode='border')
+        if self.clamp_range:
+            retval = torch.clamp(retval,min=0,max=1)
+        if self.gamma:
+            retval = retval.pow(1/self.gamma)  # convert back to same gamma encoding as the input used
+        return retval
     
-    #create mask of unneeded pixels outside of warped image's region
-    mask = None
-    if make_mask:
-        mask = torch.nn.functional.grid_sample(torch.ones_like(source),grid,align_corners=False,mode=mode)
-        mask = F.max_pool2d(mask,3,stride=1,padding=1) # Expand support region by 1 pixel in all directions (needed to get edge pixels fully covered during unwarp)
-        mask = mask<0.0001
-        retval[mask] = 0  # force pixels outside of image's warped support to zero
-    if params.clamp_range:
-        retval = torch.clamp(retval,min=0,max=1)
-    if params.gamma:
-        retval = retval.pow(1/params.gamma)  # convert back to same gamma encoding as the input used
-    return retval,mask
+    # Blending weights for the region near the gaze point (radius < min_radius) which is not represented in the warped image
+    # Returned as a (gaze_count x 1 x height x width) tensor
+    def get_gaze_blend_kernel(self):
+        if self._blend_kernel is None:
+            rmin = self.min_radius
+            self._blend_kernel = torch.stack([blend.trapezoid_radial(self.image_size,rmin+1,rmin+5,center=g,device=self.device) 
+                                              for g in self.gazes]).unsqueeze(1)
+        return self._blend_kernel
+    
+""#END-CLASS------------------------------------
+
+# Cache of recently used GazeWarpers (most recently used at the end)
+_gaze_warper_cache = collections.OrderedDict()
+GAZE_WARPER_CACHE_SIZE = 8
+
+# Returns a GazeWarper for the given geometry, reusing a previously constructed one if available
+def get_gaze_warper(image_size,params,gaze=None,device=None,mode='bicubic'):
+    if torch.is_tensor(image_size): image_size = image_size.size()
+    if isinstance(gaze,list): gaze = [tuple(g) for g in gaze]
+    key = (tuple(image_size[-2:]),None if gaze is None else tuple(gaze),params._cache_key(),str(device),mode)
+    warper = _gaze_warper_cache.get(key)
+    if warper is None:
+        warper = GazeWarper(image_size,params,gaze,device=device,mode=mode)
+        _gaze_warper_cache[key] = warper
+        while len(_gaze_warper_cache) > GAZE_WARPER_CACHE_SIZE:
+            _gaze_warper_cache.popitem(last=False)   # discard least recently used entry
+    else:
+        _gaze_warper_cache.move_to_end(key)
+    return warper
+
+# Discard all cached GazeWarpers (eg to free memory)
+def clear_gaze_warper_cache():
+    _gaze_warper_cache.clear()
+
+def _gaze_warp_image_logpolar(image, params, gaze=None, 
+                    mode='bicubic',rmax=None,preblur=True,make_mask=True):    
+    warper = GazeWarper(image.size(),params,gaze,device=image.device,mode=mode,rmax=rmax,preblur=preblur)
+    return warper.warp(image,make_mask=make_mask)
 
 def _gaze_unwarp_image_logpolar(warped,origsize,params,gaze=None,
                     mode='bicubic',rmax=None):
-    if torch.is_tensor(origsize): origsize = origsize.size()
-    width = origsize[-1]
-    height = origsize[-2]
-    thetasize = warped.size(-1)
-    if gaze is None: gaze = (height/2,width/2)
-    eccentricity_scaling = params.scaling
-    target_pooling_size = params.target_pooling_size
-    anisotropy_ratio = params.anisotropy
-    rmin = params.get_min_radius()
-#    if rmin is None: rmin = target_pooling_size/eccentricity_scaling - target_pooling_size/2
-    if rmax is None: rmax = _max_radius(origsize, gaze)
-    a = target_pooling_size/eccentricity_scaling
-    b = -a*math.log(rmin)
-    smin = 0
-    smax = _ceil_multiple(a*math.log(rmax) + b, 8)
-    if smax != warped.size(-2): raise ValueError(f' size mismatch {smax} vs {warped.size(-2)}')
+    warper = GazeWarper(origsize,params,gaze,device=warped.device,mode=mode,rmax=rmax,preblur=False)
+    return warper.unwarp(warped)
 
-    radius,dx,dy = _make_distance_image(origsize,gaze,device=warped.device)
-    theta = (torch.atan2(dy,dx) + math.pi)*(thetasize/(2*math.pi))
-    s = a*torch.log(radius) + b + 0.5
-    nx = (2/(thetasize))*theta - 1
-    ny = 1 - (2/smax)*s
-    source = warped
-    if mode != 'nearest':
-        source = torch.nn.functional.pad(source,[2,2,0,0],'circular') #add values just beyond theta=-pi and theta=pi for interpolation
-        nx = (thetasize/(thetasize+4))*nx
-    grid = torch.stack((nx,ny),2).unsqueeze(0)
-    if params.gamma:
-        source = source.pow(params.gamma)  # Convert image to "linear" space if it was in a nonlinear gamma encoding 
-    # use grid_sample to fetch each pixel's value from its warped position
-    retval = torch.nn.functional.grid_sample(source,grid,align_corners=False,mode=mode,padding_mode='border')
-    if params.clamp_range:
-        retval = torch.clamp(retval,min=0,max=1)
-    if params.gamma:
-        retval = retval.pow(1/params.gamma)  # convert back to same gamma encoding as the input used
-    return retval
 
+# Automatically convert ImagePoint or NormalizedPoint classes (or a list of them) to simple tuples
+def _gaze_in_torch_coordinates(gaze,image):
+    if isinstance(gaze,list): return [_gaze_in_torch_coordinates(g,image) for g in gaze]
+    if hasattr(gaze,"get_in_torch_coordinates"): return gaze.get_in_torch_coordinates(image)
+    return gaze
 
 # Warp an image into gaze-centric log-polar space
-def gaze_warp_image(image,params,gaze=None,make_mask=True,prefer_cuda=True):
-    if hasattr(gaze,"get_in_torch_coordinates"):  # automatically convert ImagePoint or NormalizeImagePoint classes to simple tuple
-        gaze = gaze.get_in_torch_coordinates(image)
+#  gaze can also be a list of gaze points, in which case a batch of warped images (one per gaze point) is returned
+#  If a device is specified, the warp is computed on that device and the results are left there.  Otherwise prefer_cuda
+#  will compute it on the gpu (if available) and then copy the results back to the image's original device
+def gaze_warp_image(image,params,gaze=None,make_mask=True,prefer_cuda=True,device=None):
+    gaze = _gaze_in_torch_coordinates(gaze,image)
     # should we move the tensor to the GPU?
-    move_to_cuda = prefer_cuda and torch.cuda.is_available() and not image.is_cuda
+    move_to_cuda = (device is None) and prefer_cuda and torch.cuda.is_available() and not image.is_cuda
     if move_to_cuda: image = image.cuda()
-    warped,mask = _gaze_warp_image_logpolar(image,params,gaze,make_mask=make_mask)
+    if device is not None: image = image.to(device)
+    warper = get_gaze_warper(image.size(),params,gaze,device=image.device)
+    warped,mask = warper.warp(image,make_mask=make_mask)
     if move_to_cuda:   # Move results back to cpu if that is where the origal image ws
         warped = warped.cpu()
         if mask is not None: mask = mask.cpu()
@@ -403,29 +477,33 @@ def gaze_warp_image(image,params,gaze=None,make_mask=True,prefer_cuda=True):
         return warped
 
 # Unwarp log-polar image back to normal image space (inverse of gaze_warp_image, though there is some loss of information/blurring)
-def gaze_unwarp_image(warpedimage,origimage,params,gaze=None,blend_gaze=True,draw_gaze=False,prefer_cuda=True):
-    if hasattr(gaze,"get_in_torch_coordinates"):  # automatically convert ImagePoint or NormalizeImagePoint classes to simple tuple
-        gaze = gaze.get_in_torch_coordinates(origimage)
+#  for a list of gaze points, warpedimage should be a batch with one warped image per gaze point
+#  device has the same meaning as in gaze_warp_image (if specified, the unwarp and blends are all computed and left on it)
+def gaze_unwarp_image(warpedimage,origimage,params,gaze=None,blend_gaze=True,draw_gaze=False,prefer_cuda=True,device=None):
+    gaze = _gaze_in_torch_coordinates(gaze,origimage)
         
     # Should we move the image to the GPU if it is not already there?
-    move_to_cuda = prefer_cuda and torch.cuda.is_available() and not warpedimage.is_cuda
+    move_to_cuda = (device is None) and prefer_cuda and torch.cuda.is_available() and not warpedimage.is_cuda
+    return_device = warpedimage.device
     if move_to_cuda: warpedimage = warpedimage.cuda()
-    unwarped = _gaze_unwarp_image_logpolar(warpedimage,origimage.size(),params,gaze)
-    if move_to_cuda: unwarped = unwarped.cpu()  # TODO: delay move back to cpu until after blends
+    if device is not None: warpedimage = warpedimage.to(device)
+    warper = get_gaze_warper(origimage.size(),params,gaze,device=warpedimage.device)
+    unwarped = warper.unwarp(warpedimage)
     
     if blend_gaze:
         # The region around the gaze point where radius < min_radius will be wrong since it was not represented in the warped image
         # We can optionally blend in this region from the original image to fill in this missing region
-        rmin = params.get_min_radius()
-        kern = blend.trapezoid_radial(origimage,rmin+1,rmin+5,center=gaze)
+        kern = warper.get_gaze_blend_kernel()
         unwarped = blend.blend_images(origimage,unwarped,kern)
     if draw_gaze:
         # Can optionally draw a red dot at the gaze point
-        dotcolor = torch.tensor([1.,0,0])[None,:,None,None]  
+        dotcolor = torch.tensor([1.,0,0],device=unwarped.device)[None,:,None,None]  
         dot_radius = 5
         if isinstance(draw_gaze,float): dot_radius = draw_gaze
-        dotkern = blend.trigezoid_radial(unwarped,dot_radius,dot_radius+4,center=gaze)
+        gazes = gaze if isinstance(gaze,list) else [gaze]
+        dotkern = torch.stack([blend.trigezoid_radial(unwarped,dot_radius,dot_radius+4,center=g) for g in gazes]).unsqueeze(1)
         unwarped = blend.blend_images(dotcolor,unwarped,dotkern)
+    if move_to_cuda: unwarped = unwarped.to(return_device)  # copy back only after the blends are done
     return unwarped
 
 def test_warp_roundtrip():
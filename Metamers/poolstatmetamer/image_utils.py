@@ -11,32 +11,39 @@ A collection of utility routines for loading, plotting, and saving images stored
 # Released under an open-source MIT license, see LICENSE file for details
 
 import math
-from PIL import Image
-import imageio
-import matplotlib.pyplot as plt
-import matplotlib.colors
 import torch
-import torchvision.transforms as transforms
-import torchvision.utils
-from mpl_toolkits.axes_grid1 import ImageGrid
 import numpy as np
 
 _default_figsize = [9,6]
-if torch.__version__ <= '1.7':
-    plt.rcParams["mpl_toolkits.legacy_colorbar"] = False  # This removes a deprecation warning in matplotlib 3.2 (will probably become unneeded in some future release)
+
+# The plotting, image I/O, and movie I/O libraries (matplotlib, torchvision, PIL, imageio) are slow to import
+# and are not needed by headless workers that never plot, so they are imported on first use via these helpers
+def _pyplot():
+    import matplotlib.pyplot as plt
+    if torch.__version__ <= '1.7':
+        plt.rcParams["mpl_toolkits.legacy_colorbar"] = False  # This removes a deprecation warning in matplotlib 3.2 (will probably become unneeded in some future release)
+    return plt
+
+def _pil_image():
+    from PIL import Image
+    return Image
+
+def _to_tensor(pil_image):
+    import torchvision.transforms as transforms
+    return transforms.ToTensor()(pil_image)
 
 # Load an image, convert it to grayscale, and return it as a tensor
 def load_image_gray(filename):
 #    print(f'cwd:{os.getcwd()} filename:{filename}')
-    pil_image = Image.open(filename).convert('L')
-    tensor_image = transforms.ToTensor()(pil_image)
+    pil_image = _pil_image().open(filename).convert('L')
+    tensor_image = _to_tensor(pil_image)
     if tensor_image.dim()==3: tensor_image = tensor_image.unsqueeze(0)  # Make sure result has pytorch standard 4 dimensions
     return tensor_image
 
 # Load an image and return it as a tensor
 def load_image_rgb(filename):
-    pil_image = Image.open(filename).convert('RGB')
-    tensor_image = transforms.ToTensor()(pil_image)
+    pil_image = _pil_image().open(filename).convert('RGB')
+    tensor_image = _to_tensor(pil_image)
     if tensor_image.dim()==3: tensor_image = tensor_image.unsqueeze(0)  # Make sure result has pytorch standard 4 dimensions
     return tensor_image
 
@@ -51,11 +58,13 @@ def save_image(tensor,filename,gamma=None,verbose=True):
     elif not tensor.is_cuda:
         tensor = tensor.clone()   #Save image seems to sometimes modify the image?!? (*255)
     if tensor.is_cuda: tensor = tensor.cpu()   # Make sure tensor is copied to cpu first if needed
+    import torchvision.utils
     torchvision.utils.save_image(tensor, filename)  #WARNING!!: modifies tensor in some cases
     if verbose: print(f"Saved image to {filename}")
 
 # Display an image onscreen
 def show_image(tensor):
+    import torchvision.transforms as transforms
     pil = transforms.ToPILImage()(tensor.squeeze())
     pil.show()
     
@@ -86,12 +95,14 @@ class LoadMovie():
         self.filename = filename
         self.framerange = framerange
     def __iter__(self):
+        import imageio
+        Image = _pil_image()
         print(f'Loading movie from {self.filename}')
         for num,frame in enumerate(imageio.get_reader(self.filename)):
             if (self.framerange is not None) and (not num in self.framerange): continue   # skip any frames not in the given range
             pil_image = Image.fromarray(frame)    # For consistency with single image loading, we use PIL to convert the input to the appropriate color space
             pil_image = pil_image.convert('RGB')
-            yield transforms.ToTensor()(pil_image).unsqueeze(0) # convert to pytorch standard 4 dimensional format
+            yield _to_tensor(pil_image).unsqueeze(0) # convert to pytorch standard 4 dimensional format
 
 # A generator that will load frames from a movie file and return them one at a time as RGB tensor images
 class LoadMovieGray():
@@ -99,12 +110,14 @@ class LoadMovieGray():
         self.filename = filename
         self.framerange = framerange
     def __iter__(self):
+        import imageio
+        Image = _pil_image()
         print(f'Loading grayscale movie from {self.filename}')
         for num,frame in enumerate(imageio.get_reader(self.filename)):
             if (self.framerange is not None) and (not num in self.framerange): continue   # skip any frames not in the given range
             pil_image = Image.fromarray(frame)    # For consistency with single image loading, we use PIL to convert the input to the appropriate color space
             pil_image = pil_image.convert('L')
-            yield transforms.ToTensor()(pil_image).unsqueeze(0) # convert to pytorch standard 4 dimensional format
+            yield _to_tensor(pil_image).unsqueeze(0) # convert to pytorch standard 4 dimensional format
         
 # Makes a purple to green color ramp with black in the middle, good for showing negative&positive parts of an image
 def make_purple_green_cmap():
@@ -116,11 +129,13 @@ def make_purple_green_cmap():
     vals[:, 0] = ramp_rev
     vals[:, 1] = ramp
     vals[:, 2] = ramp_rev
+    import matplotlib.colors
     newcmap = matplotlib.colors.ListedColormap(vals)
     return newcmap
     
 # Plot the image here using matplotlib.
 def plot_image(tensor,title=None,center_zero=None,colorbar=True,show=True,savefile=None):
+    plt = _pyplot()
     plt.figure(figsize=_default_figsize)
     if title is not None:
         plt.title(title)     #add plot title if one was provided
@@ -182,6 +197,7 @@ def plot_image_stack(imagestack,**kwargs):
     plot_image(combo,**kwargs)
     
 def plot_images_alt(tensortuple,colorbar=True):
+    plt = _pyplot()
     num = len(tensortuple)
     fig, ax = plt.subplots(nrows=1, ncols=num, figsize=[12,5])
     for i,tensor in enumerate(tensortuple):
@@ -237,6 +253,8 @@ def plot_images(tensorlist, colorbar=True, center_zero=None, title=None ,show=Tr
     else:
         cmap = 'gray'
 
+    plt = _pyplot()
+    from mpl_toolkits.axes_grid1 import ImageGrid
     fig = plt.figure(figsize=_default_figsize)
     cbar_fraction = 5/min(4,flatlist[0].size(-1)/flatlist[0].size(-2))
     grid = ImageGrid(fig, 111,  # as in plt.subplot(111)
@@ -285,6 +303,7 @@ def plot_images(tensorlist, colorbar=True, center_zero=None, title=None ,show=Tr
 
 # Plot the image here using matplotlib.
 def plot_histogram(tensor,bins=100,title=None,show=True,savefile=None):
+    plt = _pyplot()
     plt.figure(figsize=_default_figsize)
     if title is not None:
         plt.title(title)     #add plot title if one was provided
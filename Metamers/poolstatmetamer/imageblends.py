@@ -15,8 +15,6 @@ import math
 import torch
 import subprocess
 import shutil
-import torchvision.transforms
-from PIL import Image, ImageDraw, ImageFont
 from image_utils import plot_image
 
 import os
@@ -29,10 +27,12 @@ import numpy as np
 # Step is the spacing between elements in the return distance image
 #  if step is not 1, then return image size will be different than the input image size
 # Can optionally also return the dx and dy images by setting return_dx_dy to true
-def distance_image(image_size,center=None,step=1,return_squared_distance=False,return_dx_dy=False):
+# Result is created on the specified device (default is the input image's device or else the cpu)
+def distance_image(image_size,center=None,step=1,return_squared_distance=False,return_dx_dy=False,device=None):
     if torch.is_tensor(image_size):
         width = image_size.size(-1)
         height = image_size.size(-2)
+        if device is None: device = image_size.device
     elif isinstance(image_size,(torch.Size,tuple,list)):
         width = image_size[-1]
         height = image_size[-2]  # assume tuple is in torch ordering (...,height,width)
@@ -41,8 +41,8 @@ def distance_image(image_size,center=None,step=1,return_squared_distance=False,r
         height = image_size
     if center is None: 
         center = ((height-1)/2,(width-1)/2)  # if center not specified use middle of image
-    x = torch.arange(0,width,step=step).float() - center[-1]
-    y = torch.arange(0,height,step=step).float() - center[-2]
+    x = torch.arange(0,width,step=step,device=device).float() - center[-1]
+    y = torch.arange(0,height,step=step,device=device).float() - center[-2]
     x2 = (x**2).unsqueeze(0)
     y2 = (y**2).unsqueeze(1)
     dist2 = x2 + y2
@@ -57,18 +57,18 @@ def distance_image(image_size,center=None,step=1,return_squared_distance=False,r
 
 # Kernel which is one inside the inner radius and blends smoothly to zero at the outer_radius using cosine^2
 # A 2D radially-symmetric kernel
-def trapezoid_radial(image,inner_radius,outer_radius=None,center=None):
+def trapezoid_radial(image,inner_radius,outer_radius=None,center=None,device=None):
     if outer_radius is None: outer_radius = inner_radius*2
-    dist = distance_image(image,center=center)
+    dist = distance_image(image,center=center,device=device)
     blend_func = (outer_radius - dist)/(outer_radius - inner_radius)
     blend_func.clamp_(min=0,max=1)
     return blend_func
 
 # Kernel which is one inside the inner radius and blends smoothly to zero at the outer_radius using cosine^2
 # A 2D radially-symmetric kernel
-def trigezoid_radial(image,inner_radius,outer_radius=None,center=None):
+def trigezoid_radial(image,inner_radius,outer_radius=None,center=None,device=None):
     if outer_radius is None: outer_radius = inner_radius*2
-    dist = distance_image(image,center=center)
+    dist = distance_image(image,center=center,device=device)
     angles = (dist - inner_radius)*(math.pi/(2*(outer_radius-inner_radius)))
     angles.clamp_(min=0)
     blend_func = (torch.cos(angles)**2) * dist.lt(outer_radius).float()
@@ -76,7 +76,8 @@ def trigezoid_radial(image,inner_radius,outer_radius=None,center=None):
 
 # Blend two images according the specified weights (for the first image)
 def blend_images(imageA, imageB, weightA):
-    weightA = weightA.to(imageA)   # Convert weight to same type as image (eg byte to float)
+    imageA = imageA.to(imageB.device)  # Blend on imageB's device (no-op if already there)
+    weightA = weightA.to(imageA)   # Convert weight to same type and device as image (eg byte to float)
     #return torch.lerp(imageA,imageB,weightA)   lerp with tensor weights was only recently added and not yet supported in my version of pytorch
     return imageA*weightA + imageB*(1-weightA)
 
@@ -145,6 +146,8 @@ def compile_convergence_graph_cv2(iterdir, framenames, framerate=30):
 # Given a string, rasterize it into an image sized to fit the text
 # Fonts are annoying platform and install specific, but you can easily use the (low quality) default bitmap font
 def text_to_image(text,font=None):
+    from PIL import Image, ImageDraw, ImageFont  # imported here so PIL and torchvision only load when text is actually rasterized
+    import torchvision.transforms
     if font is None:
         font = ImageFont.load_default()     # If no font was provided, use the simple default bitmap one
 #    elif isinstance(font,str):
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 18:47:30 2026
+
+Rough prediction of the peak memory used by the metamer solver, so that out-of-memory
+problems can be detected (and often avoided) before the optimization starts rather than
+after minutes of work.  The estimate is built from:
+    the solver's parameters and buffers (pyramid filters, pooling kernels, target and metamer images),
+    the L-BFGS history (two vectors per history entry for every trainable pixel, possibly in a compact format),
+    the steerable pyramid images (from the builder's image size, levels, downsampling, and orientations),
+    the statistic product images (sizes recorded while computing the target statistics),
+    and the pooled statistics.
+It is an analytic model and so only approximate.  The solver also records the actual peak (on
+cuda devices) so the memory_estimate_scale mode can be calibrated for a given configuration.
+
+@author: bw
+"""
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+from typing import NamedTuple
+from statcost import PRODUCT_COSTS, DEFAULT_PRODUCT_COST
+from metamerstatistics import accepts_missing_statimg
+
+# Estimated memory usage (in bytes) broken down into its main components
+class MemoryEstimate(NamedTuple):
+    fixed : int               # parameters and buffers (filters, kernels, images)
+    optimizer : int           # optimizer history and gradient vectors
+    target_statistics : int   # pooled target statistics
+    pyramids : int            # pyramid images for the current frame, plus their gradients during backward
+    statistic_images : int    # statistic product images kept for the backward pass
+    transient : int           # temporary spectra while building a pyramid
+    scale : float = 1.0       # calibration multiplier applied to the total
+
+    @property
+    def total(self):
+        return int(self.scale*(self.fixed+self.optimizer+self.target_statistics+self.pyramids+self.statistic_images+self.transient))
+
+    def __str__(self):
+        gb = 2**30
+        parts = ' '.join(f'{name}={getattr(self,name)/gb:.2f}' for name in self._fields if name != 'scale')
+        return f'Estimated peak memory {self.total/gb:.2f} GB  ({parts} GB)'
+""#END-CLASS------------------------------------
+
+# Statlabel callback that records the size of the statistic product images (optionally forwarding to another callback)
+class StatImageSizeRecorder():
+
+    def __init__(self,callback=None):
+        self.callback = callback
+        self.total_bytes = 0      # Total size of all the newly created statistic images
+        self.group_bytes = {}     # Size per (temporal,channel) group, ie the images created in one call to a statistics object
+        self.accepts_missing_statimg = accepts_missing_statimg(callback)   # statistics computed without an image add no bytes
+
+    def __call__(self,stat,label,statimg):
+        if statimg is not None and PRODUCT_COSTS.get(label.weight_category,DEFAULT_PRODUCT_COST)[1] > 0:   # otherwise it pools a pyramid image directly
+            nbytes = statimg.numel()*statimg.element_size()
+            self.total_bytes += nbytes
+            key = (label.temporal,label.channel)
+            self.group_bytes[key] = self.group_bytes.get(key,0) + nbytes
+        if self.callback is not None: self.callback(stat,label,statimg)
+
+""#END-CLASS------------------------------------
+
+def _tensor_bytes(tensors):
+    return sum(t.numel()*t.element_size() for t in tensors if t is not None)
+
+# Estimate the peak memory for a solver (after its target statistics have been computed with a StatImageSizeRecorder)
+#   history_size is the L-BFGS history length (stored with history_element_size bytes per element in device memory)
+#   and checkpointing says whether the statistic images are recomputed during backward
+def estimate_solver_memory(solver,recorder,target_stats,*,history_size=30,history_element_size=4,checkpointing=False,scale=1.0):
+    fixed = _tensor_bytes(solver.parameters()) + _tensor_bytes(solver.buffers())
+    trainable = sum(p.numel() for p in solver.parameters() if p.requires_grad)
+    optimizer = (2*history_size*history_element_size + 4*4)*trainable    # s&y history plus direction, gradients, and previous gradient vectors
+    target = _tensor_bytes(target_stats)
+    image = solver.target_image
+    pyramids = transient = 0
+    for teval in solver.stat_eval.temporal_evals:
+        if not hasattr(teval.builder,'estimate_memory'): continue
+        channel_names = teval.colorspace.channel_names() if image.size(1) == 3 else ('',)
+        temps = []
+        for cname in channel_names:
+            (kept,temp) = teval.builder.estimate_memory(image.size(),element_size=image.element_size(),
+                                                        make_crossscale=teval.builder_crossscale,colorname=cname,
+                                                        components=teval.pyramid_components())
+            pyramids += 2*kept       # the images plus their gradients during the backward pass
+            temps.append(temp)
+        # channels built together as a batch need their temporary spectra at the same time
+        transient = max(transient,sum(temps) if hasattr(teval.builder,'build_spyramid_channels') else max(temps))
+    if checkpointing:
+        statimages = max(recorder.group_bytes.values(),default=0)   # only one group's images are recomputed at a time
+    else:
+        statimages = recorder.total_bytes
+    return MemoryEstimate(fixed,optimizer,target,pyramids,statimages,transient,scale)
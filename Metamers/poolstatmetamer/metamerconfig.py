@@ -33,33 +33,103 @@ import gc
 import poolingregions as pool
 import spyramid as sp
 import imageblends as blend
+import outputsinks
 from metamersolver import make_solver, MetamerImage
 from gazewarp import gaze_warp_image, gaze_unwarp_image, WarpParams
-from image_utils import load_image_gray, load_image_rgb, plot_image, LoadMovie, LoadMovieGray, LoadFrames, show_image, save_image
+from image_utils import load_image_gray, load_image_rgb, LoadMovie, LoadMovieGray, LoadFrames, show_image
 
 
 #---------- Some simple methods for generating seed images for the metamer solver-------------------
-def seed_random(target,metamer_prior_frames=None,backup=None):
+def seed_random(target,metamer_prior_frames=None,backup=None,target_prior_frames=None):
     return torch.rand_like(target)  # Seed with tensor of random numbers in range [0,1)
 
-def seed_prior_frame(target,metamer_prior_frames=None,backup=None):
+def seed_prior_frame(target,metamer_prior_frames=None,backup=None,target_prior_frames=None):
     if (metamer_prior_frames is not None) and (len(metamer_prior_frames)>=1): 
         return metamer_prior_frames[0]            # return previous metamer image as the seed if available
     if backup is not None: return backup(target)  # next try the backup seed method if available
     return torch.rand_like(target)                # otherwise use a random noise image
 
-def seed_const_half(target,metamer_prior_frames=None,backup=None):
+# Uses the previous metamer frame warped by the estimated motion between the previous and current target frames
+def seed_motion_compensated(target,metamer_prior_frames=None,backup=None,target_prior_frames=None):
+    if (metamer_prior_frames is None) or (len(metamer_prior_frames)<1) or (target_prior_frames is None) or (len(target_prior_frames)<1):
+        return seed_prior_frame(target,metamer_prior_frames,backup)   # cannot estimate motion without the prior frames
+    prev_metamer = metamer_prior_frames[0]
+    if prev_metamer.shape[-2:] != target.shape[-2:]:   # eg the prior metamer was cropped by size conditioning
+        return seed_prior_frame(target,metamer_prior_frames,backup)
+    motion = estimate_block_motion(target_prior_frames[0],target)
+    if prev_metamer.dim()==3: 
+        return warp_by_motion(prev_metamer.unsqueeze(0),motion.to(prev_metamer.device)).squeeze(0)
+    return warp_by_motion(prev_metamer,motion.to(prev_metamer.device))
+
+def seed_const_half(target,metamer_prior_frames=None,backup=None,target_prior_frames=None):
     return 0.5*torch.ones_like(target)   # Use a constant gray image as the seed
 
-def seed_const_zero(target,metamer_prior_frames=None,backup=None):
+def seed_const_zero(target,metamer_prior_frames=None,backup=None,target_prior_frames=None):
     return torch.zeros_like(target)   # Use a constant black image as the seed
 
-def seed_rotate180(target,metamer_prior_frames=None,backup=None):
+def seed_rotate180(target,metamer_prior_frames=None,backup=None,target_prior_frames=None):
     return torch.flip(target,(-1,-2))  #flip target image horizontally and vertically (equivalent to 180 rotation)
 
-def seed_copy_target(target,metamer_prior_frames=None,backup=None):
+def seed_copy_target(target,metamer_prior_frames=None,backup=None,target_prior_frames=None):
     return target  #copies original image
 
+# Resamples image at positions offset by a per-pixel motion field (1x2xHxW tensor of x,y offsets in pixels)
+def warp_by_motion(image,motion):
+    (height,width) = image.shape[-2:]
+    ys = torch.arange(height,dtype=image.dtype,device=image.device).view(1,height,1)
+    xs = torch.arange(width,dtype=image.dtype,device=image.device).view(1,1,width)
+    # convert to pytorch's normalized coordinates (in range [-1,1] with align_corners=False)
+    gx = (2*(xs + motion[:,0]) + 1)/width - 1
+    gy = (2*(ys + motion[:,1]) + 1)/height - 1
+    grid = torch.stack((gx,gy),-1).expand(image.size(0),-1,-1,-1)
+    return torch.nn.functional.grid_sample(image,grid,mode='bilinear',padding_mode='border',align_corners=False)
+
+# Estimates dense motion between two frames using coarse-to-fine block matching on a lowpass (box-filtered) pyramid
+# Computed on the cpu since it is small compared to the solver.  Returns a 1x2xHxW motion field in pixels
+# such that current(p) ~= previous(p + motion(p)), which can be applied with warp_by_motion()
+def estimate_block_motion(previous,current,block_size=8,search_radius=2,max_levels=4):
+    prev = previous.detach().cpu().float()
+    cur = current.detach().cpu().float()
+    if prev.dim()==3: prev = prev.unsqueeze(0)
+    if cur.dim()==3: cur = cur.unsqueeze(0)
+    prev = prev[:1].mean(1,keepdim=True)   # match on luminance only
+    cur = cur[:1].mean(1,keepdim=True)
+    (height,width) = cur.shape[-2:]
+    # build lowpass pyramids (stop once the image is only a few blocks in size)
+    prevpyr = [prev]
+    curpyr = [cur]
+    while (len(curpyr) < max_levels) and (min(curpyr[-1].shape[-2:]) >= 4*block_size):
+        prevpyr.append(torch.nn.functional.avg_pool2d(prevpyr[-1],2,ceil_mode=True))
+        curpyr.append(torch.nn.functional.avg_pool2d(curpyr[-1],2,ceil_mode=True))
+    def blocks_to_pixels(blockmotion,size):
+        return blockmotion.repeat_interleave(block_size,-2).repeat_interleave(block_size,-1)[...,:size[0],:size[1]]
+    motion = None
+    for prev_l,cur_l in zip(reversed(prevpyr),reversed(curpyr)):
+        size = cur_l.shape[-2:]
+        blockgrid = (math.ceil(size[0]/block_size),math.ceil(size[1]/block_size))
+        if motion is None:
+            motion = torch.zeros(1,2,*blockgrid)
+        else:
+            motion = 2*torch.nn.functional.interpolate(motion,size=blockgrid,mode='nearest')  # refine estimate from coarser level
+        best_err = None
+        best_motion = motion
+        for dy in range(-search_radius,search_radius+1):
+            for dx in range(-search_radius,search_radius+1):
+                candidate = motion + torch.tensor([dx,dy],dtype=motion.dtype).view(1,2,1,1)
+                warped = warp_by_motion(prev_l,blocks_to_pixels(candidate,size))
+                err = torch.nn.functional.avg_pool2d((warped-cur_l).abs(),block_size,ceil_mode=True)  # mean absolute error per block
+                if best_err is None:
+                    best_err = err
+                    best_motion = candidate
+                else:
+                    better = err < best_err
+                    best_err = torch.where(better,err,best_err)
+                    best_motion = torch.where(better,candidate,best_motion)
+        motion = best_motion
+    # smoothly interpolate the per-block motion to get a per-pixel motion field
+    motion = torch.nn.functional.interpolate(motion,scale_factor=block_size,mode='bilinear',align_corners=False)
+    return motion[...,:height,:width]
+
 # MetamerConfig class wraps the metamersolver interface to make it more easily configurable while
 # also integrating some ease-of-use and sanity-check improvements.  You can instantiate MetamerConfig or
 # lists of MetamerConfigs and apply them to images or video sequences.
@@ -81,7 +151,9 @@ class MetamerConfig():
                  temporal_mode=None,
                  warping=None,
                  stat_modes=None,
-                 solver_kwargs=None, solver_modes=None):
+                 solver_kwargs=None, solver_modes=None,
+                 device=None,
+                 output_sink=None):
         super().__init__()
         self.suffix = suffix
         self.stat_params = stats
@@ -103,11 +175,27 @@ class MetamerConfig():
         if solver_modes is not None: self.solver_modes.update(solver_modes)
         self.solver_kwargs = {}
         if solver_kwargs is not None: self.solver_kwargs.update(solver_kwargs)
+        if self.warp_params is not None and self.solver_kwargs.get('size_conditioning') == 'crop':
+            raise ValueError('Warped metamers cannot use crop size conditioning (unwarping needs the full warped image), use pad instead')
         self.pooling_kwargs = {}    # Extra arguments to be passed to pooling generation
         self.stat_modes = {}        # Extra options to be set/changed in the statistics evaluation
         if stat_modes is not None: self.stat_modes.update(stat_modes)
+        self.output_sink = output_sink          # Receives all output images (see outputsinks), None means write png files
+        self.device = device                    # Device for the whole pipeline (None means use gpu if available and enabled by use_gpu_if_available)
         self.max_prior_frames_used = None       # Will be set automatically when solver is created
+        self._solver_cache = None               # Optional (key,pooling,copymask,solver) tuple reused for frames with the same geometry
                 
+    # Returns the device on which the images are warped, solved, unwarped, and blended (only final outputs are copied back to the cpu)
+    def get_device(self):
+        if self.device is not None: return torch.device(self.device)
+        if self.solver_modes.get('use_gpu_if_available',True) and torch.cuda.is_available(): return torch.device('cuda')
+        return torch.device('cpu')
+        
+    # Returns the sink to which all output images are sent
+    def get_output_sink(self):
+        if self.output_sink is None: return outputsinks.PngSink()
+        return self.output_sink
+        
     # Combines explicit option with configuration settings to get the PoolingParams object to use
     def _get_pooling_params(self,pooling_sizes):
         if self.pooling_params is not None:
@@ -143,6 +231,8 @@ class MetamerConfig():
         for mode,value in self.solver_modes.items():
             solver.set_mode(mode,value)
         solver.set_mode('save_image',outfile)
+        solver.set_mode('output_sink',self.get_output_sink())
+        solver.set_mode('device',self.get_device())
         solver.set_output_directory(outdir)
         self.max_prior_frames_used = solver.get_statistics_evaluator().max_prior_frames_used()
         
@@ -192,24 +282,33 @@ class MetamerConfig():
     def generate_image_metamer(self,target_image,pooling_sizes=None,seed_image=None,max_iters=10,outfile='pmetamer.png',
                              outdir=None,randseed=None,
                              gaze_point=None,
-                             target_prior_frames = (), metamer_prior_frames = ()):
+                             target_prior_frames = (), metamer_prior_frames = (), prior_frame_ids = None,
+                             reuse_solver=False):
         if outdir is None: outdir = self.DEFAULT_OUTPUT_DIR
         outpath = os.path.expanduser(outdir)  #expand ~ or ~user to the user's home directory
         # if a randseed was provided, use it 
         if randseed is None: randseed = self.randseed    # method parameter seed takes precedence otherwise use solver's seed
         if randseed is not None: torch.manual_seed(randseed)   # Setting the seed makes it (mostly) deterministic. Gpu scheduling can make it not fully deterministic
+        # move all inputs to the pipeline's device once, everything after this stays there
+        device = self.get_device()
+        target_image = target_image.to(device)
+        target_prior_frames = [f.to(device) for f in target_prior_frames]
+        metamer_prior_frames = [f.to(device) for f in metamer_prior_frames]
+        if torch.is_tensor(seed_image): seed_image = seed_image.to(device)
         # create seed image according to inputs (or use default method if not specified)
         if self.copy_original_exactly:  
             seed_image = target_image  #modify parameters to output will just be a copy of the original
         elif callable(seed_image): #if seed_image is a generator method then call it to generate the seed_image
-            seed_image = seed_image(target_image,metamer_prior_frames=metamer_prior_frames,backup=self.default_metamer_seed)
+            seed_image = seed_image(target_image,metamer_prior_frames=metamer_prior_frames,backup=self.default_metamer_seed,
+                                    target_prior_frames=target_prior_frames)
         elif seed_image is None:   # otherwise use the solver's seed generation method
-            seed_image = self.default_metamer_seed(target_image,metamer_prior_frames=metamer_prior_frames)
+            seed_image = self.default_metamer_seed(target_image,metamer_prior_frames=metamer_prior_frames,target_prior_frames=target_prior_frames)
         if seed_image is target_image:
             max_iters = -1  # if seed and target image the same, no need for iterations
         # don't give solver previous metamer frames unless we are also giving it the previous target frames
         if len(target_prior_frames)==0: 
             metamer_prior_frames = ()  
+            prior_frame_ids = None
         needs_unwarp = False
         copymask = False
         if self.warp_params is not None:
@@ -218,39 +317,113 @@ class MetamerConfig():
                 raise ValueError(f'Warped metamers should use wrap_x boundary mode for their pyramid, instead got {self.pyramid_params}')
             self.warp_params.suggest_pooling_params(self._get_pooling_params(pooling_sizes))
             orig_target = target_image
-            target_image,warpcopymask = gaze_warp_image(target_image,self.warp_params,gaze_point)
-            seed_image = gaze_warp_image(seed_image,self.warp_params,gaze_point,make_mask=False)
+            target_image,warpcopymask = gaze_warp_image(target_image,self.warp_params,gaze_point,device=device)
+            seed_image = gaze_warp_image(seed_image,self.warp_params,gaze_point,make_mask=False,device=device)
             needs_unwarp = True
             if warpcopymask is not None: copymask = warpcopymask | copymask
             #TODO: BW: should we set a small copy region here to help the metamer align with the foveal region for later blending????
         
-        # Create the pooling-regions and copy-pixels-mask 
-        (pooling,poolcopymask) = self._create_pooling(pooling_sizes,target_image,gaze_point)
-        if poolcopymask is not None: copymask = poolcopymask | copymask
-        # Create the metamer solver
-        solver = self._create_solver(target_image,pooling, outfile,outdir=outpath) 
+        # Warped results are saved after unwarping (below) rather than by the solver
+        solver_outfile = None if needs_unwarp else outfile
+        # Create the pooling-regions, copy-pixels-mask, and metamer solver.  When reuse_solver is set (eg for movie frames)
+        # and the size, pooling, and gaze are unchanged, then the previously built objects (filters, kernels, evaluator) are reused 
+        cache_key = (tuple(target_image.size()),str(pooling_sizes),gaze_point,outpath)
+        if reuse_solver and (self._solver_cache is not None) and (self._solver_cache[0] == cache_key):
+            (_,pooling,poolcopymask,solver) = self._solver_cache
+            solver.set_mode('save_image',solver_outfile)   # only the output filename changes between frames
+        else:
+            (pooling,poolcopymask) = self._create_pooling(pooling_sizes,target_image,gaze_point)
+            solver = self._create_solver(target_image,pooling, solver_outfile,outdir=outpath) 
+            self._solver_cache = (cache_key,pooling,poolcopymask,solver) if reuse_solver else None
+        if poolcopymask is not None: copymask = poolcopymask.to(device) | copymask
+        # Only give the solver as many prior frames as its statistics use (extra frames may have been kept for seeding)
+        target_prior_frames = target_prior_frames[:self.max_prior_frames_used]
+        metamer_prior_frames = metamer_prior_frames[:self.max_prior_frames_used]
+        if prior_frame_ids is not None: prior_frame_ids = prior_frame_ids[:self.max_prior_frames_used]
+        if len(target_prior_frames)==0: prior_frame_ids = None
             
         # Compute our own metamer starting from precomputed metamer
-        res = solver.solve_for_metamer(target_image,max_iters,seed_image,copy_target_mask=copymask,target_prior_frames=target_prior_frames,metamer_prior_frames=metamer_prior_frames)
+        res = solver.solve_for_metamer(target_image,max_iters,seed_image,copy_target_mask=copymask,target_prior_frames=target_prior_frames,metamer_prior_frames=metamer_prior_frames,
+                                       prior_frame_ids=prior_frame_ids)
         if needs_unwarp:
-            unwarped = gaze_unwarp_image(res.get_image(),orig_target,self.warp_params,gaze_point)
-            plot_image(target_image,title='warped original')
-            plot_image(res.get_image(),title='warped metamer')
-            plot_image(unwarped,title='unwarped metamer')
+            sink = self.get_output_sink()
+            warped_metamer = res.clone_image()
+            unwarped = gaze_unwarp_image(warped_metamer,orig_target,self.warp_params,gaze_point,device=device)
+            if sink.show_plots:
+                sink.plot_image(target_image,title='warped original')
+                sink.plot_image(warped_metamer,title='warped metamer')
+                sink.plot_image(unwarped,title='unwarped metamer')
             res = MetamerImage(unwarped)
-            # TODO: the following is a bit of hack to store unwarped output, should better integrate warping into metamersolver somehow
             if outfile is not None:
-                savefile = os.path.join(outpath,outfile)
-                os.replace(savefile,savefile+'.warped.png')
+                if sink.save_intermediates: sink.write_image(warped_metamer,outfile+'.warped.png',outpath)
                 if max_iters >= 0:
-                    save_image(unwarped,savefile)
+                    sink.write_image(unwarped,outfile,outpath)
                 else:
-                    save_image(unwarped,savefile+'.unwarped.png')
-                    save_image(orig_target,savefile)
+                    sink.write_image(unwarped,outfile+'.unwarped.png',outpath)
+                    sink.write_image(orig_target,outfile,outpath)
             #Should we wrap this in a MetamerImage object?  Provide access to the warped version?
         return res
     
+    # Generates metamers of one image for several gaze points at once (requires gaze warping).  The target is warped to all the
+    # gaze points as a single batch, the warped metamers (which share the same warped size) are solved together, and then
+    # unwarped as a batch.  Returns a list of MetamerImages, one per gaze point, and output files get a _gaze# suffix
+    def generate_multigaze_metamers(self,target_image,gaze_points,pooling_sizes=None,seed_image=None,max_iters=10,outfile='pmetamer.png',
+                                    outdir=None,randseed=None):
+        if self.warp_params is None: raise ValueError('Multi-gaze metamers require gaze warping (see the warping parameter)')
+        if sp.SPyramidParams.union(self.pyramid_params).boundary_mode.lower() != 'wrap_x':
+            raise ValueError(f'Warped metamers should use wrap_x boundary mode for their pyramid, instead got {self.pyramid_params}')
+        # The gaze points are solved as one batch with a single pooling, so it must not depend on the gaze point (gaze-centric
+        # pooling with several sizes does, while in warped images uniform pooling already scales with eccentricity)
+        sizes = [pooling_sizes] if isinstance(pooling_sizes,(int,float)) else pooling_sizes
+        if (self.pooling_params is None) and (not self.copy_original_exactly) and (sizes is not None) and (len(sizes) > 1):
+            raise ValueError(f'Multi-gaze metamers require the same pooling for every gaze point, but got gaze-centric pooling sizes {pooling_sizes}')
+        if outdir is None: outdir = self.DEFAULT_OUTPUT_DIR
+        outpath = os.path.expanduser(outdir)  #expand ~ or ~user to the user's home directory
+        if randseed is None: randseed = self.randseed
+        if randseed is not None: torch.manual_seed(randseed)
+        if target_image.dim()==3: target_image = target_image.unsqueeze(0)
+        device = self.get_device()
+        target_image = target_image.to(device)
+        if torch.is_tensor(seed_image): seed_image = seed_image.to(device)
+        gaze_points = list(gaze_points)
+        # create seed images (one per gaze point)
+        batch_target = target_image.expand(len(gaze_points),-1,-1,-1)
+        if self.copy_original_exactly:  
+            seed_image = batch_target
+        elif callable(seed_image):
+            seed_image = seed_image(batch_target,backup=self.default_metamer_seed)
+        elif seed_image is None:
+            seed_image = self.default_metamer_seed(batch_target)
+        if seed_image is batch_target:
+            max_iters = -1  # if seed and target image the same, no need for iterations
+        # warp to all the gaze points as a batch
+        self.warp_params.suggest_pooling_params(self._get_pooling_params(pooling_sizes))
+        warped_target,copymask = gaze_warp_image(target_image,self.warp_params,gaze_points,device=device)
+        warped_seed = gaze_warp_image(seed_image,self.warp_params,gaze_points,make_mask=False,device=device)
+        (pooling,poolcopymask) = self._create_pooling(pooling_sizes,warped_target,None)
+        if poolcopymask is not None: copymask = poolcopymask.to(device) | copymask
+        solver = self._create_solver(warped_target,pooling,None,outdir=outpath)  # results are saved per gaze point below
+        res = solver.solve_for_metamer(warped_target,max_iters,warped_seed,copy_target_mask=copymask)
+        unwarped = gaze_unwarp_image(res.clone_image(),target_image,self.warp_params,gaze_points,device=device)
+        results = []
+        for k in range(len(gaze_points)):
+            image = unwarped.narrow(0,k,1)
+            met = MetamerImage(image)
+            met.loss_value = res.loss_value    # loss is for the combined solve of all gaze points
+            results.append(met)
+            if outfile is not None:
+                (base,ext) = os.path.splitext(outfile)
+                gazefile = f'{base}_gaze{k}{ext}'
+                if max_iters >= 0:
+                    self.get_output_sink().write_image(image,gazefile,outpath)
+                else:   # copying the original, so write it rather than its (slightly blurred) warped and unwarped version
+                    self.get_output_sink().write_image(image,gazefile+'.unwarped.png',outpath)
+                    self.get_output_sink().write_image(target_image,gazefile,outpath)
+        return results
+    
     # generate metamer of a movie (specified as a list of source frames)
+    #  use_prior_as_seed can be True (seed with previous metamer frame), 'motion' (previous metamer frame warped 
+    #  by the estimated motion between target frames), or False (use the default seed for every frame)
     def generate_movie_metamer(self,source_generator,pooling_size,max_iters=500,gaze_point=None,
                    outbasename='pmetamer', outdir=None,
                    framerate=None, target_modifier=None,
@@ -264,30 +437,34 @@ class MetamerConfig():
         # no previous frame for the first frame
         target_prior_frames = []
         metamer_prior_frames = []
+        prior_frame_ids = []        # frame numbers of the prior frames (used as keys for caching their pyramids and statistics)
         seed_image = None
-        if use_prior_as_seed:
+        if use_prior_as_seed == 'motion':
+            seed_image = seed_motion_compensated   #use motion-compensated prior frame as seed
+        elif use_prior_as_seed:
             seed_image = seed_prior_frame    #use prior frame as seed
+        self._solver_cache = None   # frames share one solver (built on the first frame and reused for the rest)
         for framenum,target_image in enumerate(source_generator):
             outfile = f'{outbasename}_frame{framenum:03d}.png'
             if outbasename is None: outfile=None
             if target_modifier: target_image = target_modifier(target_image)
-            if self.use_movie_warping:
-                target_image_original = target_image
-                target_image = gaze_warp_image(target_image)
-                outfile_unwarped = outfile
-                outfile=None
 #            print(f"target {target_image.size()} prev {target_prev_image.size() if target_prev_image!=None else None}")
 #            print(f"prior frames {len(target_prior_frames)}")
-            # generate the metamer for this frame
+            # generate the metamer for this frame (gaze warping, if any, is handled within generate_image_metamer)
             res = self.generate_image_metamer(target_image,pooling_size,seed_image=seed_image,max_iters=max_iters,
                                      gaze_point=gaze_point,outfile=outfile,outdir=outpath,
-                                     target_prior_frames=target_prior_frames,metamer_prior_frames=metamer_prior_frames)
-            # prepend new images to list of prior frames (and truncate list if needed)
-            if self.max_prior_frames_used > 0:
-                target_prior_frames = [target_image, *target_prior_frames[0:self.max_prior_frames_used-1]]
-                metamer_prior_frames = [res.get_image(), *metamer_prior_frames[0:self.max_prior_frames_used-1]]
+                                     target_prior_frames=target_prior_frames,metamer_prior_frames=metamer_prior_frames,
+                                     prior_frame_ids=prior_frame_ids,reuse_solver=True)
+            # prepend new images to list of prior frames (and truncate list if needed), motion seeding needs at least one prior frame
+            history = max(self.max_prior_frames_used, 1 if use_prior_as_seed == 'motion' else 0)
+            if history > 0:
+                target_prior_frames = [target_image, *target_prior_frames[0:history-1]]
+                metamer_prior_frames = [res.clone_image(), *metamer_prior_frames[0:history-1]]  # keep on the device for the next frame
+                prior_frame_ids = [framenum, *prior_frame_ids[0:history-1]]
         
-        if outbasename is not None:
+        if self._solver_cache is not None: self._solver_cache[3].get_statistics_evaluator().clear_frame_cache()
+        self._solver_cache = None   # release the solver (and any memory it holds) once the movie is done
+        if (outbasename is not None) and isinstance(self.get_output_sink(),outputsinks.PngSink):  # movie needs the frames as png files
             blend.compile_frames_to_mp4(inputpattern=f'{outpath}/{outbasename}_frame%03d.png',outputfilename=f'{outpath}/{outbasename}_movie.mp4',framerate=framerate)
         print('finished movie generation')
         
@@ -295,6 +472,7 @@ class MetamerConfig():
 
 # Generate image metamers for a specified image according schedule of configurations
 # The schedule can be a single MetamerConfig or a list of them
+# gaze_point can also be a list of gaze points (for warped configurations), which are then generated together as a batch
 def generate_image_schedule(target,config_schedule,pooling_sizes=None,color=False,seed_image=None,max_iters=10,basename='pmetamer',
                              target_modifier=None, randseed=None, gaze_point=None):
     # Load a original image 
@@ -315,7 +493,10 @@ def generate_image_schedule(target,config_schedule,pooling_sizes=None,color=Fals
         gc.collect()   #We can use a lot of memory, try to make sure as much is free as possible before starting
         suffix = config.update_namesuffix(suffix)
         if basename is not None: outfile = basename+suffix+".png"
-        config.generate_image_metamer(target_image,pooling_sizes,seed_image,max_iters=max_iters,outfile=outfile,gaze_point=gaze_point)
+        if isinstance(gaze_point,list):
+            config.generate_multigaze_metamers(target_image,gaze_point,pooling_sizes,seed_image,max_iters=max_iters,outfile=outfile)
+        else:
+            config.generate_image_metamer(target_image,pooling_sizes,seed_image,max_iters=max_iters,outfile=outfile,gaze_point=gaze_point)
     print('finished metamer generation schedule')
     
 # generate metamer of a movie (specified as a list of source frames)
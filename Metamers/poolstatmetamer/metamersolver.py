@@ -32,12 +32,16 @@ import metamerstateval as meval
 import poolingregions as pool
 import imageblends as blend
 import metamerstatgroups
+import outputsinks
+import profiling
+import memoryestimate
+from compactlbfgs import CompactLBFGS
+from sizeconditioning import SizeConditioner
 import os
 import math
 import time
 import tempfile
 import contextlib
-import matplotlib.pyplot as plt
 from image_utils import plot_image, save_image, load_image_gray, load_image_rgb, plot_images
 try:
     import temporalstatistics 
@@ -83,14 +87,22 @@ class MetamerImage(torch.nn.Module):
         self.learned = torch.nn.Parameter(seed_image)   # Making it a parameter marks it as learnable
         self.learned.requires_grad_()                   # Metamer image is what we are trying to learn so we need its gradients
         self.frozen_mask = None                         # Optional mask indicating parts which are not subject to training
+        self.packed = None                              # Optional vector of just the trainable (non-frozen) pixels, see pack_trainable_pixels_()
+        self.packed_mask = None                         # Mask of the pixels stored in the packed vector
         # Some related data that can optionally be computed
         self.loss_value = math.nan                      # Loss value (or NaN if not yet computed)
+        self.loss_history = None                        # Loss values at each step of the solve that produced this image
         self.pooling_loss_image = None                  # Tensor with per-region pooling summed loss/error (or none if not computed)
         self.blame_image = None                         # Image the approximate local loss/error per pixel (or none if not computed)
         self.statgroup_loss_images = None               # Dictionary mapping StatGroups to group-keys to their loss images
+        self.stage_profile = None                       # Solver stage timings (if profiling was enabled in the solver)
+        self.statistic_costs = None                     # Per statistic category&level costs (if requested from the solver)
+        self.memory_usage = None                        # Estimated and actual peak memory usage (if requested from the solver)
+        self.size_conditioner = None                    # If the image was padded or cropped for the solve, converts it back for output
         
     # Copy the specified pixels from the target image and force their gradients to be zero so optimizer will not modify them
     def copy_and_freeze_pixels_(self,target_image,copy_mask):
+        self.unpack_trainable_pixels_()
         with torch.no_grad():
             self.learned.copy_(torch.where(copy_mask,target_image,self.learned))
         #plot_image(self.learned)
@@ -98,24 +110,48 @@ class MetamerImage(torch.nn.Module):
         
     # Mark some pixels in metamer image as unchangeable (frozen) so optimizer cannot modify them
     def set_frozen_mask(self,freeze_mask):
+        self.unpack_trainable_pixels_()
         self.frozen_mask = torch.nn.Parameter(freeze_mask,requires_grad=False)       
         
+    # Replace the trainable image by a packed vector of only its non-frozen pixels, which forward() scatters back into the image.
+    # The optimizer then only sees the free pixels, so its history memory and vector operations scale with their number
+    # (rather than storing and updating the frozen pixels and zeroing their gradients).  Does nothing if no pixels are frozen.
+    def pack_trainable_pixels_(self):
+        if self.frozen_mask is None or self.packed is not None: return
+        self.packed_mask = torch.nn.Parameter(~self.frozen_mask,requires_grad=False)
+        self.packed = torch.nn.Parameter(self.learned.detach().masked_select(self.packed_mask))
+        self.learned.requires_grad_(False)   # the full image now just holds the frozen pixels' values
+        
+    # Undo pack_trainable_pixels_() so the whole image is trainable again (eg before changing the frozen pixels)
+    def unpack_trainable_pixels_(self):
+        if self.packed is None: return
+        with torch.no_grad():
+            self.learned.copy_(MetamerImage.forward(self))   # (subclasses may transform the learned image in their forward)
+        self.learned.requires_grad_()
+        self.packed = None
+        self.packed_mask = None
+        
+    # The tensor being trained: the packed vector of free pixels (if packed) or else the whole learned image
+    def trainable_tensor(self):
+        return self.packed if self.packed is not None else self.learned
+        
     # Return a representation of the current state of this object
     def _get_current_state_copy(self):
-        return self.clone_image()
+        return self.trainable_tensor().detach().clone()
     
     def _set_current_state(self,prior_state):
         with torch.no_grad():
-            self.learned.copy_(prior_state)
+            self.trainable_tensor().copy_(prior_state)
     
     # Blend the current state with a prior state (from get_current_state_copy)
     def _blend_with_prior_state(self,prior_state,fraction):
         with torch.no_grad():
-            self.learned.lerp_(prior_state, fraction)
+            self.trainable_tensor().lerp_(prior_state, fraction)
         
     # Get a copy of the current metamer estimate suitable for visualization or saving (has no gradients and is on cpu)
     def get_image(self):
         image = self()
+        if self.size_conditioner is not None: image = self.size_conditioner.restore(image)  # back to the original image size
         if image.is_cuda:
             return image.detach().cpu()
         else:
@@ -123,11 +159,14 @@ class MetamerImage(torch.nn.Module):
         
     # Get a copy of current metamer estimate suitable for input to later iterations (no gradients but may not on gpu or cpu)
     def clone_image(self):
-        return self().detach().clone();   # Make a copy on same device that does not affect gradients
+        image = self()
+        if self.size_conditioner is not None: image = self.size_conditioner.restore(image)  # back to the original image size
+        return image.detach().clone();   # Make a copy on same device that does not affect gradients
         
     # Get a copy of the current gradient image suitable for visualization or saving 
     def get_gradient_image(self):
         image = self.learned.grad
+        if self.packed is not None: image = torch.zeros_like(self.learned).masked_scatter(self.packed_mask,self.packed.grad)
         if image.is_cuda:
             return image.detach().cpu()
         else:
@@ -179,25 +218,37 @@ class MetamerImage(torch.nn.Module):
     def set_statgroup_loss_images(self,statgroupdict):
         self.statgroup_loss_images = statgroupdict
         
+    # Convert a limit (None, a constant, or a list of per-channel values) to a form that can be compared with the trainable tensor
+    def _trainable_limit(self,limit):
+        if type(limit) is not list: return limit
+        image = self.learned
+        limit = torch.tensor(limit,dtype=image.dtype,device=image.device).view(-1,1,1).expand(image.shape)
+        if self.packed is not None: limit = limit.masked_select(self.packed_mask)
+        return limit
+        
     # Clamp current learned image to be no less than min and no more than max
     def clamp_range_(self,lower_limit,upper_limit):
         if (lower_limit is not None) or (upper_limit is not None): 
             with torch.no_grad():
+                img = self.trainable_tensor()
                 # Check if limits are lists (per-channel values) or constants (same across all channels)
                 if (type(lower_limit) is list) or (type(upper_limit) is list):
-                    for i in range(self.learned.size(-3)):
-                        self.learned.narrow(-3,i,1).clamp_(min=lower_limit[i],max=upper_limit[i])                    
+                    lower = self._trainable_limit(lower_limit)
+                    upper = self._trainable_limit(upper_limit)
+                    if lower is not None: img.copy_(torch.max(img,torch.as_tensor(lower,dtype=img.dtype,device=img.device)))
+                    if upper is not None: img.copy_(torch.min(img,torch.as_tensor(upper,dtype=img.dtype,device=img.device)))
                 else:
-                    self.learned.clamp_(min=lower_limit,max=upper_limit)
+                    img.clamp_(min=lower_limit,max=upper_limit)
 
     # Filter gradients for pixels with values at the lower or upper limits if gradient descent would lead to 
     # violating those limits and for pixels which have been marked as non-modifiable (ie non-trainable or constant)
     def clamp_range_gradients_(self,lower_limit,upper_limit):
+        img = self.trainable_tensor()
         # If the image is at the min limit, then clamp its gradient to be non-positive (<=0) 
         # Idea is that the minimization is allowed to increase the element (if that will reduce the loss)
         # but not decrease it (since its value would just end up being clamped to min anyway) 
         # so we set gradient to zero for that case, so optimizer will not become confused by the clamping effect
-        def clamp_at_min(img,limit):
+        def clamp_at_min(limit):
             if limit is None: return
             with torch.no_grad():
                 atmin = img.le(limit)              # Mask for tensor elements that are <= min
@@ -207,33 +258,25 @@ class MetamerImage(torch.nn.Module):
         # Enforce similar limit for pixels >= max limit
         # Set their gradient to zero if it would otherwise imply that loss could 
         # be reduced by increasing their value beyond the max limit
-        def clamp_at_max(img,limit):
+        def clamp_at_max(limit):
             if limit is None: return
             with torch.no_grad():
                 atmax = img.ge(limit)
                 maxgrad = atmax.float()*img.grad
                 badmaxgrad = maxgrad.clamp(max=0)
                 img.grad.sub_(badmaxgrad)
-        # Filter gradients for pixels <= lower_limit
-        if type(lower_limit) is list:
-            for i in range(self.learned.size(-3)):  # Apply limits to each color channel separately
-                clamp_at_min(self.learned.narrow(-3,i,1),lower_limit[i])
-        else:
-            clamp_at_min(self.learned,lower_limit)  # Apply same limit to all
-        # Filter gradients for pixels >= upper_limit
-        if type(upper_limit) is list:
-            for i in range(self.learned.size(-3)):  
-                clamp_at_max(self.learned.narrow(-3,i,1),upper_limit[i])
-        else:
-            clamp_at_max(self.learned,upper_limit)
-        # If some pixels are marked as frozen (not trainable) then set their gradients to zero
-        if self.frozen_mask is not None:
+        # Filter gradients for pixels <= lower_limit and >= upper_limit (limits may be per color channel)
+        clamp_at_min(self._trainable_limit(lower_limit))
+        clamp_at_max(self._trainable_limit(upper_limit))
+        # If some pixels are marked as frozen (not trainable) then set their gradients to zero (packed images do not contain them)
+        if self.frozen_mask is not None and self.packed is None:
             with torch.no_grad():
                 self.learned.grad.masked_fill_(self.frozen_mask,0)
 
     # Returns the current estimate metamer image for use in gradient descent learning loop (may be on GPU or other device)
     def forward(self):
-        # Metamer is just learned data "as is" here, but subclasses can override this
+        # Metamer is just learned data "as is" here (with any packed trainable pixels scattered into it), but subclasses can override this
+        if self.packed is not None: return self.learned.masked_scatter(self.packed_mask,self.packed)
         return self.learned
 
 ""#END-CLASS------------------------------------    
@@ -249,7 +292,7 @@ class LowResMetamerImage(MetamerImage):
         raise NotImplementedError("cannot copy pixels to downsampled version")
 
     def get_lowres_image(self):
-        image = self.learned
+        image = super().forward()
         if image.is_cuda:
             return image.detach().cpu()
         else:
@@ -257,7 +300,7 @@ class LowResMetamerImage(MetamerImage):
         
     # Returns the current estimate metamer image for use in gradient descent learning loop
     def forward(self):
-        return torch.nn.functional.interpolate(self.learned,scale_factor=self.scale_factor,mode='nearest')
+        return torch.nn.functional.interpolate(super().forward(),scale_factor=self.scale_factor,mode='nearest')
         # Metamer is just learned data "as is" here, but subclasses can override this
         return self.learned
     
@@ -299,6 +342,8 @@ class MetamerImageSolver(torch.nn.Module):
         self.upper_limit = None   
         # Use the gpu for computations if it is available
         self.use_gpu_if_available = True
+        # Explicit device to use for computations (overrides use_gpu_if_available if not None)
+        self.device = None
         # We scale up the loss to avoid problems with low thresholds in the optimizer
         self.loss_scalefactor = 1e3
         # Some optional outputs that can be returned with(in) the metamer image
@@ -321,6 +366,18 @@ class MetamerImageSolver(torch.nn.Module):
         self.print_category_loss_images = False
         self.print_blame_image = False
         self.print_gpu_memory = False
+        self.print_stage_profile = False      # Time the solver stages (pyramids, statistics, pooling, loss, backward) and print a breakdown
+        self.save_stage_profile = False       # Also write the stage timings as json and chrome-trace files next to the output image
+        self.print_statistic_costs = False    # Print estimated flops, memory traffic, time, and loss contribution for each statistic category&level
+        self.print_memory_estimate = False    # Print the predicted peak memory before optimizing (and the actual peak afterwards on cuda devices)
+        self.memory_budget = None             # Memory budget in GB.  If the predicted peak exceeds it, checkpointing is enabled, then the L-BFGS history is stored as bfloat16
+                                              # (unless lbfgs_history_dtype was set), and only then are history pairs dropped (a shorter history can slow convergence)
+        self.memory_estimate_scale = 1.0      # Calibration multiplier for the predicted peak (eg the ratio of actual to predicted from an earlier run)
+        self.checkpoint_statistics = False    # Recompute the statistic images during the backward pass instead of storing them (saves memory but costs time)
+        self.lbfgs_history_dtype = None       # Store the L-BFGS history in a compact format (eg 'bfloat16'), the updates are still computed in float32
+        self.lbfgs_history_device = None      # Store the L-BFGS history on another device (eg 'cpu' to offload it from the gpu into pinned memory)
+        self.pack_trainable_pixels = True     # Optimize only the non-frozen pixels (eg not the copied gaze regions) as a packed vector (saves optimizer memory and time)
+        self.size_conditioner = None          # Pads or crops images to a downsampling-friendly size for the solve (see sizeconditioning and make_solver)
         self.save_image = False
         self.save_convergence_movie = False
         self.save_convergence_graph = False
@@ -336,7 +393,9 @@ class MetamerImageSolver(torch.nn.Module):
         self.step_print_gpu_memory = False
         self.step_save_image = False
         self.output_directory = ''
+        self.output_sink = None     # Where saved images are sent (see outputsinks), None means write png files to output_directory
         self.statlabel_callback = None
+        self._solve_count = 0     # Number of solves performed (used to generate unique keys for cached prior frames)
         
     # A generic method to set an attribute but only if it already exists
     def set_mode(self,attr,value):
@@ -353,6 +412,63 @@ class MetamerImageSolver(torch.nn.Module):
         
     def get_statistics_evaluator(self):
         return self.stat_eval
+    
+    # Predict peak memory use and (if there is a memory budget) choose checkpointing, the L-BFGS history format, and its size so it fits
+    #  recorder is the StatImageSizeRecorder used while computing the target statistics
+    #  Returns (memory usage,optimizer) since a bfloat16 history may require replacing the optimizer (it has not taken any steps yet)
+    def _fit_memory_budget(self,recorder,target_stats,optimizer):
+        group = optimizer.param_groups[0]
+        checkpointing = self.checkpoint_statistics
+        history_size = group['history_size']
+        history_element_size = initial_element_size = getattr(optimizer,'device_history_element_size',4)   # bytes per history element in device memory
+        def estimate():
+            return memoryestimate.estimate_solver_memory(self,recorder,target_stats,history_size=group['history_size'],
+                                                         history_element_size=history_element_size,
+                                                         checkpointing=checkpointing,scale=self.memory_estimate_scale)
+        est = estimate()
+        if self.memory_budget is not None:
+            budget = self.memory_budget*2**30
+            if est.total > budget and not checkpointing:
+                checkpointing = True
+                est = estimate()
+            # A bfloat16 history halves its memory but keeps all its pairs, so try it before shortening the history
+            if est.total > budget and history_element_size > 2 and self.lbfgs_history_dtype is None:
+                if isinstance(optimizer,CompactLBFGS):
+                    optimizer.history_dtype = torch.bfloat16
+                else:
+                    optimizer = CompactLBFGS(group['params'],lr=group['lr'],max_iter=group['max_iter'],max_eval=group['max_eval'],
+                                             tolerance_grad=group['tolerance_grad'],tolerance_change=group['tolerance_change'],
+                                             history_size=group['history_size'],history_dtype=torch.bfloat16)
+                    group = optimizer.param_groups[0]
+                history_element_size = optimizer.device_history_element_size
+                est = estimate()
+            min_history = 5
+            if est.total > budget and group['history_size'] > min_history and history_element_size > 0:
+                trainable = sum(p.numel() for p in group['params'])
+                excess = (est.total - budget)/self.memory_estimate_scale
+                group['history_size'] = max(min_history,group['history_size'] - math.ceil(excess/(2*history_element_size*trainable)))
+                est = estimate()
+            if est.total > budget: print(f'Warning: predicted memory {est.total/2**30:.2f} GB exceeds the budget of {self.memory_budget} GB')
+            if checkpointing != self.checkpoint_statistics or history_element_size != initial_element_size or group['history_size'] != history_size or self.print_memory_estimate:
+                reduced = f' (reduced from {history_size}, which may slow convergence)' if group['history_size'] != history_size else ''
+                print(f'Memory budget {self.memory_budget} GB: statistic checkpointing={checkpointing} '
+                      f'L-BFGS history={group["history_size"]}{reduced} stored as {self._history_dtype(optimizer)}')
+        self.stat_eval.set_checkpointing(checkpointing)
+        if self.print_memory_estimate: print(est)
+        usage = {'estimate':est._asdict(),'estimated_peak':est.total,'checkpointing':checkpointing,'history_size':group['history_size'],
+                 'history_dtype':str(self._history_dtype(optimizer))}
+        return (usage,optimizer)
+    
+    # The floating point type of the optimizer's L-BFGS history
+    @staticmethod
+    def _history_dtype(optimizer):
+        return getattr(optimizer,'history_dtype',None) or optimizer.param_groups[0]['params'][0].dtype
+    
+    # Returns the device which will be used for the solver's computations
+    def get_device(self):
+        if self.device is not None: return torch.device(self.device)
+        if self.use_gpu_if_available and torch.cuda.is_available(): return torch.device('cuda')
+        return torch.device('cpu')
             
     def constrain_image_min(self,min_value):
         self.lower_limit = min_value
@@ -398,6 +514,13 @@ class MetamerImageSolver(torch.nn.Module):
                     lossdict[key] = lossdict.get(key,0) + err2   # Add loss to subgroup indicated by key (creating a new entry if needed)
         return result # return result dictionary which maps from statgroup to a mapping from key to summed error associated with that key
                     
+    # Measure the cost of each statistic category and level on these images and its (scaled) contribution to the loss (see statcost)
+    def statistic_cost_report(self,images,target_stats):
+        (report,stats) = self.stat_eval.measure_costs(images,self.get_device())
+        losses = self.compute_loss_groups(stats,target_stats,'category_levels')
+        report.set_losses({key:self.loss_scalefactor*float(val) for key,val in next(iter(losses.values())).items()})
+        return report
+
     def print_loss_by_groups(self,stats,target_stats,statgroups):
         res = self.compute_loss_groups(stats,target_stats,statgroups)
         for sg in res:
@@ -420,6 +543,7 @@ class MetamerImageSolver(torch.nn.Module):
                 
     # Print a graph fof the loss vs iteration (ie convergence)
     def plot_loss_convergence(self,losslist,show=True,savefile=None):
+        import matplotlib.pyplot as plt   # imported on first use so headless solves do not need to load matplotlib
         plt.figure(figsize=[6,5])
         plt.title('Loss vs iteration')
         plt.semilogy(range(len(losslist)), losslist)
@@ -445,6 +569,11 @@ class MetamerImageSolver(torch.nn.Module):
     def get_output_directory(self):
         return self.output_directory
     
+    # Get the sink which receives the solver's saved images
+    def get_output_sink(self):
+        if self.output_sink is None: return outputsinks.PngSink()
+        return self.output_sink
+    
     def forward(self):
         raise NotImplementedError("use solve method instead")
 #        return self.stat_model(self.metamer)     # Compute and return statistics image for metamer
@@ -452,29 +581,38 @@ class MetamerImageSolver(torch.nn.Module):
     # Solve for metamer of target_image using an iterative optimizer
     # This is the main metamersolver method and will automatically moved data to/from GPU if available
     def solve_for_metamer(self,target_image,max_iterations=10,seed_image=None,optimizer='LBFGS',lossfunc=None,copy_target_mask=None,
-                          target_prior_frames=[],metamer_prior_frames=[]):
+                          target_prior_frames=[],metamer_prior_frames=[],prior_frame_ids=None):
         # setup names and paths for output files
         outfilename = self.save_image                             # setup a name for the output image
         if type(outfilename)==bool: outfilename = 'result.png'
         if outfilename is None:
-            outbasename = outbasepath = outfilepath = None
+            outbasename = outbasepath = None
         else:
             outbasename = os.path.splitext(outfilename)[0]            # output name without the extension
             outbasepath = os.path.join(self.output_directory,outbasename)
-            outfilepath = os.path.join(self.output_directory,outfilename)
         # Start a timer se we can print the computation time
         timer = time.perf_counter()
         # Setup target image and initial metamer image estimate
         if target_image.dim()==3: target_image = target_image.unsqueeze(0)  # Pytorch prefers four dimensions (batchXchannelXheightXwidth)
+        conditioner = self.size_conditioner
+        if conditioner is not None:
+            # Solve at the conditioned size (the metamer image is converted back to the original size for output)
+            target_image = conditioner.condition(target_image)
+            if torch.is_tensor(seed_image): seed_image = conditioner.condition(seed_image)
+            if torch.is_tensor(copy_target_mask): copy_target_mask = conditioner.condition_mask(copy_target_mask)
+            target_prior_frames = [conditioner.condition(img) for img in target_prior_frames]
+            metamer_prior_frames = [conditioner.condition(img) for img in metamer_prior_frames]
         if seed_image is None: 
             self.metamer = MetamerImage(torch.rand_like(target_image)) # Start with random noise image if none specified
         elif torch.is_tensor(seed_image):
             self.metamer = MetamerImage(seed_image.detach().clone())    # If image was provided use it as intial metamer estimate
         else:
             self.metamer = seed_image;                 # assume seed image was an already configured metamer image
+        self.metamer.size_conditioner = conditioner
         if copy_target_mask is not None and copy_target_mask is not False:
             # Copy the specified pixels from the target image and force their gradients to be zero so optimizer will not modify them
             self.metamer.copy_and_freeze_pixels_(target_image,copy_target_mask)
+        if self.pack_trainable_pixels: self.metamer.pack_trainable_pixels_()
         self.metamer.clamp_range_(self.lower_limit,self.upper_limit)      # Clamp any out-of-range pixels in the input
         # Register images if they were supplied (as not needing gradients and copied to GPU if needed)
         self.target_image = torch.nn.Parameter(target_image,requires_grad=False)
@@ -490,11 +628,27 @@ class MetamerImageSolver(torch.nn.Module):
         else:
             self.target_prior_frames = []  # set them to empty list just to make later code simpler
             self.metamer_prior_frames = []
+        # Keys identifying the prior frames so their pyramids and statistics can be cached rather than recomputed every iteration
+        #  ids (eg frame numbers) may be supplied by the caller so the cache can also be reused across successive frames
+        self._solve_count += 1
+        if prior_frame_ids is None: prior_frame_ids = [(self._solve_count,i) for i in range(len(self.target_prior_frames))]
+        if len(prior_frame_ids) != len(self.target_prior_frames): raise ValueError(f'Expected {len(self.target_prior_frames)} prior frame ids, got {prior_frame_ids}')
+        target_frame_keys = [None, *[('target',fid) for fid in prior_frame_ids]]
+        metamer_frame_keys = [None, *[('metamer',fid) for fid in prior_frame_ids]]
         # Move our attribute tensors and module attributes to the GPU (module keeps track of its member attributes).
         # This should happen before constructing the optimizer in case the optimizer constructs internal tensors
-        if self.use_gpu_if_available and torch.cuda.is_available():
-            print("Using GPU for solver computations")
-            self.cuda()   
+        device = self.get_device()
+        if device.type == 'cuda': print("Using GPU for solver computations")
+        self.to(device)
+        # Optional per-stage profiling (only enabled if requested since CUDA event timing needs a sync each iteration)
+        profiler = None
+        if self.print_stage_profile or self.save_stage_profile: profiler = profiling.StageProfiler(device)
+        # Optional peak memory prediction (uses the statistic image sizes recorded while computing the target statistics)
+        self.stat_eval.set_checkpointing(self.checkpoint_statistics)
+        size_recorder = None
+        if self.print_memory_estimate or self.memory_budget is not None:
+            size_recorder = memoryestimate.StatImageSizeRecorder(self.statlabel_callback)
+            if device.type == 'cuda': torch.cuda.reset_peak_memory_stats(device)
                 
         # Setup the loss and optimzation functions (if not already specified)
         if lossfunc is None:
@@ -506,7 +660,11 @@ class MetamerImageSolver(torch.nn.Module):
 #        if optimizer == 'AdaptiveStepRootFinder':
 #            optimizer = rootfinderopt.AdaptiveStepRootFinder(trainables,momentum=0.75)
         if optimizer == 'LBFGS':
-            optimizer = torch.optim.LBFGS(trainables, max_iter=1, history_size=30, tolerance_grad=1e-9)  
+            if self.lbfgs_history_dtype is None and self.lbfgs_history_device is None:
+                optimizer = torch.optim.LBFGS(trainables, max_iter=1, history_size=30, tolerance_grad=1e-9)  
+            else:
+                optimizer = CompactLBFGS(trainables, max_iter=1, history_size=30, tolerance_grad=1e-9,
+                                         history_dtype=self.lbfgs_history_dtype, history_device=self.lbfgs_history_device)
 #            optimizer = torch.optim.LBFGS(trainables, max_iter=1, history_size=30, tolerance_grad=1e-12, tolerance_change=1e-12)  
 #            optimizer = torch.optim.LBFGS(trainables, max_iter=1, history_size=30, tolerance_grad=1e-9, line_search_fn='strong_wolfe',max_eval=8)  
 #            optimizer = torch.optim.LBFGS(trainables, lr=1, max_iter=1, history_size=50, tolerance_grad=0, tolerance_change=0)  
@@ -516,11 +674,16 @@ class MetamerImageSolver(torch.nn.Module):
         
         # Compute the statistics for the target image, this is what we will try to match
         #  for the input we construct list of frames starting with the current and going backward in time
-        target_stats = self.stat_eval([self.target_image, *self.target_prior_frames],create_labels=True,statlabel_callback=self.statlabel_callback)
+        with profiling.activate(profiler), profiling.stage('target statistics'):
+            target_stats = self.stat_eval([self.target_image, *self.target_prior_frames],create_labels=True,
+                                          statlabel_callback=size_recorder if size_recorder is not None else self.statlabel_callback,
+                                          frame_keys=target_frame_keys)
 
         filtered_target_stats = [stat for stat in target_stats if stat.sum() != 0]
 
         if self.print_num_statistics: print(f"Total number of statistics: {len(filtered_target_stats)}")
+        memory_usage = None
+        if size_recorder is not None: (memory_usage,optimizer) = self._fit_memory_budget(size_recorder,target_stats,optimizer)
         losslist = []      # List of loss values at each step (so we can plot or analyze them later)
         # Related quantities that we may need to compute (if they were requested)
         keepBlameImage = self.step_print_blame_image
@@ -535,10 +698,12 @@ class MetamerImageSolver(torch.nn.Module):
             nonlocal saved_met_state
             self.metamer.clear_auxiliary_data()    # Clear any old auxiliary data from metamer
             optimizer.zero_grad()                  # Clear any gradients from prior computations
-            stats = self.stat_eval([self.metamer(), *self.metamer_prior_frames]) 
+            with profiling.stage('statistics'):
+                stats = self.stat_eval([self.metamer(), *self.metamer_prior_frames],frame_keys=metamer_frame_keys) 
                                                    # Evaluate the model on the current estimate and return its statistics
-            loss = lossfunc(stats, target_stats,   # Loss measures difference between statistics
-                            self.loss_scalefactor) #  scaled up to avoid triggering epsilon thresholds in the optimizer
+            with profiling.stage('loss'):
+                loss = lossfunc(stats, target_stats,   # Loss measures difference between statistics
+                                self.loss_scalefactor) #  scaled up to avoid triggering epsilon thresholds in the optimizer
             # Check if loss increased significantly and retry with smaller step in that case
             if losslist and (not (1.001*losslist[-1] > loss)):
                 if (max_retries>0):
@@ -559,7 +724,8 @@ class MetamerImageSolver(torch.nn.Module):
                 saved_met_state = self.metamer._get_current_state_copy()
             losslist.append(float(loss))           # Add loss value to list in case we want it later
             if compute_gradients:
-                loss.backward()                    # Compute image gradients with respect to loss
+                with profiling.stage('backward'):
+                    loss.backward()                # Compute image gradients with respect to loss
                                                    # Adjust gradients for any clamped or out-of-range pixels
                 self.metamer.clamp_range_gradients_(self.lower_limit,self.upper_limit)          
 #                if torch.isnan(self.metamer.learned.grad).any(): print(f'Nan in gradient image')
@@ -572,7 +738,10 @@ class MetamerImageSolver(torch.nn.Module):
             return loss
         
         # Create a context manager so temporary directories or files are deleted at the end of this scope
+        # Note: only the final image goes through the output sink.  The optional diagnostics enabled by the save_* and step_save_*
+        #  modes (step images and convergence movie, loss graph and regional loss pdfs, profiles) are always written as files to the output directory
         with contextlib.ExitStack() as cmscope:
+            cmscope.enter_context(profiling.activate(profiler))
             if self.step_save_image:  # create a directory to save step images or output to
                 iterdir = f'{outbasepath}steps{int(time.time())}'
                 os.mkdir(iterdir)
@@ -584,7 +753,8 @@ class MetamerImageSolver(torch.nn.Module):
             # Learning loop to train the metamer
             for inum in range(max_iterations):
                 if self.step_print_image: plot_images(self.metamer.get_image(),center_zero=False,title=f'Step {len(losslist)} Image')
-                optimizer.step(closure)     # Invoke optimizer to perform one optimization iteration
+                with profiling.stage('optimizer step'):
+                    optimizer.step(closure)     # Invoke optimizer to perform one optimization iteration
                 self.metamer.clamp_range_(self.lower_limit,self.upper_limit)  # Clamp any out-of-range pixels that optimizer might have created
                 if self.step_print_gradient_image: plot_image(self.metamer.get_gradient_image(),title=f'Step {len(losslist)} Gradient Image')
                 if self.step_print_pooling_loss_image: plot_image(self.metamer.get_pooling_loss_image(),title=f'Step {len(losslist)} Regional Loss')
@@ -602,15 +772,34 @@ class MetamerImageSolver(torch.nn.Module):
             print_loss_groups = self.print_loss_groups
             print_top_losses = self.print_top_losses
             if max_iterations >= 0:
-                closure(compute_gradients=keepGradients)    # Compute statistics for final result
+                with profiling.stage('final evaluation'):
+                    closure(compute_gradients=keepGradients)    # Compute statistics for final result
             else:
                 print("Not computing statistics for metamer because number of iterations was negative")
             
             timer = time.perf_counter() - timer  # stop timer (don't include result saving or movie generation)
             if self.print_elapsed_time: print(f"Elapsed solver time {timer} secs")
+            if profiler is not None:
+                if self.print_stage_profile: profiler.print_report()
+                if self.save_stage_profile and outbasepath is not None:
+                    profiler.save_json(f'{outbasepath}_profile.json')
+                    profiler.save_chrome_trace(f'{outbasepath}_trace.json')
             
             result = self.metamer  # This is value we will return at the end of this function
+            if self.print_statistic_costs and max_iterations >= 0:
+                result.statistic_costs = self.statistic_cost_report([self.metamer(), *self.metamer_prior_frames],target_stats)
+                result.statistic_costs.print_report()
+                if self.save_stage_profile and outbasepath is not None: result.statistic_costs.save_json(f'{outbasepath}_statcosts.json')
             result.loss_value = losslist[-1] if len(losslist)>0 else None  # Store final loss 
+            result.loss_history = list(losslist)
+            if profiler is not None: result.stage_profile = profiler.summary()     # Per-stage and per-category timings (in ms)
+            if memory_usage is not None:
+                # Record the actual peak (for calibrating the estimate), this is only available for cuda devices
+                #  note: the gpu memory printing modes reset the peak statistics so they should not be combined with this
+                memory_usage['actual_peak'] = torch.cuda.max_memory_allocated(device) if device.type == 'cuda' else None
+                if self.print_memory_estimate and memory_usage['actual_peak'] is not None:
+                    print(f"Actual peak memory {memory_usage['actual_peak']/2**30:.2f} GB (predicted {memory_usage['estimated_peak']/2**30:.2f} GB)")
+                result.memory_usage = memory_usage
             # print/save any desired outputs before returning the result
             if self.print_loss: print(f'Final loss: {result.loss_value}')
             if self.print_gpu_memory: ms_print_gpu_mem()
@@ -633,9 +822,11 @@ class MetamerImageSolver(torch.nn.Module):
                 plot_image(result.get_blame_image())
             if self.print_gradient_image: plot_image(result.get_gradient_image())
             if self.print_image: plot_image(result.get_image(),center_zero=False,title='Metamer Image')
-            if self.print_image_comparison: plot_images(torch.cat((result.get_image(),target_image),-1),center_zero=False,title='Metamer & Target Image')   
+            if self.print_image_comparison:
+                shown_target = conditioner.restore(target_image) if conditioner is not None else target_image
+                plot_images(torch.cat((result.get_image(),shown_target),-1),center_zero=False,title='Metamer & Target Image')   
             if self.save_image: 
-                save_image(result.get_image(),outfilepath)
+                self.get_output_sink().write_image(result.get_image(),outfilename,self.output_directory)
             if self.save_convergence_movie and (outbasename is not None): # use ffmpeg to compile the iterations into a movie
                 moviename = f'{outbasepath}_converge.mp4'
                 blend.compile_frames_to_mp4(os.path.join(iterdir,'metamer_iter%03d.png'),moviename)
@@ -655,6 +846,8 @@ def make_solver(target_image,           # target image, size is used to precompu
                 pyramid_builder=None,   # Optionally provide a specific steerable pyramid builder (for expert use only, overrides other pyramid settings)
                 pyramid_params=None,    # Specifies which pyramid levels to build for each image (can vary by channel and if set takes precedence over other parameters below)
                 temporal_mode=None,     # Mode for handling temporal information (default is only consider current frame)
+                size_conditioning=None, # 'pad' or 'crop' to solve at a nearby size that allows pyramid downsampling (for sizes not divisible by powers of two)
+                pyramid_method='fourier', # How the default pyramid builder filters: 'fourier' (FFTs), 'spatial' (convolution), or 'auto' (chosen per level by cost)
                 ):   
     # Convert any params that are given as strings or other non-canonical forms
     pyramid_params = sp.SPyramidParams.normalize(pyramid_params)
@@ -673,19 +866,41 @@ def make_solver(target_image,           # target image, size is used to precompu
         pass # assume it is an already configure statistic pooling object so just use it
     else:
         raise ValueError(f'expected pooling size or object, but got {stat_pooling}')
+    conditioner = None     # only used with the default pyramid builder (a provided builder already has its image size)
     # If no pyramid builder was specified, then configure a default builder
     if pyramid_builder is None:
         # automatically determine a max_downsampling such that windows still land on integer coordinates
         min_pool_spacing = stat_pooling.min_stride_divisor()
-        max_downsample = math.gcd(math.gcd(64,min_pool_spacing),math.gcd(target_image.size(-1),target_image.size(-2)))
+        desired_downsample = math.gcd(64,min_pool_spacing)
+        image_size = tuple(target_image.shape[-2:])
+        if size_conditioning:
+            # Pad (with reflection) or crop the image to a multiple of the desired downsampling, if needed.
+            conditioner = SizeConditioner(image_size,desired_downsample,size_conditioning)
+            if not conditioner.is_identity():
+                print(f'Conditioning image size: {conditioner}')
+                # Pooling lists (eg gaze-centric pooling) are built for one specific image size and would be misaligned at the conditioned size
+                if isinstance(stat_pooling,pool.RegionPoolingList):
+                    raise ValueError(f'size_conditioning cannot be used with image-size specific pooling (eg gaze-centric pooling) for image size {image_size}')
+                image_size = conditioner.size
+                if conditioner.mode == 'pad':   # the statistics should only be pooled over the original image area
+                    stat_pooling = pool.MaskedPooling(stat_pooling,conditioner.valid_mask())
+            else:
+                conditioner = None
+        max_downsample = math.gcd(desired_downsample,math.gcd(image_size[0],image_size[1]))
         #print(f"max_downsample_factor: {max_downsample}")
         stat_pooling.configure_for_downsampling(max_downsample)
         # Create the steerable pyramid builder.  It may use the target image size to precompute its filters
         # Downsampling causes the coarser levels to be stored at lower resolution (save memory and computation)
         # We limit the max downsampling because pooling windows use integer shifts and thus cannot be less than the coarsest resolution used in the pyramid
         # Future: add code to automatically set max_downsample_factor based on the pooling
-        pyramid_builder = sp.SPyramidFourierBuilder(target_image,pyramid_params,
-                                                    downsample=True,max_downsample_factor=max_downsample)
+        if pyramid_method == 'fourier':
+            pyramid_builder = sp.SPyramidFourierBuilder(image_size,pyramid_params,
+                                                        downsample=True,max_downsample_factor=max_downsample)
+        else:
+            # Spatial convolution can be faster for the finer levels of large images (particularly on cpus)
+            pyramid_builder = sp.SPyramidConvolutionalBuilder(image_size,pyramid_params,method=pyramid_method,
+                                                              downsample=True,max_downsample_factor=max_downsample)
+            print(f'Pyramid level methods: {pyramid_builder.method_summary()}')
     if make_temporal_stat_evaluator is not None:
         stat_evaluator = make_temporal_stat_evaluator(temporal_mode,pyramid_builder,stat_pooling,prefilter)
     else:
@@ -707,6 +922,7 @@ def make_solver(target_image,           # target image, size is used to precompu
         stat_evaluator = meval.StatisticsEvaluator(tchannel_evals,crosst_evals,prefilter=prefilter)
     # Create a solver and configure it with some reasonable defaults
     solver = MetamerImageSolver(stat_evaluator)
+    if conditioner is not None: solver.set_mode('size_conditioner',conditioner)
     # Pixels are required to be positive and we can add more constraints to their allowed range
     if max_value_constraint:
         solver.constrain_image_max(max_value_constraint)
@@ -14,7 +14,11 @@ cross-channel statistics.
 # Released under an open-source MIT license, see LICENSE file for details
 
 import torch
+import torch.utils.checkpoint
+import collections
 import color_utils as color
+import profiling
+import statcost
 
 # Simple temporal filter (weighted combination of current and prior frames)
 class WeightedImageFilter(torch.nn.Module):
@@ -37,6 +41,28 @@ class WeightedImageFilter(torch.nn.Module):
     def get_history_size(self):
         return len(self.filter_weights) - 1
     
+    # Does the filter's output depend on the current frame (index 0)?
+    def uses_current_frame(self):
+        return self.filter_weights[0] != 0
+    
+    # Returns the weighted combination of just the prior frames (or None if there are no non-zero terms)
+    def prior_forward(self,images):
+        retval = None
+        for weight,img in zip(self.filter_weights[1:],images[1:]):
+            if weight == 0: continue
+            if retval is None:
+                retval = weight*img
+            else:
+                retval = weight*img + retval
+        return retval
+    
+    # Combines the current frame with a precomputed result from prior_forward()
+    def combine_with_prior(self,current,prior):
+        weight = self.filter_weights[0]
+        if prior is None: return weight*current
+        if weight == 0: return prior
+        return weight*current + prior
+    
 # Simple temporal filter (return fixed frame from the list of frames, 0 is current frame, 1 is previous frame, etc.)
 class IndexedImageFilter(torch.nn.Module):
 
@@ -51,6 +77,9 @@ class IndexedImageFilter(torch.nn.Module):
     def get_history_size(self):
         return self.index
     
+    def uses_current_frame(self):
+        return self.index == 0
+    
 
 # This object computes statistics within a single frame.  This "frame" could be a still image, 
 # a single frame from a sequence (ie the current frame), or a "synthetic" frame generated from
@@ -74,14 +103,63 @@ class FrameChannelStatisticsEvaluator(torch.nn.Module):
         self.channel_stats = channel_stats # Module that computes intra-channel statistic images from steerable pyramids
         self.crosscolor_stats = crosscolor_stats # Module that computes inter-color-channel statistic images (if it is is a color image)
         self.poolfunc = pooling            # Statistic pooling function (typically blurs and downsamples stat images)
+        # Prior frames do not change during a solve, so results that depend only on them can be cached (keyed by frame keys)
+        self.cache_prior_frames = True     # Enable the rolling cache of prior-frame results
+        self.frame_cache_size = 4          # Maximum number of cached entries (oldest entries are discarded first)
+        self._frame_cache = collections.OrderedDict()
+        self.checkpoint_statistics = False # Recompute statistic images during the backward pass rather than storing them (saves memory but costs time)
+        self.prune_pyramids = True         # Only build the pyramid components that the enabled statistics read
+        
+    # Discard all cached prior-frame results
+    def clear_frame_cache(self):
+        self._frame_cache.clear()
+        
+    # Key identifying the prior frames within the temporal filter's support (or None if results should not be cached)
+    def _prior_frames_key(self,frame_keys):
+        if (frame_keys is None) or (not self.cache_prior_frames): return None
+        key = tuple(frame_keys[1:self.temporal_filter.get_history_size()+1])
+        if (len(key) == 0) or (None in key): return None
+        return key
+    
+    def _cache_store(self,key,value):
+        self._frame_cache[key] = value
+        self._frame_cache.move_to_end(key)
+        while len(self._frame_cache) > self.frame_cache_size:
+            self._frame_cache.popitem(last=False)   # discard the oldest entry
     
     # Compute the statistics for the given images and return them as a list of (pooled) images
     #   images is a list of frames starting with the current frame and going backward in time (if prior frames are available to the statistics)
     #   if stat_labels is a list then labels will be added to it for each statistic added
-    def forward(self,images,*,stat_labels=None,statlabel_callback=None):
+    #   frame_keys is an optional list of hashable keys identifying each image (None for frames that may change such as the current one)
+    def forward(self,images,*,stat_labels=None,statlabel_callback=None,frame_keys=None):
+        prior_key = self._prior_frames_key(frame_keys)
+        if prior_key is None:
+            image = self.temporal_filter(images)  # apply temporal filter to create image
+        elif not self.temporal_filter.uses_current_frame():
+            # Statistics depend only on prior frames, so reuse earlier results if available (unless labels are being collected)
+            key = ('stats',prior_key)
+            if (key in self._frame_cache) and (stat_labels is None):
+                return self._frame_cache[key]
+            with torch.no_grad():
+                result = self._evaluate(self.temporal_filter(images),stat_labels,statlabel_callback)
+            self._cache_store(key,result)
+            return result
+        else:
+            # Reuse the combination of prior frames and only add in the current frame's contribution
+            key = ('prior',prior_key)
+            if key in self._frame_cache:
+                prior = self._frame_cache[key]
+            else:
+                with torch.no_grad():
+                    prior = self.temporal_filter.prior_forward(images)
+                self._cache_store(key,prior)
+            image = self.temporal_filter.combine_with_prior(images[0],prior)
+        return self._evaluate(image,stat_labels,statlabel_callback)
+    
+    # Computes the statistics for a single (temporally filtered) image and returns them with the pyramids
+    def _evaluate(self,image,stat_labels,statlabel_callback):
         spyr_list = []   # List of steerable pyramids for each channel
         stats_list = []       # List of all statistic images
-        image = self.temporal_filter(images)  # apply temporal filter to create image
         if image is None:
             return (stats_list,spyr_list) # may be none if no images are within the temporal support of the filter
         # Transform to statistics color space (if it is a color image)
@@ -93,12 +171,21 @@ class FrameChannelStatisticsEvaluator(torch.nn.Module):
         else: 
             raise NotImplementedError(f'Only 1-grayscale or 3-rgb channel images supported.  Number channels was {image.size(1)}')
         def eval_stat(evaluator,spyrs):
-            stats = evaluator(spyrs,poolfunc=self.poolfunc,stat_labels=stat_labels,statlabel_callback=statlabel_callback)   #evaluate the statistics
+            with profiling.stage(type(evaluator).__name__):
+                if self.checkpoint_statistics and (stat_labels is None) and torch.is_grad_enabled():
+                    stats = torch.utils.checkpoint.checkpoint(evaluator,spyrs,use_reentrant=False,poolfunc=self.poolfunc,stat_labels=None)
+                else:
+                    stats = evaluator(spyrs,poolfunc=self.poolfunc,stat_labels=stat_labels,statlabel_callback=statlabel_callback)   #evaluate the statistics
             stats_list.extend(stats)                                    #add stats to list of all stats
+        # Build the pyramids for all the channels (in one batch if the builder supports it)
+        if hasattr(self.builder,'build_spyramid_channels'):
+            spyr_list = self.builder.build_spyramid_channels(image,channel_names,temporalname=self.name,make_crossscale=self.builder_crossscale,
+                                                             components=self.pyramid_components())
+        else:
+            spyr_list = [self.builder.build_spyramid(image.narrow(1,c,1),colorname=channel_names[c],temporalname=self.name,make_crossscale=self.builder_crossscale)
+                         for c in range(image.size(1))]
         # For each channel compute the intra-channel statistics
-        for c in range(image.size(1)):
-            spyr = self.builder.build_spyramid(image.narrow(1,c,1),colorname=channel_names[c],temporalname=self.name,make_crossscale=self.builder_crossscale)
-            spyr_list.append(spyr)
+        for spyr in spyr_list:
             eval_stat(self.channel_stats,spyr)
         # Compute cross channel statistics (if image has more than one channel)
         if (self.crosscolor_stats is not None) and (len(spyr_list) > 1):
@@ -111,6 +198,16 @@ class FrameChannelStatisticsEvaluator(torch.nn.Module):
         yield self.channel_stats
         if self.crosscolor_stats is not None: yield self.crosscolor_stats
         
+    # Returns the set of pyramid components needed by the enabled statistics (or None if all should be built)
+    def pyramid_components(self):
+        if not self.prune_pyramids: return None
+        comps = set()
+        for statobj in self.stat_objects():
+            c = statobj.pyramid_components()
+            if c is None: return None
+            comps |= c
+        return comps
+        
     # Return the maximum number of prior frames used when evaluated this temporal channel
     def max_prior_frames_used(self):
         return self.temporal_filter.get_history_size()
@@ -130,6 +227,7 @@ class StatisticsEvaluator(torch.nn.Module):
             
         self.statlabels = None            # List of StatLabels for each statistic (subclass of NamedTuple)
         self.cross_evals = torch.nn.ModuleList(cross_evals)   # List of cross-temporal-channel statistics evaluators
+        if len(self.cross_evals) > 0: self.set_pyramid_pruning(False)   # cross-channel evaluators may read any pyramid component
         
     # Generate and return the steerable pyramids for this image but don't generate any statistics
     def make_pyramids(self,images):
@@ -140,7 +238,8 @@ class StatisticsEvaluator(torch.nn.Module):
         
     # Compute the statistics for the given images and return them as a list of (pooled) images
     # Images is a list of frames starting with the current frame and going backward in time 
-    def forward(self,images,*,create_labels=False,statlabel_callback=None):
+    # Optional frame_keys identify each image (eg by frame number) so that results for unchanging prior frames can be cached
+    def forward(self,images,*,create_labels=False,statlabel_callback=None,frame_keys=None):
         spyr_dict = {}      # Dictionary from temporal channel names to its steerable_pyramids 
         stats_list = []     # List of all statistic images
         stat_labels = None  # None means don't bother collecting the StatLabels
@@ -152,7 +251,7 @@ class StatisticsEvaluator(torch.nn.Module):
             images = [self.prefilter(img) for img in images]
         # Evaluate each of the temporal channels and any statistics within that channel
         for teval in self.temporal_evals:
-            (stats,spyrs) = teval(images,stat_labels=stat_labels,statlabel_callback=statlabel_callback)
+            (stats,spyrs) = teval(images,stat_labels=stat_labels,statlabel_callback=statlabel_callback,frame_keys=frame_keys)
             stats_list.extend(stats)
             spyr_dict[teval.name] = spyrs
         # Evaluate any cross temporal channel statistics
@@ -163,8 +262,35 @@ class StatisticsEvaluator(torch.nn.Module):
         if stat_labels is not None: self.statlabels = stat_labels # If generated, save label list for later access
         return stats_list
     
+    # Measure the estimated flops, memory traffic, and time of each statistic category and level for these images
+    # Returns (StatCostReport,stats).  Runs once untimed first so one-time setup costs are not included in the times
+    def measure_costs(self,images,device=None):
+        if torch.is_tensor(images): images = (images,)
+        recorder = statcost.StatCostRecorder({teval.name:teval.poolfunc for teval in self.temporal_evals},images[0].size())
+        profiler = profiling.StageProfiler(device if device is not None else images[0].device)
+        with torch.no_grad():
+            self(images)
+            with profiling.activate(profiler), profiling.stage('statistics'):
+                stats = self(images,create_labels=True,statlabel_callback=recorder)
+        return (statcost.StatCostReport(recorder,profiler),stats)
+    
     def max_prior_frames_used(self):
         return max(teval.max_prior_frames_used() for teval in self.temporal_evals)
+    
+    # Discard any cached results for prior frames (eg when starting a new sequence)
+    def clear_frame_cache(self):
+        for teval in self.temporal_evals:
+            teval.clear_frame_cache()
+
+    # Enable/disable recomputing the statistic images during the backward pass (trades time for memory)
+    def set_checkpointing(self,value):
+        for teval in self.temporal_evals:
+            teval.checkpoint_statistics = value
+            
+    # Enable/disable building only the pyramid components that the enabled statistics use
+    def set_pyramid_pruning(self,value):
+        for teval in self.temporal_evals:
+            teval.prune_pyramids = value
 
     # Returns all the statistic objects (subclasses of MetamerStatistics) used by this evaluator
     def stat_objects(self):
@@ -38,6 +38,10 @@ class StatGroupTypes(StatGroup):
         if 'phase' in label.weight_category: return 'phase'
         return 'value'
     
+class StatGroupCategoryLevels(StatGroup):  # Groups by (category,level) pairs, eg for per-statistic cost accounting
+    def label_to_key(self,label): return (label.weight_category,label.level)
+    def key_to_str(self,key): return f'{key[0]} {level_to_str(key[1])}'
+    
 class StatGroupIndividual(StatGroup):
     def label_to_key(self,label): return str(label)
     
@@ -76,7 +80,13 @@ class StatGroupFilter(StatGroup):
 
 statgroup_aliases = {'levels':StatGroupLevels(), 'categories':StatGroupCategories(),
                   'channels':StatGroupChannels(), 'types':StatGroupTypes(),
-                  'individuals':StatGroupIndividual()}
+                  'individuals':StatGroupIndividual(), 'category_levels':StatGroupCategoryLevels()}
+
+# Short string for a statistic's pyramid level(s) (matches the format used in StatLabel strings)
+def level_to_str(level):
+    if level is None: return 'Base'
+    if isinstance(level,int): return f'L{level}'
+    return 'L'+'_'.join(str(l) for l in level)
 
 def get_statgroup_by_name(name):
     return statgroup_aliases[name]
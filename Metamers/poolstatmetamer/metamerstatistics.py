@@ -19,7 +19,9 @@ about the current statistics being used can be returned as a list of StatLabels
 
 import torch
 import autocorrelation as acorr
+import profiling
 from spyramid import SPyramidParams
+from poolingregions import WholeImagePooling
 from typing import NamedTuple, Union, Tuple, Any
 
 #imports for edgestop tests
@@ -53,6 +55,11 @@ def range_distinct_ordered_pairs(limit):
         for j in range(limit):
             if (i != j): yield (i,j)
     
+# Can a statlabel_callback handle statistics computed without a statistic image (statimg=None, see GrayscaleStatistics._forward_global)?
+# Callbacks opt in by having a true accepts_missing_statimg attribute
+def accepts_missing_statimg(callback):
+    return callback is None or getattr(callback,'accepts_missing_statimg',False)
+    
 # A record containing some information about a particular statistic mode 
 # used to optionally return some information about each statistic for debugging or labeling outputs
 class StatLabel(NamedTuple):
@@ -230,6 +237,11 @@ class MetamerStatistics(torch.nn.Module):
         if hasattr(level,'__iter__'): level = max(level)  # Gives slightly higher weight for inter-level statistics
         return self.per_level_weight**level
         
+    # Returns the set of pyramid component types (see spyramid.PYRAMID_COMPONENTS) read by the currently enabled statistics
+    # so the pyramid builder can skip the others.  None means all components may be needed (the safe default for subclasses)
+    def pyramid_components(self):
+        return None
+        
     # Compute each of the enabled statistics, average it over the pooling regions, and return
     # the result as a list of tensor images (one per statistic)
     # If stat_labels is a list, then a StatLabel for each stat will be added to it
@@ -246,6 +258,9 @@ class EmptyStatistics(MetamerStatistics):
     def __init__(self):
         super().__init__()
 
+    def pyramid_components(self):
+        return set()
+
     def forward(self,spyr,poolfunc, stat_labels=None, statlabel_callback=None):
         return []  # just return an empty list as we have no statistics
 
@@ -284,6 +299,10 @@ class GrayscaleStatistics(MetamerStatistics):
         self.stat_phase_orientationcorrelation = True     # Not in Portilla statistics but in Freeman's (off by default bw:8/2020, renabled 12/2021, helps text tests)
         self.stat_phase_scalecorrelation = True
         self.stat_phase_scaleorientationcorrelation = True # Separated from phase_scalecorrelation and turned off by default bw:8/2020
+        # Compute the edge and phase statistics on the whole orientation stacks (with pair index tables) and pool each stack in one call
+        self.batch_orientations = True
+        # With whole-image pooling, compute the statistics directly from reductions, Gram matrices, and power spectra
+        self.global_fast_path = True    # (not used for statlabel callbacks that need the statistic images)
         
         # Some named groups of statistics for convenience
         self.named_stat_groups = { 
@@ -293,7 +312,7 @@ class GrayscaleStatistics(MetamerStatistics):
                  'ps_magnitudecorrelation':('edge_mean','edge_variance','edge_autocorrelation','edge_orientationcorrelation','edge_scalecorrelation','edge_scaleorientationcorrelation'), #note: original P&S did not use edge_mean, but we include it since we are using raw moments instead of centralized moments
                  'ps_crossscalephase':('phase_scalecorrelation','phase_scaleorientationcorrelation'),
                  # Meta groups for all Portilla&Simoncelli statistics and all Freeman&Portilla statistics
-                 'ps_all':('ps_marginalstatistics',' ','ps_magnitudecorrelation','ps_crossscalephase'),
+                 'ps_all':('ps_marginalstatistics','ps_coefficientcorrelation','ps_magnitudecorrelation','ps_crossscalephase'),
                  'fs_all':('ps_all','phase_orientationcorrelation'),
                  # categories based on source image type (original,low-pass,high-pass,edge-magnitude,phase)
                  'base_stats':('mean','base_variance','base_skewkurtosis'),
@@ -329,6 +348,19 @@ class GrayscaleStatistics(MetamerStatistics):
         self.low_autoshifts = offsetlist
         self.edge_autoshifts = offsetlist
         
+    def pyramid_components(self):
+        comps = set()
+        if self.stat_bandpass_variance: comps.add('bandpass')
+        if self.stat_low_variance or self.stat_low_skewkurtosis or self.stat_low_autocorrelation: comps.add('lowpass')
+        if (self.stat_edge_mean or self.stat_edge_variance or self.stat_edge_kurtosis or self.stat_edge_autocorrelation or
+            self.stat_edge_orientationcorrelation or self.stat_edge_scalecorrelation or self.stat_edge_scaleorientationcorrelation or
+            self.stat_edge_stop or self.stat_edge_continue):
+            comps.add('edge_magnitude')
+        if self.stat_edge_scalecorrelation or self.stat_edge_scaleorientationcorrelation: comps.add('coarser_magnitude')
+        if self.stat_phase_orientationcorrelation or self.stat_phase_scalecorrelation or self.stat_phase_scaleorientationcorrelation: comps.add('edge')
+        if self.stat_phase_scalecorrelation or self.stat_phase_scaleorientationcorrelation: comps.add('coarser_dphase')
+        return comps
+        
     # Compute each of the enabled statistics, average it over the pooling regions, and return
     # the result as a list of tensor images (one per statistic)
     # Can also record category and descriptive name for each statistic
@@ -340,6 +372,9 @@ class GrayscaleStatistics(MetamerStatistics):
         basesize = baseimg.size()
         channel = spyr.cname
         temporal = spyr.tname
+        if (self.global_fast_path and isinstance(poolfunc,WholeImagePooling) and baseimg.size(0) == 1
+            and accepts_missing_statimg(statlabel_callback)):   # other callbacks get the statistic images from the generic path
+            return self._forward_global(spyr,stat_labels,statlabel_callback)
         # Utility function to process and add one statistic image to list
         # statimg is the statistics image and cat is its category
         # src1,src2 are used to optinoally create descriptive strings for each statistic
@@ -347,7 +382,9 @@ class GrayscaleStatistics(MetamerStatistics):
             #if len(stats)==5: plot_image(statimg,title=name)
             weight = self.category_weights[catname]
             if self.per_level_weight: weight *= self._level_weight(level)
-            stat = poolfunc.pool_stats(statimg,basesize)
+            profiling.lap('statistic products',catname,level)   # time spent computing statimg since the previous statistic was pooled
+            with profiling.category(catname,level):
+                stat = poolfunc.pool_stats(statimg,basesize)
             stats.append(weight*stat)
             if stat_labels is not None: 
                 stat_labels.append(StatLabel(catname, level, channel, temporal, note, ori))
@@ -356,6 +393,23 @@ class GrayscaleStatistics(MetamerStatistics):
 #                imgdir = os.path.expanduser('~/Desktop/statimagespep_es/')
 #                plot_image(stat,title=str(stat_labels[-1]),savefile=imgdir+str(stat_labels[-1]).strip()+".png")
 #                plot_image(stat,title=str(stat_labels[-1]))
+        # Process and add a stack of statistics images (NxKxHxW), where oris gives the orientation(s) label for each of the K images
+        # A single image's stack is pooled in one call, while a batch (N>1) pools each orientation's Nx1xHxW images like add_stat
+        def add_stat_stack(statimgs,catname,level,oris,*,note=None):
+            weight = self.category_weights[catname]
+            if self.per_level_weight: weight *= self._level_weight(level)
+            profiling.lap('statistic products',catname,level)
+            with profiling.category(catname,level):
+                if statimgs.size(0) == 1:
+                    pooled = poolfunc.pool_stats_batch(statimgs.transpose(0,1),basesize)
+                else:
+                    pooled = [poolfunc.pool_stats(statimgs.narrow(1,k,1),basesize) for k in range(statimgs.size(1))]
+            for k,stat in enumerate(pooled):
+                stats.append(weight*stat)
+                if stat_labels is not None:
+                    stat_labels.append(StatLabel(catname, level, channel, temporal, note, oris[k]))
+                    if statlabel_callback is not None:
+                        statlabel_callback(stat,stat_labels[-1],statimgs.narrow(1,k,1))
         
         # Start adding the various image statistics
         if self.stat_mean:
@@ -385,12 +439,16 @@ class GrayscaleStatistics(MetamerStatistics):
                 #print(f"scale: {scale} origsize: {origsize} size: {L.size(-1)}")
                 for shift in self.low_autoshifts:
                     add_stat(acorr.autocorrelation2d(L,shift,scale),'autocorrelation',level=i,note=shift)
+        if self.batch_orientations:
+            self._add_edge_stat_stacks(spyr,params,basesize,add_stat_stack)
+            return stats
         def _ori_to_list(x): # returns list of tensors for each slice in dimension one, but keeps the same number of dimensions (unlike torch.unbind)
             return [x.narrow(1,ori,1) for ori in range(x.size(1))] if x is not None else None
         # Add edge magnitude statistics
         for i in params.edge_range():
             Mlist = _ori_to_list(spyr.edge_magnitude_images(i))
             Clist = _ori_to_list(spyr.coarser_magnitude_images(i))  # may be None if coarser images are not present at this level
+            if Mlist is None: continue    # magnitudes were not built since no enabled statistic uses them
             if self.stat_edge_stop:      # Build list of offsets used by the edgestop statistics
                 stopdist = 2**(i)
                 edgestop_offsets = []
@@ -435,6 +493,7 @@ class GrayscaleStatistics(MetamerStatistics):
             #Note: to save some memory we can not build dr and only use the di images.  In this case dr==None even when di is present 
             dr = _ori_to_list(spyr.dphase_real_images(i))
             di = _ori_to_list(spyr.dphase_imag_images(i))
+            if er is None: continue       # edge images were not built since no enabled statistic uses them
             if self.stat_phase_orientationcorrelation:
                 for (a,b) in range_unique_pairs(len(er)):
                     add_stat(er[a]*er[b], 'phase_correlation',level=i,ori=(a,b),note='er')
@@ -454,6 +513,189 @@ class GrayscaleStatistics(MetamerStatistics):
                     add_stat(er[a]*di[b], 'phase_correlation',level=(i,i+1),ori=(a,b),note='er*di')
         #plot_image(stats[-1])
         return stats     # Return list of statistic tensors (assume loss function can process a list)
+
+    # Specialized version of forward() for whole-image pooling, where every statistic is a global average.  The moments
+    # are plain reductions, products between orientations (or scales) are entries of Gram matrices, and autocorrelations
+    # for all offsets come from each band's power spectrum (Wiener-Khinchin), so no per-statistic product images are created.
+    # Produces the same statistics and labels, in the same order, as the batch_orientations path (up to floating point rounding).
+    # Note: the statlabel_callback receives None for the statistic image since none is created (only used with callbacks that accept this)
+    def _forward_global(self,spyr,stat_labels,statlabel_callback):
+        stats = []
+        params = spyr.params()
+        baseimg = spyr.original_image()
+        channel = spyr.cname
+        temporal = spyr.tname
+        def add_values(values,catname,level,oris=(None,),*,note=None):   # values is a tensor with one entry per label in oris
+            weight = self.category_weights[catname]
+            if self.per_level_weight: weight *= self._level_weight(level)
+            profiling.lap('statistic products',catname,level)
+            for k,value in enumerate(values.reshape(-1)):
+                stat = value.reshape(1,1,1,1)    # matches the shape produced by WholeImagePooling
+                stats.append(weight*stat)
+                if stat_labels is not None:
+                    stat_labels.append(StatLabel(catname, level, channel, temporal, note, oris[k]))
+                    if statlabel_callback is not None:
+                        statlabel_callback(stat,stat_labels[-1],None)
+        def mean(x): return x.mean((-1,-2))               # per channel/orientation average
+        def gram(A,B): return torch.matmul(A.flatten(-2),B.flatten(-2).transpose(-1,-2))[0]/A[0,0].numel()  # KxK averaged products
+        if self.stat_mean:
+            add_values(mean(baseimg),'mean',None)
+        if self.stat_base_variance:
+            add_values(mean(baseimg.pow(2)),'variance',None)
+        if self.stat_base_skewkurtosis:
+            add_values(mean(baseimg.pow(3)),'skew',None)
+            add_values(mean(baseimg.pow(4)),'kurtosis',None)
+        for i in params.bandpass_range():
+            if self.stat_bandpass_variance:
+                add_values(mean(spyr.band_pass_image(i).pow(2)),'bandpass_variance',i)
+        for i in params.lowpass_range():
+            L = spyr.low_pass_image(i)
+            if self.stat_low_variance:
+                add_values(mean(L.pow(2)),'variance',i)
+            if self.stat_low_skewkurtosis:
+                add_values(mean(L.pow(3)),'skew',i)
+                add_values(mean(L.pow(4)),'kurtosis',i)
+            if self.stat_low_autocorrelation:
+                scale = (2**i)*L.size(-1) // baseimg.size(-1)
+                sums = acorr.autocorrelation_sums(L)/L[0,0].numel()
+                for shift in self.low_autoshifts:
+                    add_values(acorr.autocorrelation_sum_at(sums,shift,scale),'autocorrelation',i,note=shift)
+        for i in params.edge_range():
+            M = spyr.edge_magnitude_images(i)
+            C = spyr.coarser_magnitude_images(i)  # may be None if coarser images are not present at this level
+            if M is None: continue
+            K = M.size(1)
+            oris = list(range(K))
+            if self.stat_edge_mean:
+                add_values(mean(M),'edge_mean',i,oris)
+            if self.stat_edge_variance:
+                add_values(mean(M.pow(2)),'edge_variance',i,oris)
+            if self.stat_edge_kurtosis:
+                add_values(mean(M.pow(4)),'edge_kurtosis',i,oris)
+            if self.stat_edge_autocorrelation or self.stat_edge_continue:
+                sums = acorr.autocorrelation_sums(M)/M[0,0].numel()
+            if self.stat_edge_autocorrelation:
+                scale = (2**i)*M.size(-1) // baseimg.size(-1)
+                for shift in self.edge_autoshifts:
+                    add_values(acorr.autocorrelation_sum_at(sums,shift,scale),'edge_autocorrelation',i,oris,note=shift)
+            if C is not None and (self.stat_edge_scalecorrelation or self.stat_edge_scaleorientationcorrelation):
+                GC = gram(M,C)
+                if self.stat_edge_scalecorrelation:
+                    add_values(GC.diagonal(),'edge_correlation',(i,i+1),oris)
+            if self.stat_edge_stop:      # uses differences rather than products, so it is computed directly
+                stopdist = 2**(i)
+                for ori in oris:
+                    angle = ori*math.pi/K
+                    offset = (round(stopdist*math.cos(angle)),round(stopdist*math.sin(angle)))
+                    add_values(mean(autodifference2d(M.narrow(1,ori,1),offset)**2),'edge_stop',i,(ori,))
+            if self.stat_edge_continue:
+                cdist = 2**(i+2)
+                values = [acorr.autocorrelation_sum_at(sums,(round(cdist*math.cos(ori*math.pi/K)),round(cdist*math.sin(ori*math.pi/K))))[0,ori] for ori in oris]
+                add_values(torch.stack(values),'edge_continue',i,oris)
+            if self.stat_edge_orientationcorrelation:
+                G = gram(M,M)
+                pairs = list(range_unique_pairs(K))
+                if pairs: add_values(G[[a for a,b in pairs],[b for a,b in pairs]],'edge_correlation',i,pairs)
+            if self.stat_edge_scaleorientationcorrelation and C is not None:
+                pairs = list(range_distinct_ordered_pairs(K))
+                if pairs: add_values(GC[[a for a,b in pairs],[b for a,b in pairs]],'edge_correlation',(i,i+1),pairs)
+        for i in params.edge_range():
+            er = spyr.edge_real_images(i)
+            ei = spyr.edge_imag_images(i)
+            dr = spyr.dphase_real_images(i)
+            di = spyr.dphase_imag_images(i)
+            if er is None: continue
+            K = er.size(1)
+            if self.stat_phase_orientationcorrelation:
+                pairs = list(range_unique_pairs(K))
+                if pairs:
+                    G = gram(er,er)
+                    add_values(G[[a for a,b in pairs],[b for a,b in pairs]],'phase_correlation',i,pairs,note='er')
+            if di is not None and (self.stat_phase_scalecorrelation or self.stat_phase_scaleorientationcorrelation):
+                G1 = gram(ei,di) if dr is None else gram(er,dr)
+                note1 = 'ei*di' if dr is None else 'er*dr'
+                G2 = gram(er,di)
+                if self.stat_phase_scalecorrelation:
+                    oris = list(range(K))
+                    add_values(G1.diagonal(),'phase_correlation',(i,i+1),oris,note=note1)
+                    add_values(G2.diagonal(),'phase_correlation',(i,i+1),oris,note='er*di')
+                pairs = list(range_distinct_ordered_pairs(K))
+                if self.stat_phase_scaleorientationcorrelation and pairs:
+                    a = [a for a,b in pairs]
+                    b = [b for a,b in pairs]
+                    add_values(G1[a,a] if dr is None else G1[a,b],'phase_correlation',(i,i+1),pairs,note=note1)  # same pairing as the per-orientation version
+                    add_values(G2[a,b],'phase_correlation',(i,i+1),pairs,note='er*di')
+        return stats
+
+    # Edge magnitude and phase statistics computed on the full orientation stacks (1xKxHxW) rather than per orientation
+    # Pairwise products use index tables (from the same pair generators as the per-orientation version) to gather all
+    # the pairs into one stacked tensor and the labels are generated from the same tables
+    def _add_edge_stat_stacks(self,spyr,params,basesize,add_stat_stack):
+        for i in params.edge_range():
+            M = spyr.edge_magnitude_images(i)
+            C = spyr.coarser_magnitude_images(i)  # may be None if coarser images are not present at this level
+            if M is None: continue    # magnitudes were not built since no enabled statistic uses them
+            K = M.size(1)
+            oris = list(range(K))
+            unique_pairs = list(range_unique_pairs(K))
+            ordered_pairs = list(range_distinct_ordered_pairs(K))
+            if self.stat_edge_mean:
+                add_stat_stack(M,'edge_mean',i,oris)
+            if self.stat_edge_variance:
+                add_stat_stack(M.pow(2),'edge_variance',i,oris)
+            if self.stat_edge_kurtosis:
+                add_stat_stack(M.pow(4),'edge_kurtosis',i,oris)
+            if self.stat_edge_autocorrelation:
+                scale = (2**i)*M.size(-1) // basesize[-1]
+                for shift in self.edge_autoshifts:
+                    add_stat_stack(acorr.autocorrelation2d(M,shift,scale),'edge_autocorrelation',i,oris,note=shift)
+            if self.stat_edge_scalecorrelation and C is not None:
+                add_stat_stack(M*C,'edge_correlation',(i,i+1),oris)
+            # edge stop and continue use a different offset for each orientation
+            if self.stat_edge_stop:
+                stopdist = 2**(i)
+                offsets = [(round(stopdist*math.cos(ori*math.pi/K)),round(stopdist*math.sin(ori*math.pi/K))) for ori in oris]
+                add_stat_stack(torch.cat([autodifference2d(M.narrow(1,ori,1),offsets[ori]) for ori in oris],dim=1)**2,'edge_stop',i,oris)
+            if self.stat_edge_continue:
+                cdist = 2**(i+2)              # Note distance if four times greater than distance used for edge stop
+                offsets = [(round(cdist*math.cos(ori*math.pi/K)),round(cdist*math.sin(ori*math.pi/K))) for ori in oris]
+                add_stat_stack(torch.cat([acorr.autocorrelation2d(M.narrow(1,ori,1),offsets[ori]) for ori in oris],dim=1),'edge_continue',i,oris)
+            if self.stat_edge_orientationcorrelation and unique_pairs:
+                (a,b) = zip(*unique_pairs)
+                add_stat_stack(M[:,list(a)]*M[:,list(b)],'edge_correlation',i,unique_pairs)
+            if self.stat_edge_scaleorientationcorrelation and C is not None and ordered_pairs:
+                (a,b) = zip(*ordered_pairs)
+                add_stat_stack(M[:,list(a)]*C[:,list(b)],'edge_correlation',(i,i+1),ordered_pairs)
+                    
+        # Add edge phase statistics
+        for i in params.edge_range():
+            er = spyr.edge_real_images(i)
+            ei = spyr.edge_imag_images(i)
+            #Note: to save some memory we can not build dr and only use the di images.  In this case dr==None even when di is present 
+            dr = spyr.dphase_real_images(i)
+            di = spyr.dphase_imag_images(i)
+            if er is None: continue   # edge images were not built since no enabled statistic uses them
+            K = er.size(1)
+            unique_pairs = list(range_unique_pairs(K))
+            ordered_pairs = list(range_distinct_ordered_pairs(K))
+            if self.stat_phase_orientationcorrelation and unique_pairs:
+                (a,b) = zip(*unique_pairs)
+                add_stat_stack(er[:,list(a)]*er[:,list(b)],'phase_correlation',i,unique_pairs,note='er')
+            if self.stat_phase_scalecorrelation and di is not None:
+                oris = list(range(K))
+                if dr is None:
+                    add_stat_stack(ei*di,'phase_correlation',(i,i+1),oris,note='ei*di')
+                else:
+                    add_stat_stack(er*dr,'phase_correlation',(i,i+1),oris,note='er*dr')
+                add_stat_stack(er*di,'phase_correlation',(i,i+1),oris,note='er*di')
+            if self.stat_phase_scaleorientationcorrelation and di is not None and ordered_pairs:
+                (a,b) = zip(*ordered_pairs)
+                (a,b) = (list(a),list(b))
+                if dr is None:
+                    add_stat_stack(ei[:,a]*di[:,a],'phase_correlation',(i,i+1),ordered_pairs,note='ei*di')  # same pairing as the per-orientation version
+                else:
+                    add_stat_stack(er[:,a]*dr[:,b],'phase_correlation',(i,i+1),ordered_pairs,note='er*dr')
+                add_stat_stack(er[:,a]*di[:,b],'phase_correlation',(i,i+1),ordered_pairs,note='er*di')
         
 ""#END-CLASS------------------------------------
 
@@ -471,11 +713,21 @@ class CrossColorStatistics(MetamerStatistics):
         self.stat_color_low_covariance = True       # Raw (or uncentered) covariance of corresponding images from each color channel
         self.stat_color_edge_covariance = True
         self.stat_color_phase_covariance = True
+        # Compute the products for all channel pairs as one batched tensor (requires all channels to use the same pyramid params)
+        self.batch_channel_pairs = True
         # Some named groups of statistics for convenience
         self.named_stat_groups = { 
                 # categories based on statistics type
                  'crosscolor_stats':('color_low_covariance','color_edge_covariance','color_phase_covariance','color_base_covariance','color_bandpass_covariance'), 
                  }
+        
+    def pyramid_components(self):
+        comps = set()
+        if self.stat_color_bandpass_covariance: comps.add('bandpass')
+        if self.stat_color_low_covariance: comps.add('lowpass')
+        if self.stat_color_edge_covariance: comps.add('edge_magnitude')
+        if self.stat_color_phase_covariance: comps.add('edge')
+        return comps
                     
     # Compute each of the enabled statistics, average it over the pooling regions, and return
     # the result as a list of tensor images (one per statistic)
@@ -494,7 +746,9 @@ class CrossColorStatistics(MetamerStatistics):
             #if len(stats)==5: plot_image(statimg,title=name)
             weight = self.category_weights[catname]
             if self.per_level_weight: weight *= self._level_weight(level)
-            stat = poolfunc.pool_stats(statimg,basesize)
+            profiling.lap('statistic products',catname,level)   # time spent computing statimg since the previous statistic was pooled
+            with profiling.category(catname,level):
+                stat = poolfunc.pool_stats(statimg,basesize)
             stats.append(weight*stat)
             if stat_labels is not None: 
                 stat_labels.append(StatLabel(catname, level, chnames, temporal, note, ori))
@@ -502,8 +756,47 @@ class CrossColorStatistics(MetamerStatistics):
                     statlabel_callback(stat,stat_labels[-1],statimg)
         def _ori_to_list(x): # returns list of tensors for each slice in dimension one, but keeps the same number of dimensions (unlike torch.unbind)
             return [x.narrow(1,ori,1) for ori in range(x.size(1))] if x is not None else None
-        # Iterate over all pairs of channels
-        for (a,b) in range_unique_pairs(len(spyr_list)):
+        pairs = list(range_unique_pairs(len(spyr_list)))
+        if self.batch_channel_pairs and all(str(s.params()) == str(spyr_list[0].params()) for s in spyr_list):
+            # Compute the products for all channel pairs (and orientations) at once as one stacked tensor and pool them in a single call
+            idxA = [a for (a,b) in pairs]
+            idxB = [b for (a,b) in pairs]
+            chnames_list = [(spyr_list[a].cname,spyr_list[b].cname) for (a,b) in pairs]
+            def add_pair_stats(get_image,catname,level,*,oriented=False,note=None):
+                X = torch.cat([get_image(spyr) for spyr in spyr_list])     # channels x orientations x H x W
+                prod = X[idxA]*X[idxB]                                     # pairs x orientations x H x W
+                K = prod.size(1)
+                prod = prod.reshape(-1,1,prod.size(-2),prod.size(-1))      # one single-channel statistic image per (pair,orientation)
+                weight = self.category_weights[catname]
+                if self.per_level_weight: weight *= self._level_weight(level)
+                profiling.lap('statistic products',catname,level)
+                with profiling.category(catname,level):
+                    pooled = poolfunc.pool_stats_batch(prod,basesize)
+                for n,stat in enumerate(pooled):
+                    (p,ori) = divmod(n,K)
+                    stats.append(weight*stat)
+                    if stat_labels is not None:
+                        stat_labels.append(StatLabel(catname, level, chnames_list[p], temporal, note, ori if oriented else None))
+                        if statlabel_callback is not None:
+                            statlabel_callback(stat,stat_labels[-1],prod.narrow(0,n,1))
+            p = spyr_list[0].params()
+            if self.stat_color_base_covariance:
+                add_pair_stats(lambda spyr: spyr.original_image(),'covariance',None)
+            if self.stat_color_bandpass_covariance:
+                for i in p.bandpass_range():
+                    add_pair_stats(lambda spyr: spyr.band_pass_image(i),'bandpass_variance',i)
+            if self.stat_color_low_covariance:
+                for i in p.lowpass_range():
+                    add_pair_stats(lambda spyr: spyr.low_pass_image(i),'covariance',i)
+            if self.stat_color_edge_covariance:
+                for i in p.edge_range():
+                    add_pair_stats(lambda spyr: spyr.edge_magnitude_images(i),'edge_covariance',i,oriented=True)
+            if self.stat_color_phase_covariance:
+                for i in p.edge_range():
+                    add_pair_stats(lambda spyr: spyr.edge_real_images(i),'phase_covariance',i,oriented=True,note='er')
+            return stats
+        # Otherwise iterate over all pairs of channels
+        for (a,b) in pairs:
             A = spyr_list[a]
             B = spyr_list[b]
             p = SPyramidParams.intersection(A.params(),B.params()) # use only levels present in both pyramids
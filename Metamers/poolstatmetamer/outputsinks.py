@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:12:37 2026
+
+Output sinks decide what happens to the images produced by the metamer solver
+and MetamerConfig.  Rather than writing files or plotting images directly, the
+outputs are handed to a sink which can discard them, write them as png files,
+keep them in memory, or collect them into a single npz file.  Images are only
+displayed (plotted) if the sink requests it, so headless batch runs do not pay
+for figure creation or extra image encoding.
+
+The sink receives the final metamer images (and MetamerConfig's warped/unwarped
+gaze images).  Diagnostic files that must be explicitly enabled with the solver's
+save_* modes (step images, convergence movies, loss graphs, profiles) are still
+written directly to the output directory.
+
+@author: bw
+"""
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import os
+import numpy as np
+
+# Base class for output sinks, which also acts as a no-op sink that discards all outputs
+class OutputSink():
+
+    def __init__(self,show_plots=False,save_intermediates=False):
+        self.show_plots = show_plots                  # Display images when the solver/config offers them for visualization
+        self.save_intermediates = save_intermediates  # Also write intermediate images (eg the warped version of gaze metamers)
+
+    # Write an image tensor under the given name (usually a filename relative to the output directory)
+    def write_image(self,image,name,directory=None):
+        pass
+
+    # Display an image, but only if this sink requests visualization
+    def plot_image(self,image,title=None):
+        if self.show_plots:
+            from image_utils import plot_image
+            plot_image(image,title=title)
+
+    # Finish writing any pending outputs
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+""#END-CLASS------------------------------------
+
+# Sink which discards all outputs (useful for benchmarking or when the returned images are all that is needed)
+class NullSink(OutputSink):
+    pass
+
+""#END-CLASS------------------------------------
+
+# Sink which writes each image to a png file (this is the default behavior)
+class PngSink(OutputSink):
+
+    def __init__(self,directory=None,gamma=None,verbose=True,**kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory   # Output directory (or None to use the directory supplied with each image)
+        self.gamma = gamma           # Optional gamma correction applied before saving
+        self.verbose = verbose
+
+    def write_image(self,image,name,directory=None):
+        from image_utils import save_image
+        if self.directory is not None: directory = self.directory
+        path = name if directory is None else os.path.join(os.path.expanduser(directory),name)
+        save_image(image,path,gamma=self.gamma,verbose=self.verbose)
+        return path
+
+""#END-CLASS------------------------------------
+
+# Sink which keeps copies of the images in memory as (cpu) tensors in the images dictionary keyed by name
+class ArraySink(OutputSink):
+
+    def __init__(self,**kwargs):
+        super().__init__(**kwargs)
+        self.images = {}
+
+    def write_image(self,image,name,directory=None):
+        self.images[name] = image.detach().cpu().clone()
+
+""#END-CLASS------------------------------------
+
+# Sink which collects all the images and writes them as arrays to a single (compressed) npz file when closed
+class NpzSink(ArraySink):
+
+    def __init__(self,filename,**kwargs):
+        super().__init__(**kwargs)
+        self.filename = os.path.expanduser(filename)
+
+    def close(self):
+        np.savez_compressed(self.filename,**{name:image.numpy() for name,image in self.images.items()})
+        print(f'Saved {len(self.images)} images to {self.filename}')
+
+""#END-CLASS------------------------------------
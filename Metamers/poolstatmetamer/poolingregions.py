@@ -28,9 +28,8 @@ import collections.abc
 import ast
 import imageblends as blend
 import imagefilters as filters
+import profiling
 from typing import NamedTuple, Optional
-from image_utils import plot_image
-import matplotlib.pyplot as plt
 import numpy as np
 
 # This class specifies the parameters for pooling regions such as width, kernel type, etc.
@@ -248,9 +247,20 @@ class WholeImagePooling(torch.nn.Module):
     
     # Return an image of statistics averaged over each pooling region
     def pool_stats(self,image,original_size=None):
-        if image.dim() > 3 and image.size(3)>1:
-            return image.mean((-1,-2),keepdim=True)  #if it was a batch image, compute mean only over x and y, but not over batch and channel dimensions
-        return image.mean()
+        with profiling.stage('pooling'):
+            if image.dim() > 3 and image.size(3)>1:
+                return image.mean((-1,-2),keepdim=True)  #if it was a batch image, compute mean only over x and y, but not over batch and channel dimensions
+            return image.mean()
+
+    # Pool a batch of statistic images (stacked along the first dimension) in one call
+    # Returns a list with the same result as calling pool_stats() on each image of the batch
+    def pool_stats_batch(self,images,original_size=None):
+        with profiling.stage('pooling'):
+            return list(images.mean((-1,-2),keepdim=True).split(1))
+
+    # Estimated (flops,bytes of memory traffic) for a pool_stats() call on this image
+    def pooling_cost(self,image,original_size=None):
+        return (image.numel(), image.numel()*image.element_size())
     
     def configure_for_downsampling(self,max_dowsampling_factor):
         pass  #nothing to do as we average the whole image regardless of size
@@ -416,6 +426,16 @@ class RegionPooling(torch.nn.Module):
         self.base_image_height = height
         
     def pool_stats(self,image,original_size):
+        with profiling.stage('pooling'):
+            return self._pool_stats(image,original_size)
+
+    # Pool a batch of statistic images (stacked along the first dimension) in one call
+    # Returns a list with the same result as calling pool_stats() on each image of the batch
+    def pool_stats_batch(self,images,original_size):
+        with profiling.stage('pooling'):
+            return list(self._pool_stats(images,original_size).split(1))
+        
+    def _pool_stats(self,image,original_size):
         # If image was downsampled, we need to select the appropriately downsampled kernel to use with it
         original_width = original_size[-1]
         original_height = original_size[-2]
@@ -457,6 +477,48 @@ class RegionPooling(torch.nn.Module):
             raise ValueError(f'Unsupported pad_mode {self.pad_mode}')
         return stat
         
+    # Returns (padded_image,kernel,stride) for pooling an image at its (possibly downsampled) level, always padding explicitly
+    # Used by the sparse pooling, which gathers individual regions from the padded image rather than convolving all of it
+    def _padded_for_level(self,image,original_size):
+        original_width = original_size[-1]
+        original_height = original_size[-2]
+        if original_width != self.base_image_width or original_height != self.base_image_height:
+            self._configure_padding(original_width, original_height)
+        level = original_width.bit_length() - image.size(-1).bit_length()
+        if image.size(-1)<<level != original_width or image.size(-2)<<level != original_height:
+            raise ValueError(f"image downsampling only supported for powers of two {image.size(-1)} vs {original_width}")
+        stride = 1 if self.force_unit_stride else self.base_stride>>level
+        pads = (self.padMinX>>level,self.padMaxX>>level,self.padMinY>>level,self.padMaxY>>level)
+        if self.pad_mode == 'zeros':
+            image = F.pad(image,pads)
+        elif self.pad_mode == 'wrap' or self.pad_mode == 'circular':
+            image = F.pad(image,pads,mode='circular')
+        elif self.pad_mode == 'wrap_x' or self.pad_mode == 'circular_x':
+            image = F.pad(F.pad(image,(0,0,pads[2],pads[3])),(pads[0],pads[1],0,0),mode='circular')
+        elif self.pad_mode == 'wrap_y' or self.pad_mode == 'circular_y':
+            image = F.pad(F.pad(image,(pads[0],pads[1],0,0)),(0,0,pads[2],pads[3]),mode='circular')
+        else:
+            raise ValueError(f'Unsupported pad_mode {self.pad_mode}')
+        return (image,self.kernels[level],stride)
+
+    # Estimated (flops,bytes of memory traffic) for a pool_stats() call on this image (one multiply-add per kernel tap per output)
+    def pooling_cost(self,image,original_size):
+        original_width = original_size[-1]
+        if original_width != self.base_image_width or original_size[-2] != self.base_image_height:
+            self._configure_padding(original_width, original_size[-2])
+        width = image.size(-1)
+        height = image.size(-2)
+        level = original_width.bit_length() - width.bit_length()
+        region_kernel = self.kernels[level]
+        kernY,kernX = region_kernel.size(-2),region_kernel.size(-1)
+        stride = 1 if self.force_unit_stride else self.base_stride>>level
+        outX = (width + (self.padMinX>>level) + (self.padMaxX>>level) - kernX)//stride + 1
+        outY = (height + (self.padMinY>>level) + (self.padMaxY>>level) - kernY)//stride + 1
+        outputs = (image.numel()//(width*height))*outX*outY
+        flops = 2*outputs*kernX*kernY
+        traffic = (image.numel() + outputs + region_kernel.numel())*image.element_size()
+        return (flops, traffic)
+
     # This method takes a pooled state image and interpolates/splats them into a higher resolution image
     # Note: this is not the inverse of pool_stats() but can be very useful for approximating higher resolution stat images
     def blame_stats(self,stat_image,original_size):
@@ -547,7 +609,9 @@ def Trigezoid(pooling_size,stride_fraction=1/4,*,circular=False,pixel_offset=Non
 # Provides a way to simulate having the pooling function vary over the image
 class RegionPoolingList(torch.nn.Module):
     
-    def __init__(self,regionpooling_list,regionweights=None):
+    # sparse - only evaluate the regions with nonzero weight (requires weights), so the cost scales with the number of active
+    #          regions rather than the number of kernels times the image area.  The result then only contains the active regions
+    def __init__(self,regionpooling_list,regionweights=None,sparse=False):
         super().__init__()
         # Stored in a module list so that pytorch can find all the sub-modules
         self.pool_list = torch.nn.ModuleList(regionpooling_list)
@@ -557,13 +621,42 @@ class RegionPoolingList(torch.nn.Module):
             self.weights = torch.nn.ParameterList()
             for w in regionweights:
                 self.weights.append(torch.nn.Parameter(w,requires_grad=False))
+        if sparse and self.weights is None: raise ValueError('Sparse pooling requires region weights')
+        self.sparse = sparse
+        self._gather_cache = {}    # (pool index,padded height,padded width,stride,device) -> (pixel gather indices,active weights)
         
     def configure_for_downsampling(self,max_downsampling_factor):
         for p in self.pool_list:
             p.configure_for_downsampling(max_downsampling_factor)
         
+    # Pixel indices (into the flattened padded image) of every active region's window and the weights of those regions
+    def _active_region_gather(self,i,padded,kernel,stride):
+        key = (i,padded.size(-2),padded.size(-1),stride,padded.device)
+        if key not in self._gather_cache:
+            weight = self.weights[i].reshape(self.weights[i].shape[-2:])
+            regions = weight.nonzero()       # (y,x) indices of the active regions in the pooled output, in row-major order
+            kh,kw = kernel.size(-2),kernel.size(-1)
+            rows = regions[:,0,None]*stride + torch.arange(kh,device=regions.device)[None,:]
+            cols = regions[:,1,None]*stride + torch.arange(kw,device=regions.device)[None,:]
+            index = (rows[:,:,None]*padded.size(-1) + cols[:,None,:]).reshape(regions.size(0),kh*kw)
+            self._gather_cache[key] = (index.to(padded.device),weight[regions[:,0],regions[:,1]].to(padded.device))
+        return self._gather_cache[key]
+
+    # Pool only the active regions by gathering their windows, returns a list with an NxCxA tensor for each pooling
+    def _pool_active_regions(self,image,original_size):
+        with profiling.stage('pooling'):
+            stat_list = []
+            for i,p in enumerate(self.pool_list):
+                (padded,kernel,stride) = p._padded_for_level(image,original_size)
+                (index,weight) = self._active_region_gather(i,padded,kernel,stride)
+                windows = padded.flatten(-2)[...,index]                  # N x C x regions x kernel-pixels
+                stat_list.append(torch.matmul(windows,kernel.reshape(-1))*weight)
+            return stat_list
+
     # Return an image of statistics averaged over each pooling region
     def pool_stats(self,image,original_size):
+        if self.sparse:
+            return torch.cat([stat.reshape(-1) for stat in self._pool_active_regions(image,original_size)])
         stat_list = []
         for i,p in enumerate(self.pool_list):
             stat = p.pool_stats(image,original_size)
@@ -571,6 +664,39 @@ class RegionPoolingList(torch.nn.Module):
             if self.weights is not None: stat = stat*self.weights[i]
             stat_list.append(stat.view(-1))
         return torch.cat(stat_list)
+
+    # Pool a batch of statistic images (stacked along the first dimension) in one call
+    # Returns a list with the same result as calling pool_stats() on each image of the batch
+    def pool_stats_batch(self,images,original_size):
+        if self.sparse:
+            return list(torch.cat([stat.reshape(images.size(0),-1) for stat in self._pool_active_regions(images,original_size)],dim=1).unbind(0))
+        stat_list = []
+        for i,p in enumerate(self.pool_list):
+            stat = p.pool_stats(images,original_size)
+            if self.weights is not None: stat = stat*self.weights[i]
+            stat_list.append(stat.reshape(images.size(0),-1))
+        return list(torch.cat(stat_list,dim=1).unbind(0))
+
+    # Estimated (flops,bytes of memory traffic) for a pool_stats() call, summed over the pooling list (plus the region weighting)
+    def pooling_cost(self,image,original_size):
+        flops = traffic = 0
+        if self.sparse:
+            channels = image.numel()//(image.size(-1)*image.size(-2))
+            for i,p in enumerate(self.pool_list):
+                level = original_size[-1].bit_length() - image.size(-1).bit_length()
+                active = int((self.weights[i] != 0).sum())
+                taps = p.kernels[level].numel()
+                flops += 2*channels*active*taps
+                traffic += (channels*active*taps + active*taps)*image.element_size() + active*taps*8   # windows, kernel, and gather indices
+            return (flops, traffic)
+        for i,p in enumerate(self.pool_list):
+            (f,t) = p.pooling_cost(image,original_size)
+            flops += f
+            traffic += t
+            if self.weights is not None:
+                flops += self.weights[i].numel()
+                traffic += 2*self.weights[i].numel()*self.weights[i].element_size()
+        return (flops, traffic)
         
     # Return the greatest common divisor of pooling regions strides (useful for knowing how much downsampling can be allowed without creating an invalid stride (stride that is not an integer >= 1)
     def min_stride_divisor(self):
@@ -581,11 +707,57 @@ class RegionPoolingList(torch.nn.Module):
 
 ""#END-CLASS------------------------------------
     
+# Wraps another pooling so that only the pixels inside a mask contribute to each pooling region, eg when an
+# image has been padded (see sizeconditioning) the padding should not affect the statistics.  Each region's result
+# is the pooled masked statistic divided by the pooled mask (normalized convolution), and is zero for regions
+# entirely outside the mask.  The mask must be the full-resolution image size and is averaged down for downsampled images
+class MaskedPooling(torch.nn.Module):
+
+    def __init__(self,pooling,mask):
+        super().__init__()
+        self.pooling = pooling
+        while mask.dim() < 4: mask = mask.unsqueeze(0)
+        self.mask = torch.nn.Parameter(mask.float(),requires_grad=False)
+        self._norm_cache = {}     # (height,width,channels,device) -> (mask at that size, pooled mask)
+
+    # Returns the mask at the image's resolution and the pooled mask used to normalize its statistics
+    def _mask_and_norm(self,image,original_size):
+        key = (image.size(-2),image.size(-1),image.size(1),image.device)
+        if key not in self._norm_cache:
+            mask = self.mask.to(image.device)
+            reduction = mask.size(-1)//image.size(-1)
+            if reduction > 1: mask = F.avg_pool2d(mask,reduction)
+            if mask.shape[-2:] != image.shape[-2:]: raise ValueError(f'Mask size {tuple(self.mask.shape[-2:])} does not match image size {tuple(image.shape[-2:])}')
+            norm = self.pooling.pool_stats(mask.expand(1,image.size(1),-1,-1),original_size)
+            self._norm_cache[key] = (mask,norm.clamp(min=1e-12))
+        return self._norm_cache[key]
+
+    def pool_stats(self,image,original_size):
+        (mask,norm) = self._mask_and_norm(image,original_size)
+        return self.pooling.pool_stats(image*mask,original_size)/norm
+
+    def pool_stats_batch(self,images,original_size):
+        (mask,norm) = self._mask_and_norm(images,original_size)
+        return [stat/norm for stat in self.pooling.pool_stats_batch(images*mask,original_size)]
+
+    def pooling_cost(self,image,original_size):
+        (flops,traffic) = self.pooling.pooling_cost(image,original_size)
+        return (flops + 2*image.numel(), traffic + 2*image.numel()*image.element_size())   # plus masking and normalization
+
+    def configure_for_downsampling(self,max_downsampling_factor):
+        self._norm_cache.clear()
+        self.pooling.configure_for_downsampling(max_downsampling_factor)
+
+    def min_stride_divisor(self):
+        return self.pooling.min_stride_divisor()
+
+""#END-CLASS------------------------------------
+    
 # Given an image where each pixel has the desired pool_size and a list of region pooling kernels
 # Build combined pooling list where each kernel is restricted to image regions where its
 # kernel size is equal to or larger than the local desired pool_size
 # poolsize_image must be the same size as the images it will be used on
-def VariableRegionPooling(poolsize_image,kernel_list):
+def VariableRegionPooling(poolsize_image,kernel_list,sparse=False):
     while poolsize_image.dim() < 4: poolsize_image = poolsize_image.unsqueeze(0)
     ones = torch.ones_like(poolsize_image)
     k_list = []
@@ -605,7 +777,7 @@ def VariableRegionPooling(poolsize_image,kernel_list):
         if (weight.sum() > 0):
             k_list.append(k)
             w_list.append(weight)
-    return RegionPoolingList(k_list,w_list)
+    return RegionPoolingList(k_list,w_list,sparse=sparse)
 
 
 # Some utility data structures for specifying the gaze point in various ways
@@ -647,7 +819,7 @@ def make_uniform_pooling(pooling_size,stride_fraction=1/4,pixel_offset=None):
 # Returns tuple of (poolingobject,copymask) where the pooling object implements the pooling regions and the copymask
 # specifies the (gaze-centered) region that should just be copied verbatim from the reference (or None if region is empty)
 def make_gaze_centric_pooling(pooling_sizes,target_image,gazepoint,
-                              eccentricity_scaling=0.5,stride_fraction=1/4, pixel_offset=None):
+                              eccentricity_scaling=0.5,stride_fraction=1/4, pixel_offset=None, sparse=False):
     if isinstance(pooling_sizes,(int,float)): pooling_sizes = [pooling_sizes]    #convert to list if pooling_size was given as a single number
     # if no gaze point was given or there is only one pooling size return uniform (same) pooling everywhere 
     if (gazepoint is None) or (len(pooling_sizes)==1):
@@ -703,7 +875,7 @@ def make_gaze_centric_pooling(pooling_sizes,target_image,gazepoint,
             weightlist.append(weight)
     
     # construct the combined size pooing object and return it along with the copy mask
-    pooling = RegionPoolingList(kernlist,weightlist)
+    pooling = RegionPoolingList(kernlist,weightlist,sparse=sparse)
     return (pooling,copymask)        
     
 def _testmain():
@@ -727,6 +899,7 @@ def _testcircular():
         plot_image(k.pool_stats(image,image.size()),title=pm)
     
 def plot_image(image, title=None, cmap='viridis'):
+    import matplotlib.pyplot as plt
     if torch.is_tensor(image):
         image = image.squeeze().detach().cpu().numpy()
     plt.imshow(image, cmap=cmap)
@@ -736,6 +909,7 @@ def plot_image(image, title=None, cmap='viridis'):
 
 
 def visualize_pooling(original_image, pooled_image, pooling_params):
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(1, 2, figsize=(12, 6))
 
     # Plot original image
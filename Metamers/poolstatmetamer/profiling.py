@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:21:05 2026
+
+Opt-in per-stage timing for the metamer solver.  Code marks the stages it wants timed
+(eg pyramid FFTs, statistic products, pooling, loss, backward) using profiling.stage(name),
+which does nothing unless a StageProfiler has been activated.  When profiling on the GPU
+the stages are timed using CUDA events (so asynchronous kernel execution is measured
+correctly), otherwise a wall-clock timer is used.
+
+Stages can be nested and the report gives both the total time and the self time (ie
+excluding nested stages) for each stage, plus a breakdown by statistic category.
+Results can be exported as JSON or in the Chrome trace format (viewable in chrome://tracing
+or https://ui.perfetto.dev).
+
+Example:
+    prof = StageProfiler(device)
+    with profiling.activate(prof):
+        ... solve ...
+    prof.print_report()
+    prof.save_chrome_trace('trace.json')
+
+@author: bw
+"""
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import time
+import json
+import contextlib
+import torch
+
+_active_profiler = None                   # Profiler that currently receives the stage timings (None means profiling is off)
+_null_context = contextlib.nullcontext()  # Reusable do-nothing context returned when profiling is off
+
+# Returns the currently active profiler (or None)
+def get_profiler():
+    return _active_profiler
+
+# Make the profiler active within the scope of a with statement (activating None disables profiling)
+@contextlib.contextmanager
+def activate(profiler):
+    global _active_profiler
+    prev = _active_profiler
+    _active_profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _active_profiler = prev
+
+# Time the enclosed code as a stage (with optional statistic category) if profiling is active
+def stage(name,category=None):
+    if _active_profiler is None: return _null_context
+    return _active_profiler.stage(name,category)
+
+# Record the time since the previous stage boundary or lap as a stage (useful for code that is not easily enclosed in a with)
+def lap(name,category=None,level=None):
+    if _active_profiler is not None: _active_profiler.lap(name,category,level)
+
+# Stages opened within this scope (without their own category) will be assigned to the given statistic category (and pyramid level)
+def category(catname,level=None):
+    if _active_profiler is None: return _null_context
+    return _active_profiler.category(catname,level)
+
+
+class StageProfiler():
+
+    def __init__(self,device=None,max_trace_events=200000):
+        device = torch.device(device) if device is not None else torch.device('cpu')
+        self.device = device
+        self.use_cuda_events = (device.type == 'cuda') and torch.cuda.is_available()
+        self.max_trace_events = max_trace_events  # Limit on the stored trace events (the aggregated totals are always complete)
+        self.reset()
+
+    # Clear all recorded timings
+    def reset(self):
+        self._records = []          # Pending records as [name,category,level,start,end,parent_index]
+        self._stack = []            # Indices of the currently open stages
+        self._category_stack = []
+        self._lap_mark = None
+        self._origin = self._now()
+        self.stage_totals = {}      # name -> [count,total_ms,self_ms]
+        self.category_totals = {}   # category -> {name -> [count,total_ms]}
+        self.category_level_totals = {}   # (category,level) -> {name -> [count,total_ms]}
+        self.trace_events = []
+        self.dropped_trace_events = 0
+
+    def _now(self):
+        if self.use_cuda_events:
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            return event
+        return time.perf_counter()
+
+    def _elapsed_ms(self,start,end):
+        if self.use_cuda_events: return start.elapsed_time(end)
+        return 1000*(end-start)
+
+    @contextlib.contextmanager
+    def stage(self,name,category=None):
+        index = self._open(name,category)
+        try:
+            yield
+        finally:
+            self._close(index)
+
+    @contextlib.contextmanager
+    def category(self,catname,level=None):
+        self._category_stack.append((catname,level))
+        try:
+            yield
+        finally:
+            self._category_stack.pop()
+
+    def lap(self,name,category=None,level=None):
+        end = self._now()
+        start = self._lap_mark if self._lap_mark is not None else end
+        self._records.append([name,*self._resolve_category(category,level),start,end,self._stack[-1] if self._stack else None])
+        self._lap_mark = end
+        if not self._stack: self.flush()
+
+    # Returns (category,level) for a new record
+    def _resolve_category(self,category,level=None):
+        if category is not None: return (category,level)
+        if self._category_stack: return self._category_stack[-1]
+        if self._stack: return tuple(self._records[self._stack[-1]][1:3])    # inherit category of the enclosing stage
+        return (None,None)
+
+    def _open(self,name,category):
+        record = [name,*self._resolve_category(category),self._now(),None,self._stack[-1] if self._stack else None]
+        self._records.append(record)
+        self._stack.append(len(self._records)-1)
+        self._lap_mark = record[3]
+        return len(self._records)-1
+
+    def _close(self,index):
+        if not self._stack or self._stack[-1] != index: raise RuntimeError('Profiler stages were not closed in nested order')
+        self._stack.pop()
+        self._records[index][4] = self._now()
+        self._lap_mark = self._records[index][4]
+        if not self._stack: self.flush()    # Outermost stage finished, so fold its records into the totals
+
+    # Resolve the pending (completed) records into the aggregated totals and trace.
+    # For CUDA events this synchronizes with the device, so it is only done when an outermost stage finishes
+    def flush(self):
+        if self._stack or not self._records: return
+        if self.use_cuda_events: torch.cuda.synchronize(self.device)
+        durations = [self._elapsed_ms(r[3],r[4]) for r in self._records]
+        child_ms = [0.0]*len(self._records)
+        for i,r in enumerate(self._records):
+            if r[5] is not None: child_ms[r[5]] += durations[i]
+        for i,(name,cat,level,start,end,parent) in enumerate(self._records):
+            tot = self.stage_totals.setdefault(name,[0,0.0,0.0])
+            tot[0] += 1
+            tot[1] += durations[i]
+            tot[2] += durations[i] - child_ms[i]
+            if cat is not None:
+                ctot = self.category_totals.setdefault(cat,{}).setdefault(name,[0,0.0])
+                ctot[0] += 1
+                ctot[1] += durations[i]
+                ltot = self.category_level_totals.setdefault((cat,level),{}).setdefault(name,[0,0.0])
+                ltot[0] += 1
+                ltot[1] += durations[i]
+            if len(self.trace_events) < self.max_trace_events:
+                event = {'name':name,'cat':cat or 'stage','ph':'X','pid':0,'tid':0,
+                         'ts':1000*self._elapsed_ms(self._origin,start),'dur':1000*durations[i]}
+                if level is not None: event['args'] = {'level':str(level)}
+                self.trace_events.append(event)
+            else:
+                self.dropped_trace_events += 1
+        self._records = []
+
+    # Returns a dictionary with the per-stage and per-category breakdown (times in milliseconds)
+    def summary(self):
+        self.flush()
+        stages = {name:{'count':c,'total_ms':t,'self_ms':s} for name,(c,t,s) in self.stage_totals.items()}
+        categories = {}
+        for cat,entries in self.category_totals.items():
+            categories[cat] = {name:{'count':c,'total_ms':t} for name,(c,t) in entries.items()}
+        return {'device':str(self.device),
+                'timer':'cuda_events' if self.use_cuda_events else 'perf_counter',
+                'stages':stages,
+                'categories':categories}
+
+    def print_report(self,top=None):
+        summary = self.summary()
+        stages = sorted(summary['stages'].items(),key=lambda x:-x[1]['self_ms'])
+        total_self = sum(s['self_ms'] for _,s in stages) or 1
+        print(f"Stage timing ({summary['timer']} on {summary['device']})")
+        print(f"  {'stage':<28}{'count':>8}{'total ms':>12}{'self ms':>12}{'self %':>8}")
+        for name,s in stages[:top]:
+            print(f"  {name:<28}{s['count']:>8}{s['total_ms']:>12.1f}{s['self_ms']:>12.1f}{100*s['self_ms']/total_self:>7.1f}%")
+        if summary['categories']:
+            print('Statistic category timing (ms)')
+            names = sorted({n for entries in summary['categories'].values() for n in entries})
+            print(f"  {'category':<24}"+''.join(f'{n:>14}' for n in names)+f"{'sum':>12}")
+            cats = sorted(summary['categories'].items(),key=lambda x:-sum(e['total_ms'] for e in x[1].values()))
+            for cat,entries in cats:
+                vals = [entries[n]['total_ms'] if n in entries else 0 for n in names]
+                print(f'  {str(cat):<24}'+''.join(f'{v:>14.1f}' for v in vals)+f'{sum(vals):>12.1f}')
+
+    def save_json(self,filename):
+        with open(filename,'w') as f:
+            json.dump(self.summary(),f,indent=1)
+        print(f'Profile summary written to {filename}')
+
+    def save_chrome_trace(self,filename):
+        self.flush()
+        with open(filename,'w') as f:
+            json.dump({'traceEvents':self.trace_events,'displayTimeUnit':'ms',
+                       'otherData':{'device':str(self.device),'dropped_events':self.dropped_trace_events}},f)
+        print(f'Chrome trace written to {filename}')
+
+""#END-CLASS------------------------------------
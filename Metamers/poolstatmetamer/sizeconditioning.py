@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 21:14:52 2026
+
+Conditioning of image sizes so that odd-sized images can still use pyramid downsampling.
+The pyramid can only downsample by factors that divide the image size (and the pooling
+strides), so an image such as 1080x1077 would otherwise get no downsampling at all and
+every coarse pyramid level would run at full resolution.
+
+A SizeConditioner changes the image to the nearest size that is a multiple of the desired
+downsampling factor, either by reflect padding (mode 'pad', the result is later cropped back
+to the original size) or by center cropping (mode 'crop', the result is the cropped size).
+When padding, the statistics should be pooled only over the original image area, which
+is what valid_mask() is for (see poolingregions.MaskedPooling).
+
+Usually enabled via the size_conditioning argument of metamersolver.make_solver()
+
+@author: bw
+"""
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import torch
+import torch.nn.functional as F
+
+class SizeConditioner():
+
+    def __init__(self,image_size,multiple,mode='pad'):
+        (height,width) = (image_size[-2],image_size[-1])
+        self.original_size = (height,width)
+        self.multiple = multiple
+        self.mode = mode
+        if mode == 'pad':
+            size = (-(-height//multiple)*multiple, -(-width//multiple)*multiple)    # round up to a multiple
+        elif mode == 'crop':
+            size = ((height//multiple)*multiple, (width//multiple)*multiple)        # round down to a multiple
+            if min(size) == 0: raise ValueError(f'Image size {self.original_size} is too small to crop to a multiple of {multiple}')
+        else:
+            raise ValueError(f'Unrecognized size conditioning mode: {mode}')
+        self.size = size
+        # Extra (or removed) rows and columns are split evenly between the two sides, as (left,right,top,bottom)
+        dy = abs(size[0]-height)
+        dx = abs(size[1]-width)
+        self.margins = (dx//2, dx-dx//2, dy//2, dy-dy//2)
+
+    def __str__(self):
+        return f'{self.mode} {self.original_size[0]}x{self.original_size[1]} to {self.size[0]}x{self.size[1]}'
+
+    # Returns true if the image size is unchanged (ie conditioning is not needed)
+    def is_identity(self):
+        return self.size == self.original_size
+
+    # Pad or crop an image (or stack of images) from the original size to the conditioned size
+    # In crop mode an image that is already at the cropped size (eg a previous cropped result) is returned unchanged
+    def condition(self,image):
+        if self.mode == 'crop' and tuple(image.shape[-2:]) == self.size: return image
+        if tuple(image.shape[-2:]) != self.original_size: raise ValueError(f'Expected image of size {self.original_size} but got {tuple(image.shape[-2:])}')
+        (left,right,top,bottom) = self.margins
+        if self.mode == 'crop':
+            return image[...,top:top+self.size[0],left:left+self.size[1]]
+        # reflect padding requires the padding to be smaller than the image, otherwise just replicate the boundary pixels
+        reflect = max(left,right) < image.size(-1) and max(top,bottom) < image.size(-2)
+        return F.pad(image,self.margins,mode='reflect' if reflect else 'replicate')
+
+    # Condition a boolean mask (eg the pixels to copy from the target)
+    def condition_mask(self,mask):
+        return self.condition(mask.float()) > 0.5
+
+    # Convert a conditioned image back to the original size (for padding), a cropped image is returned unchanged
+    def restore(self,image):
+        if self.mode == 'crop': return image
+        (left,right,top,bottom) = self.margins
+        return image[...,top:top+self.original_size[0],left:left+self.original_size[1]]
+
+    # Mask at the conditioned size that is one inside the original image area and zero in any padding
+    def valid_mask(self,device=None):
+        mask = torch.zeros(1,1,*self.size,device=device)
+        if self.mode == 'crop': return mask+1
+        (left,right,top,bottom) = self.margins
+        mask[...,top:top+self.original_size[0],left:left+self.original_size[1]] = 1
+        return mask
+
+""#END-CLASS------------------------------------
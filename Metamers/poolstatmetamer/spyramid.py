@@ -53,11 +53,24 @@ functional (has not been tested in a while).
 
 
 import torch
+import math
 import collections.abc
+import copy
 import spyramid_filters as spf
-from fft_utils import fftshift2d,ifftshift2d,freq_downsample2d, rfft_shim2d, irfft_shim2d, ifft_shim2d
+import profiling
+from fft_utils import fftshift2d,ifftshift2d,freq_downsample2d, rfft_shim2d, irfft_shim2d, ifft_shim2d, fft_friendly_size
 from image_utils import plot_image
 
+# Names of the component image types that a pyramid can contain (beyond its original image).  Statistics can report which
+# of these they read (see MetamerStatistics.pyramid_components) so the builders can skip the ones nobody uses
+#   bandpass, lowpass - the band-pass and low-pass images
+#   edge - the complex (real and imaginary) edge images
+#   edge_magnitude - magnitudes of the edge images
+#   coarser_magnitude, coarser_dphase - edge magnitude and phase-doubled images from the next coarser level (for cross-scale statistics)
+PYRAMID_COMPONENTS = frozenset(('bandpass','lowpass','edge','edge_magnitude','coarser_magnitude','coarser_dphase'))
+# Components that require the complex edge images to be built
+EDGE_COMPONENTS = frozenset(('edge','edge_magnitude','coarser_magnitude','coarser_dphase'))
+
 # This class specifies the parameters for a steerable pyramid such as which
 # types of images to generate and at which levels in the pyramid
 class SPyramidParams():
@@ -304,6 +317,7 @@ class SPyramid():
                  colorname=None, temporalname=None,
                  max_reduction=1,
                  avoid_dr=True,
+                 components=None,       #Set of component types to generate (from PYRAMID_COMPONENTS), None means all of them
                  ):
         super().__init__()
         assert isinstance(params,SPyramidParams)
@@ -326,6 +340,8 @@ class SPyramid():
         self.coarser_dphase_real = []   # phase doubled edge images from next levels (real part)  Can be avoided to save some memory (using imaginary parts instead)
         self.coarser_dphase_imag = []   # phase doubled edge images from next levels (imaginary part)
         self.max_reduction = max_reduction # Largest image reduction factor used in the pyramid
+        if components is None: components = PYRAMID_COMPONENTS
+        self.components = components    # Component types present in this pyramid (skipped components are stored as None)
 #        self.start_level = start_edge_level  # Starting level used for pyramid (default is zero)
 #        self.start_highband_level = start_highband_level # Starting level for highbandpass images
         if avoid_dr:
@@ -357,21 +373,23 @@ class SPyramid():
         # Generate derived edge images
         for (re,im) in zip(self.edge_real,self.edge_imag):
             mag = None
-            if re is not None:
+            if re is not None and 'edge_magnitude' in components:
                 # We add a tiny epsilon to ensure argument to sqrt() is >0,  (sqrt(0) produces NaNs in its gradient calculatons and if used as a denominator) 
                 mag = torch.sqrt(re*re + im*im + torch.finfo(re.dtype).tiny)
             self.edge_magn.append(mag)
         if make_crossscale:
             # construct phase-doubled images from next coarser scales edge-filtered images
             # note: phase-doubling swaps the even/odd-ness of the edge filter (because our filters are defined to be imaginary-valued)
+            want_magn = 'coarser_magnitude' in components
+            want_dphase = 'coarser_dphase' in components
             for (re,im) in zip(coarser_edgereallist,coarser_edgeimaglist):
-                if re is not None:
+                if re is not None and (want_magn or want_dphase):
                     # We add a tiny epsilon to ensure argument to sqrt() is >0,  (sqrt(0) produces NaNs in its gradient calculatons and if used as a denominator) 
                     mag = torch.sqrt(re*re + im*im + torch.finfo(re.dtype).tiny)
-                    self.coarser_magn.append(mag)
+                    self.coarser_magn.append(mag if want_magn else None)
                     if not avoid_dr:
-                        self.coarser_dphase_real.append( (re*re-im*im)/mag )
-                    self.coarser_dphase_imag.append( (2*re*im)/mag )
+                        self.coarser_dphase_real.append( (re*re-im*im)/mag if want_dphase else None )
+                    self.coarser_dphase_imag.append( (2*re*im)/mag if want_dphase else None )
                 else:
                     self.coarser_magn.append(None)
                     if not avoid_dr:
@@ -380,12 +398,12 @@ class SPyramid():
         def _check_range(l,r):
             for i,x in enumerate(l):
                 assert (x is not None) if i in r else (x is None)
-        _check_range(self.bandpass,self._params.bandpass_range())
-        _check_range(self.lowpass,self._params.lowpass_range())
-        _check_range(self.edge_real,self._params.edge_range())
-        _check_range(self.edge_magn,self._params.edge_range())
+        _check_range(self.bandpass,self._params.bandpass_range() if 'bandpass' in components else ())
+        _check_range(self.lowpass,self._params.lowpass_range() if 'lowpass' in components else ())
+        _check_range(self.edge_real,self._params.edge_range() if components & EDGE_COMPONENTS else ())
+        _check_range(self.edge_magn,self._params.edge_range() if 'edge_magnitude' in components else ())
         if make_crossscale:
-            _check_range(self.coarser_magn,self._params.crossscale_edge_range())
+            _check_range(self.coarser_magn,self._params.crossscale_edge_range() if 'coarser_magnitude' in components else ())
 
     def original_image(self):
         return self.image
@@ -419,6 +437,17 @@ class SPyramid():
         return self.coarser_dphase_imag[level]
     
     def params(self): return self._params
+
+    # Returns the pyramid for one image of a pyramid that was built from a batch of images (images stacked in the first dimension)
+    def select_batch(self,index,colorname=None):
+        spyr = copy.copy(self)
+        def _select(x): return x.narrow(0,index,1) if x is not None else None
+        spyr.image = _select(self.image)
+        for attr in ('bandpass','lowpass','edge_real','edge_imag','edge_magn','coarser_magn','coarser_dphase_real','coarser_dphase_imag'):
+            images = getattr(self,attr)
+            if images is not None: setattr(spyr,attr,[_select(x) for x in images])
+        if colorname is not None: spyr.cname = colorname
+        return spyr
     
     def plot_component_images(self):
         plot_image(self.original_image(),title='original image')
@@ -447,6 +476,7 @@ class SPyramid():
 # Note: Has not been used in a while and may not be up to date
 # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
 # !!! We reccomend that you use SPyramidFourierBuilder instead !!!
+# !!! or SPyramidConvolutionalBuilder for spatial convolution  !!!
 # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
 class SPyramidConvolutionalBuilder_experimental(torch.nn.Module):
     
@@ -557,13 +587,20 @@ class SPyramidFourierBuilder(torch.nn.Module):
     
     # This method needs to know the size of the images so it can prebuild its fourier filters
     def __init__(self,image_size,params,
-                 downsample=True,max_downsample_factor=64):
+                 downsample=True,max_downsample_factor=64,
+                 fft_friendly_padding=False):  # Enlarge the padding so the padded size has only small prime factors (faster FFTs)
+                                               # but this changes the statistics near zero boundaries, so it is opt-in
         super().__init__()
         params = SPyramidParams.normalize(params)
         unionparams = SPyramidParams.union(params) # Take union of pyramid parameters so we can construct according to any of the specified sets of parameters
         self.filters_bandpass = None    # list of band-pass filters (first is the traditional high pass filter)
         self.filters_lowpass = None     # list of low-pass filters, finest to coarsest
         self.filters_edge = None        # list of stacks of edge filters for each level (real part)
+        # The filters for downsampled levels are stored already cropped to the (lowest) frequency range used at that level
+        # and these lists give the reduction factor each level's filter was cropped by (1 means full size)
+        self.reduction_bandpass = None
+        self.reduction_lowpass = None
+        self.reduction_edge = None
         if not downsample: max_downsample_factor = 1     # If not downsampling, then max reduction factor is one
         self.max_downsample_factor = max_downsample_factor
         self.pad_mode = 'constant'
@@ -580,25 +617,67 @@ class SPyramidFourierBuilder(torch.nn.Module):
         else: raise ValueError(f'Unrecognized boundary mode: {boundary}')
 #        elif isinstance(pad_boundary,str): self.pad_mode = pad_boundary
 #        else: self.padX = self.padY = pad_boundary
+        # Actual padding used as (left,right,top,bottom), which may be larger than padX,padY and asymmetric
+        (height,width) = self._image_hw(image_size)
+        self.padding = (*self._choose_padding(width,self.padX,fft_friendly_padding),*self._choose_padding(height,self.padY,fft_friendly_padding))
         self._build_fourier_filters(image_size,unionparams)
         self.params_map = params
             
+    @staticmethod
+    def _image_hw(image_size):
+        if isinstance(image_size,torch.Tensor): image_size = image_size.size()  # If input was an image, convert it to a size
+        return (image_size[-2],image_size[-1])    #Keep only last two dimensions (height,width) as size
+    
+    # Returns the (before,after) padding for one image dimension given its minimum padding per side.
+    # If fft_friendly, the padding is increased to make the padded size a product of small primes, while keeping both
+    # paddings multiples of the largest reduction factor (so the padding can be removed exactly from the downsampled images)
+    def _choose_padding(self,size,pad,fft_friendly):
+        if pad == 0 or not fft_friendly: return (pad,pad)    # no padding means wraparound boundaries, so keep the size unchanged
+        step = math.gcd(pad,self.max_downsample_factor)
+        extra = fft_friendly_size(size+2*pad,step) - size
+        before = pad + ((extra-2*pad)//(2*step))*step
+        return (before,extra-before)
+        
+    # Size of the image after its boundary padding (ie the size the fourier filters are built for)
+    def _padded_size(self,image_size):
+        (height,width) = self._image_hw(image_size)
+        (left,right,top,bottom) = self.padding
+        return (height+top+bottom, width+left+right)
+        
     # Build fourier space filters (must match size of actual image they will be applied to)
     def _build_fourier_filters(self,image_size,uparams):
-        if isinstance(image_size,torch.Tensor): image_size = image_size.size()  # If input was an image, convert it to a size
-        if len(image_size) > 2:
-            image_size = (image_size[-2],image_size[-1])   #Keep only last two dimensions (height,width) as size
-        # Add zero padding of the boundaries if needed
-        image_size = (image_size[0]+2*self.padY, image_size[1]+2*self.padX)
         # We store the filters as parameters in parameterlist so module superclass can move them to GPU etc.
         def _wrap(filt):
             return torch.nn.Parameter(filt,requires_grad=False)
-        minstart = uparams.min_start_level()
         maxstop = uparams.max_stop_level()
         self.filters_lowpass = torch.nn.ParameterList([None]*maxstop)  # list of low-pass filters, finest to coarsest
         self.filters_edge = torch.nn.ParameterList([None]*maxstop)     # list of stacks of edge filters for each level (real part)
         self.filters_bandpass = torch.nn.ParameterList([None]*maxstop) # list of band-pass filters
-        
+        self.reduction_bandpass = [1]*maxstop
+        self.reduction_lowpass = [1]*maxstop
+        self.reduction_edge = [1]*maxstop
+        designs = self._design_fourier_filters(self._padded_size(image_size),uparams)
+        # Filters are cropped to their level's reduction factor, since the frequencies outside that range are discarded anyway
+        for i in uparams.bandpass_range():
+            self.reduction_bandpass[i] = self._reduction_factor(i)
+            self.filters_bandpass[i] = _wrap(self._convert_real_filter(designs['bandpass',i],self.reduction_bandpass[i]))
+#            plot_image(self.filters_bandpass[i][0,:,:,:,0],f'bandpass filter {i}')
+        for i in uparams.lowpass_range():
+            self.reduction_lowpass[i] = self._reduction_factor(i)
+            self.filters_lowpass[i] = _wrap(self._convert_real_filter(designs['lowpass',i],self.reduction_lowpass[i]))
+        for i in uparams.edge_range():
+            # edge levels may also be needed at the finer level's resolution (for cross-scale statistics)
+            reduction = self._reduction_factor(i-1 if i > uparams.edge_start else i)
+            self.reduction_edge[i] = reduction
+            self.filters_edge[i] = _wrap(self._convert_stacked_filters(designs['edge',i],reduction))
+#            plot_image(self.filters_edge[i][0,0,:,:,0],f'edge filter {i}')
+            
+    # Design the (centered and full size) fourier filters for the requested pyramid levels and return them as
+    # a dictionary mapping (component,level) to its filter, where the component is 'bandpass', 'lowpass', or 'edge'
+    def _design_fourier_filters(self,image_size,uparams):
+        minstart = uparams.min_start_level()
+        maxstop = uparams.max_stop_level()
+        designs = {}
         # create the low-pass and high-pass filters that we will need to build the other filters
         hi_f = [None]*maxstop
         lo_f = [None]*maxstop
@@ -629,12 +708,11 @@ class SPyramidFourierBuilder(torch.nn.Module):
         # create the band-pass filters for required levels (note: level zero is a special case since it is limited by image resolution rather than a low-pass filter)
         for i in uparams.bandpass_range():
             prev_lo_f = lo_f[i-1] if i>0 else 1
-            self.filters_bandpass[i] = _wrap(self._convert_real_filter(prev_lo_f*hi_f[i]))
-#            plot_image(self.filters_bandpass[i][0,:,:,:,0],f'bandpass filter {i}')
+            designs['bandpass',i] = prev_lo_f*hi_f[i]
         # create the low-pass filters for required levels
         for i in uparams.lowpass_range():
             prev_lo_f = lo_f[i-1] if i>0 else 1
-            self.filters_lowpass[i] = _wrap(self._convert_real_filter(prev_lo_f))
+            designs['lowpass',i] = prev_lo_f
         # create oriented edge filters for required levels
         # Create azimuthal or oriented filters used in constructing edge filters        
         azimuthal_f = spf.create_fourier_oriented_imaginary_filters(size=image_size,orientations=uparams.orientations)
@@ -643,99 +721,156 @@ class SPyramidFourierBuilder(torch.nn.Module):
         #  since we need both components we swap the two edge images back during build stage (and the negation doesn't matter for us)
         for i in uparams.edge_range():
             prev_lo_f = lo_f[i-1] if i>0 else 1
-            self.filters_edge[i] = _wrap(self._convert_stacked_filters(prev_lo_f*hi_f[i]*azimuthal_f))
-#            plot_image(self._convert_real_filter(prev_lo_f*hi_f[i])[0,:,:,:,0],f'bandpass filter {i}')
-#            plot_image(self.filters_edge[i][0,0,:,:,0],f'edge filter {i}')
+            designs['edge',i] = prev_lo_f*hi_f[i]*azimuthal_f
 #            plot_image(self._convert_stacked_filters(azimuthal_f)[0,0,:,:,0],f'azimuthal filter')
+        return designs
             
     @staticmethod
-    def _convert_real_filter(fourier):
-        # Shift filter into defualt fft format and add dimensions for image, channel, and complex-component
-        return ifftshift2d(fourier)[None,None,:,:,None]
+    def _convert_real_filter(fourier,reduction=1):
+        # Shift filter into defualt fft format, crop to the reduced frequency range, and add dimensions for image, channel, and complex-component
+        return freq_downsample2d(ifftshift2d(fourier),reduction)[None,None,:,:,None]
     
     @staticmethod
-    def _convert_stacked_filters(fourier):
-        # Shift filter into defualt fft format and add dimensions for image, channel, and complex-component
-        return ifftshift2d(fourier)[None,:,:,:,None]
+    def _convert_stacked_filters(fourier,reduction=1):
+        # Shift filter into defualt fft format, crop to the reduced frequency range, and add dimensions for image, channel, and complex-component
+        return freq_downsample2d(ifftshift2d(fourier),reduction)[None,:,:,:,None]
+    
+    # Degree of image downsampling used for a level (when enabled)
+    def _reduction_factor(self,level):
+        return min(2**max(level+self.downsample_kernel_bias,0),self.max_downsample_factor)
             
     # Build a steerable pyramid for the given image
     #  params - Specifies which image levels and types to build in the pyramid
     #  make_crossscale - Should we generate the images used for cross-scale correlations (phase-double and reduction matched images for neighboring scales)
-    def build_spyramid(self, image, *, colorname='', temporalname='', params=None, make_crossscale=True):
+    #  components - Optional set of component types to build (see PYRAMID_COMPONENTS), None builds them all.
+    #               The filtering, inverse FFTs, and derived images for the other components are skipped
+    def build_spyramid(self, image, *, colorname='', temporalname='', params=None, make_crossscale=True, components=None):
+        with profiling.stage('pyramid build'):
+            return self._build_spyramid(image,colorname=colorname,temporalname=temporalname,params=params,make_crossscale=make_crossscale,components=components)
+        
+    # Build the steerable pyramids for every channel of a multi-channel image (eg 1x3xHxW) and return them as a list
+    # The channels are stacked as a batch so that each band needs only one FFT multiply and inverse FFT for all the channels
+    # (falls back to building each channel separately if the channels use different pyramid parameters)
+    def build_spyramid_channels(self, image, colornames, *, temporalname='', make_crossscale=True, components=None):
+        params = [SPyramidParams.select_for_channel(cname, self.params_map) for cname in colornames]
+        if image.size(0) != 1 or any(str(p) != str(params[0]) for p in params):
+            return [self.build_spyramid(image.narrow(1,c,1),colorname=cname,temporalname=temporalname,make_crossscale=make_crossscale,components=components)
+                    for c,cname in enumerate(colornames)]
+        with profiling.stage('pyramid build'):
+            spyr = self._build_spyramid(image.transpose(0,1),colorname=colornames[0],temporalname=temporalname,
+                                        params=params[0],make_crossscale=make_crossscale,components=components)
+            return [spyr.select_batch(c,cname) for c,cname in enumerate(colornames)]
+        
+    def _build_spyramid(self, image, *, colorname='', temporalname='', params=None, make_crossscale=True, components=None):
         if params is None:
             params = SPyramidParams.select_for_channel(colorname, self.params_map)
-        orig_image = image
-        # Pad image boundary with zeros (if needed)
-        padX = self.padX
-        padY = self.padY
-        if (padX != 0) or (padY != 0):   # Pad image by adding extra elements around the boundary
-            image = torch.nn.functional.pad(image,(padX,padX,padY,padY),mode=self.pad_mode)  
-        def unpad(image,reduction=1):            # Function to removed padding after filering and IFFT
-            #return image
-            if (padX != 0) or (padY != 0):
-                prX = padX//reduction
-                prY = padY//reduction
-                return torch.nn.functional.pad(image,(-prX,-prX,-prY,-prY))
-            else:
-                return image
-        # Used for selecting degree of image downsampling (when enabled)
-        def reduction_factor(level):
-            return min(2**max(level+self.downsample_kernel_bias,0),self.max_downsample_factor)
-        # Compute FFT of image
-#        freq_img = torch.rfft(image,2,onesided=False)
-        freq_img = rfft_shim2d(image)  #Use shim for new FFT API
-        # Apply various filters by multiplication and then use inverse FFT to get results
+        if components is None: components = PYRAMID_COMPONENTS
+        # Are the coarser-level edge images (for cross-scale statistics) needed?
+        make_coarser = make_crossscale and ('coarser_magnitude' in components or 'coarser_dphase' in components)
+        reduction_factor = self._reduction_factor
+        # The image spectrum cropped to the frequency range of each (pre-cropped) filter, so the discarded frequencies are never filtered
+        # It is computed on first use (so it is skipped entirely if no filters need it)
+        cropped_spectra = {}
+        def spectrum(reduction):
+            if 1 not in cropped_spectra:
+                padded = image
+                if any(self.padding):   # Pad image boundary with zeros (if needed)
+                    padded = torch.nn.functional.pad(image,self.padding,mode=self.pad_mode)
+                with profiling.stage('pyramid fft'):
+#                    cropped_spectra[1] = torch.rfft(padded,2,onesided=False)
+                    cropped_spectra[1] = rfft_shim2d(padded)  #Use shim for new FFT API
+            if reduction not in cropped_spectra: cropped_spectra[reduction] = freq_downsample2d(cropped_spectra[1],reduction)
+            return cropped_spectra[reduction]
         maxstop = params.max_stop_level()
         # Build requested bandpass images
         bandlist = [None]*maxstop
-        for i in params.bandpass_range():
-            freq_bandp = freq_img*self.filters_bandpass[i]
-            reduction = reduction_factor(i)
-            if reduction > 1: freq_bandp = freq_downsample2d(freq_bandp,reduction)/(reduction**2)
-            bandlist[i] = unpad(irfft_shim2d(freq_bandp),reduction)
-            del freq_bandp
+        for i in (params.bandpass_range() if 'bandpass' in components else ()):
+            bandlist[i] = self._filter_real('bandpass',i,reduction_factor(i),image,spectrum)
         # Build requested lowpass images
         lowlist = [None]*maxstop
-        for i in params.lowpass_range():
-            freq_lowp = freq_img*self.filters_lowpass[i]
-            reduction = reduction_factor(i)
-            # Optionally reduce image size by removing high frequencies (and compensating for reduced size of image)
-            if reduction > 1: freq_lowp = freq_downsample2d(freq_lowp,reduction)/(reduction**2)
-            lowlist[i] = unpad(irfft_shim2d(freq_lowp),reduction)
-            del freq_lowp  #allow freq_lowp to be garbage collected here
+        for i in (params.lowpass_range() if 'lowpass' in components else ()):
+            lowlist[i] = self._filter_real('lowpass',i,reduction_factor(i),image,spectrum)
         # Build requested oriented edge images
         edgereal = [None]*maxstop          # List of edge images for each scale (real part)
         edgeimag = [None]*maxstop          # List of edge images for each scale (imaginary part)
         edgereal_ncs = [None]*maxstop      # List of next-coarser-scale edge images (real part) used for cross-scale correlations
         edgeimag_ncs = [None]*maxstop      # List of next-coarser-scale edge images (imaginary part)
-        prev_reduction = None
         max_reduction = 1
-        for i in params.edge_range():
-            freq_edge = freq_img*self.filters_edge[i]
+        for i in (params.edge_range() if components & EDGE_COMPONENTS else ()):
             reduction = reduction_factor(i)
-            if reduction > 1:
-                edge_c = ifft_shim2d(freq_downsample2d(freq_edge,reduction)/(reduction**2))
-            else:
-                edge_c = ifft_shim2d(freq_edge)
-            edgereal[i] = unpad(edge_c[:,:,:,:,1],reduction) #note swap back of real and imaginary components here
-            edgeimag[i] = unpad(edge_c[:,:,:,:,0],reduction)
-            del edge_c
-            # If the finer scale edge level exists and we want cross-scale correlations, then store a version of this edge image matching the finer scales resolution and index
-            if (i>0) and (edgereal[i-1] is not None) and make_crossscale:  # are the next higher frequency edge images present?
-                prev_reduction = reduction_factor(i-1)
-                if reduction != prev_reduction:     
-                    # If previous level used a different reduction factor, then create a matching version (for cross-scale correlations)
-                    #freq_parent = freq_downsample2d(freq_edge,prev_reduction)/(prev_reduction**2)
-                    edge_parent = ifft_shim2d(freq_downsample2d(freq_edge,prev_reduction)/(prev_reduction**2))
-                    edgereal_ncs[i-1] = unpad(edge_parent[:,:,:,:,1],prev_reduction)
-                    edgeimag_ncs[i-1] = unpad(edge_parent[:,:,:,:,0],prev_reduction)
-                    del edge_parent
+            # If the finer scale edge level exists and we want cross-scale correlations, then we also need a version of this edge image matching the finer scales resolution and index
+            make_parent = (i>0) and (edgereal[i-1] is not None) and make_coarser   # are the next higher frequency edge images present?
+            prev_reduction = reduction_factor(i-1) if make_parent else reduction
+            # If the image resolution did not change, then just reuse the already created edge images
+            reductions = (reduction,) if prev_reduction == reduction else (reduction,prev_reduction)
+            edges = self._filter_edge(i,reductions,image,spectrum)
+            (edgereal[i],edgeimag[i]) = edges[0]
+            if make_parent: (edgereal_ncs[i-1],edgeimag_ncs[i-1]) = edges[-1]
+            del edges
+        del cropped_spectra
+        with profiling.stage('pyramid magnitude/phase'):  # SPyramid derives the edge magnitude and phase-doubled images
+            return SPyramid(image,params,bandlist,lowlist,edgereal,edgeimag,edgereal_ncs,edgeimag_ncs,colorname=colorname,temporalname=temporalname,make_crossscale=make_crossscale,max_reduction=max_reduction,
+                           components=components)
+
+    # Remove the boundary padding from a filtered image (with the given reduction factor)
+    def _unpad(self,image,reduction=1):
+        if any(self.padding):
+            return torch.nn.functional.pad(image,tuple(-(p//reduction) for p in self.padding))
+        return image
+        
+    # Apply a level's band-pass or low-pass filter (kind is 'bandpass' or 'lowpass') and return the result at the given reduction factor
+    #  spectrum(r) returns the padded image's spectrum cropped by the reduction factor r
+    def _filter_real(self,kind,level,reduction,image,spectrum):
+        if kind == 'bandpass':
+            (filt,fred) = (self.filters_bandpass[level],self.reduction_bandpass[level])
+        else:
+            (filt,fred) = (self.filters_lowpass[level],self.reduction_lowpass[level])
+        freq = spectrum(fred)*filt
+        # Optionally reduce image size by removing high frequencies (and compensating for reduced size of image)
+        if reduction > 1: freq = freq_downsample2d(freq,reduction//fred)/(reduction**2)
+        with profiling.stage('pyramid ifft'):
+            return self._unpad(irfft_shim2d(freq),reduction)
+        
+    # Apply a level's oriented edge filters and return a list of (real,imaginary) edge images, one for each requested reduction factor
+    def _filter_edge(self,level,reductions,image,spectrum):
+        fred = self.reduction_edge[level]
+        freq_edge = spectrum(fred)*self.filters_edge[level]
+        results = []
+        for reduction in reductions:
+            with profiling.stage('pyramid ifft'):
+                if reduction > 1:
+                    edge_c = ifft_shim2d(freq_downsample2d(freq_edge,reduction//fred)/(reduction**2))
                 else:
-                    # If image resolution did not change, then just reuse the already created edge images
-                    edgereal_ncs[i-1] = edgereal[i] 
-                    edgeimag_ncs[i-1] = edgeimag[i]
-            del freq_edge  # allow image to be garbage collected here
-        return SPyramid(orig_image,params,bandlist,lowlist,edgereal,edgeimag,edgereal_ncs,edgeimag_ncs,colorname=colorname,temporalname=temporalname,make_crossscale=make_crossscale,max_reduction=max_reduction)
+                    edge_c = ifft_shim2d(freq_edge)
+            results.append((self._unpad(edge_c[:,:,:,:,1],reduction),   #note swap back of real and imaginary components here
+                            self._unpad(edge_c[:,:,:,:,0],reduction)))
+            del edge_c
+        return results
+
+    # Estimate the memory (in bytes) used when building one pyramid of an image with this size (per channel)
+    # Returns (retained,transient) where retained is the pyramid images kept afterwards (ie needed for the statistics
+    # and their gradients) and transient is the peak of the temporary spectra used while building it
+    def estimate_memory(self, image_size, *, element_size=4, params=None, make_crossscale=True, colorname='', components=None):
+        if params is None: params = SPyramidParams.select_for_channel(colorname, self.params_map)
+        if components is None: components = PYRAMID_COMPONENTS
+        height,width = image_size[-2],image_size[-1]
+        padded = (height+self.padding[2]+self.padding[3])*(width+self.padding[0]+self.padding[1])
+        def area(level):
+            reduction = self._reduction_factor(level)
+            return (height//reduction)*(width//reduction)
+        ori = params.orientations
+        has_edges = len(params.edge_range()) > 0 and bool(components & EDGE_COMPONENTS)
+        retained = 0
+        if 'bandpass' in components: retained += sum(area(i) for i in params.bandpass_range())
+        if 'lowpass' in components: retained += sum(area(i) for i in params.lowpass_range())
+        if has_edges:   # edge real, imaginary, and (optionally) magnitude
+            retained += sum((3 if 'edge_magnitude' in components else 2)*ori*area(i) for i in params.edge_range())
+        coarser = ('coarser_magnitude' in components) + ('coarser_dphase' in components)
+        if make_crossscale and coarser > 0:
+            retained += sum((2+coarser)*ori*area(i) for i in params.crossscale_edge_range())  # coarser real, imaginary, plus magnitude and/or phase-doubled
+        transient = 2*padded                                                       # complex spectrum of the image
+        if has_edges: transient += 2*ori*padded//(self.reduction_edge[params.edge_start]**2) + 2*ori*area(params.edge_start)  # filtered edge spectra and their inverse
+        return (retained*element_size, transient*element_size)
 
     def high_pass_filter(self):
         return self.filters_highbandpass[0]
@@ -752,6 +887,141 @@ class SPyramidFourierBuilder(torch.nn.Module):
     
 ""#END-CLASS------------------------------------
 
+# Object that builds the same steerable pyramids as SPyramidFourierBuilder, but can use spatial convolution instead of FFTs for some levels
+# The fourier filters are converted to convolution kernels (trimmed to keep most of their energy) and downsampled levels use strided 
+# convolution.  Small kernels applied to large images can be cheaper than full size FFTs (particularly on cpus), so each level uses
+# whichever method has the lower estimated cost (or all levels can be forced to use one method).
+# Results match the fourier builder except for the kernel trimming and at zero boundaries, where this computes the exact linear 
+# convolution rather than the FFT of a padded image (these are identical when the kernel fits within the padding)
+class SPyramidConvolutionalBuilder(SPyramidFourierBuilder):
+    
+    def __init__(self,image_size,params,
+                 downsample=True,max_downsample_factor=64,fft_friendly_padding=False,*,
+                 method='auto',            # 'auto' chooses each level's method by estimated cost, or use 'spatial' or 'fourier' for all levels
+                 kernel_energy=0.999,      # Fraction of each filter's energy kept when trimming it to a convolution kernel
+                 spatial_cost_scale=1.0):  # Cost of a convolution flop relative to an FFT flop (to calibrate the chooser for a device)
+        super().__init__(image_size,params,downsample,max_downsample_factor,fft_friendly_padding)
+        if method not in ('auto','spatial','fourier'): raise ValueError(f'Unrecognized pyramid method: {method}')
+        uparams = SPyramidParams.union(self.params_map)
+        maxstop = uparams.max_stop_level()
+        def _wrap(filt):
+            return torch.nn.Parameter(filt,requires_grad=False)
+        designs = self._design_fourier_filters(self._padded_size(image_size),uparams)
+        kernels = {key:self._spatial_kernel(filt,kernel_energy) for key,filt in designs.items()}
+        self.level_methods = self._choose_methods(method,uparams,kernels,self._image_hw(image_size),spatial_cost_scale)
+        self.kernels_bandpass = torch.nn.ParameterList([None]*maxstop)  # convolution kernels for the levels that use the spatial method
+        self.kernels_lowpass = torch.nn.ParameterList([None]*maxstop)
+        self.kernels_edge = torch.nn.ParameterList([None]*maxstop)      # real edge kernels for each orientation followed by the imaginary ones
+        for (kind,i),kernel in kernels.items():
+            if self.level_methods[i] != 'spatial': continue
+            getattr(self,'kernels_'+kind)[i] = _wrap(kernel)
+            getattr(self,'filters_'+kind)[i] = None    # the fourier filter is no longer needed
+            
+    # Convert a centered fourier filter (or stack of oriented filters) into a trimmed convolution kernel stack of size Nx1xKxK
+    # The edge filters are stored as real filters (see _design_fourier_filters) so their kernels are complex, and we keep both
+    # parts in the order of the edge images they produce (ie imaginary parts for the real edge images followed by the real parts)
+    @staticmethod
+    def _spatial_kernel(fourier,energy):
+        stacked = fourier.dim() == 3
+        if not stacked: fourier = fourier.unsqueeze(0)
+        comp = fftshift2d(ifft_shim2d(torch.stack((ifftshift2d(fourier),torch.zeros_like(fourier)),dim=-1)))
+        parts = torch.cat((comp[...,1],comp[...,0])) if stacked else comp[...,0]   # the real filters have purely real kernels
+        (height,width) = parts.shape[-2:]
+        (cy,cx) = (height//2,width//2)      # location of the kernel's origin
+        # Find the smallest centered square that keeps the requested fraction of every kernel's energy
+        dist = torch.max((torch.arange(height)-cy).abs()[:,None],(torch.arange(width)-cx).abs()[None,:])   # distance from origin (L-infinity)
+        maxdist = min(cy,cx,height-1-cy,width-1-cx)
+        ring_energy = torch.zeros(parts.size(0),int(dist.max())+1,dtype=parts.dtype).index_add_(1,dist.flatten(),(parts**2).flatten(1))
+        kept = ring_energy.cumsum(1) / ring_energy.sum(1,keepdim=True).clamp(min=torch.finfo(parts.dtype).tiny)
+        radius = min(int((kept < energy).sum(1).max()),maxdist)
+        trimmed = parts[:,cy-radius:cy+radius+1,cx-radius:cx+radius+1]
+        # Restore each kernel's sum (ie its response to a constant image) after trimming
+        kernels = []
+        for kern,target in zip(trimmed,parts.sum((-2,-1)).tolist()):
+            if (kern > 0).any() and (kern < 0).any(): kern = spf.adjust_sum_convolutional_filter(kern,target)
+            kernels.append(kern)
+        # conv2d actually computes correlations so we flip the kernels
+        return torch.stack(kernels).flip(-2,-1).unsqueeze(1)
+    
+    # Choose the method ('fourier' or 'spatial') for each level by comparing their estimated costs in flops, where
+    # FFTs are estimated as 5*N*log2(N) flops and convolution as 2 flops per kernel element per output pixel
+    def _choose_methods(self,method,uparams,kernels,image_hw,spatial_cost_scale):
+        (height,width) = image_hw
+        (ph,pw) = self._padded_size(image_hw)
+        def fft_cost(area,count=1): return 5*area*math.log2(max(area,2))*count
+        maxstop = uparams.max_stop_level()
+        fourier = [0]*maxstop
+        spatial = [0]*maxstop
+        feasible = [True]*maxstop
+        for (kind,i),kernel in kernels.items():
+            reduction = self._reduction_factor(i)
+            reductions = {reduction}
+            if kind == 'edge' and i > uparams.edge_start: reductions.add(self._reduction_factor(i-1))  # cross-scale version of the edges
+            count = kernel.size(0)      # number of kernels (the edge kernels produce both the real and imaginary edge images)
+            nfilt = count//2 if kind == 'edge' else 1
+            fred = getattr(self,'reduction_'+kind)[i]
+            fourier[i] += 6*nfilt*(ph//fred)*(pw//fred)     # complex multiply of the cropped spectrum
+            for r in reductions:
+                fourier[i] += fft_cost((ph//r)*(pw//r),nfilt)
+                spatial[i] += spatial_cost_scale*2*kernel.size(-1)**2*count*(height//r)*(width//r)
+            # wraparound boundaries use circular padding which cannot be larger than the image
+            radius = kernel.size(-1)//2
+            if (self.padX == 0 and radius >= width) or (self.padY == 0 and radius >= height): feasible[i] = False
+        levels = sorted(set(i for (_,i) in kernels))
+        methods = [None]*maxstop
+        for i in levels:
+            if method == 'auto':
+                methods[i] = 'spatial' if feasible[i] and spatial[i] < fourier[i] else 'fourier'
+            else:
+                methods[i] = 'spatial' if method == 'spatial' and feasible[i] else 'fourier'
+        if method == 'auto' and 'fourier' in methods and all(feasible[i] for i in levels):
+            # The image's forward FFT is shared by all the fourier levels and only avoided if every level is spatial
+            mixed = fft_cost(ph*pw) + sum(spatial[i] if methods[i] == 'spatial' else fourier[i] for i in levels)
+            if sum(spatial[i] for i in levels) < mixed:
+                for i in levels: methods[i] = 'spatial'
+        return methods
+    
+    # Returns a short description of the method used for each level (and its kernel size for spatial levels)
+    def method_summary(self):
+        desc = []
+        for i,m in enumerate(self.level_methods):
+            if m is None: continue
+            if m == 'spatial':
+                kern = next(k for k in (self.kernels_bandpass[i],self.kernels_lowpass[i],self.kernels_edge[i]) if k is not None)
+                m = f'spatial({kern.size(-1)}x{kern.size(-1)})'
+            desc.append(f'{i}:{m}')
+        return ' '.join(desc)
+    
+    # Convolve an image with a stack of kernels (Nx1xKxK) and sample the results every reduction pixels
+    def _convolve(self,image,kernel,reduction):
+        radius = kernel.size(-1)//2
+        (b,c,h,w) = image.shape
+        x = image.reshape(b*c,1,h,w)
+        # zero boundaries, or wraparound boundaries to match the fourier builder's unpadded directions
+        x = torch.nn.functional.pad(x,(radius,radius,0,0),mode='circular' if self.padX == 0 else 'constant')
+        x = torch.nn.functional.pad(x,(0,0,radius,radius),mode='circular' if self.padY == 0 else 'constant')
+        res = torch.nn.functional.conv2d(x,kernel,stride=reduction)
+        return res.reshape(b,c*kernel.size(0),res.size(-2),res.size(-1))
+        
+    def _filter_real(self,kind,level,reduction,image,spectrum):
+        if self.level_methods[level] != 'spatial': return super()._filter_real(kind,level,reduction,image,spectrum)
+        kernel = self.kernels_bandpass[level] if kind == 'bandpass' else self.kernels_lowpass[level]
+        with profiling.stage('pyramid convolution'):
+            return self._convolve(image,kernel,reduction)
+        
+    def _filter_edge(self,level,reductions,image,spectrum):
+        if self.level_methods[level] != 'spatial': return super()._filter_edge(level,reductions,image,spectrum)
+        kernel = self.kernels_edge[level]
+        ori = kernel.size(0)//2
+        results = []
+        with profiling.stage('pyramid convolution'):
+            for reduction in reductions:
+                edges = self._convolve(image,kernel,reduction)
+                results.append((edges[:,:ori],edges[:,ori:]))
+        return results
+    
+""#END-CLASS------------------------------------
+
 # Low pass filter an image in approximately the same way it would be done in 
 # a steerable pyramid at the given level.  Does not construct other pyramid components
 # Currently this does not use the GPU and has not been optimized for efficiency
@@ -957,7 +1227,7 @@ def plot_candidate_kernels():
     plot_image(unoriented_img,title=f'Bandpass unoriented kernel',savefile=f'bandpass_unoriented_kernel.png',)
     
 if __name__ == "__main__":   # execute main() only if run as a script
-    from image_utils import load_image_gray, plot_image, plot_images, plot_image_channels, plot_image_stack
+    from image_utils import load_image_gray, plot_images
 #    test_fourier()
 #    test_downsample()
 #    test_circular()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 18:02:14 2026
+
+Per-statistic cost accounting.  Breaks the cost of evaluating the statistics down by
+statistic category and pyramid level (ie by (StatLabel.weight_category,StatLabel.level))
+and reports for each:
+    the number of statistics and pooled values,
+    estimated flops and memory traffic of the statistic products (the source images being pooled),
+    estimated flops and memory traffic of pooling them,
+    the measured time of the products and of the pooling (from a profiling.StageProfiler),
+    and optionally the contribution of these statistics to the loss.
+This is intended to help choose which statistics are worth their cost for a given target.
+
+The flops and traffic are analytic estimates (from the tensor sizes and pooling kernels), not
+hardware counters, and the times are for a forward evaluation only (no backward pass).
+The cost of building the pyramids is shared by all statistics and is reported separately.
+
+Usually generated via StatisticsEvaluator.measure_costs() or MetamerImageSolver.statistic_cost_report()
+
+@author: bw
+"""
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import json
+from metamerstatgroups import level_to_str
+
+# Estimated cost of creating a statistic's product image as (flops per element, number of input tensors read)
+#  eg variance is one multiply of one input (x*x), while a correlation multiplies two different inputs
+PRODUCT_COSTS = {'mean':(0,0), 'edge_mean':(0,0),   # these pool a pyramid image directly
+                 'variance':(1,1), 'bandpass_variance':(1,1), 'edge_variance':(1,1),
+                 'skew':(2,1), 'kurtosis':(2,1), 'edge_kurtosis':(2,1),
+                 'autocorrelation':(1,2), 'edge_autocorrelation':(1,2), 'edge_continue':(1,2),
+                 'edge_correlation':(1,2), 'phase_correlation':(1,2),
+                 'covariance':(1,2), 'edge_covariance':(1,2), 'phase_covariance':(1,2),
+                 'edge_stop':(2,2)}
+DEFAULT_PRODUCT_COST = (1,2)
+
+# Statlabel callback that accumulates the estimated costs of each statistic by (category,level)
+#  poolfuncs maps temporal channel names to the pooling used for them (or can be a single pooling object)
+class StatCostRecorder():
+
+    def __init__(self,poolfuncs,original_size):
+        self.poolfuncs = poolfuncs
+        self.original_size = original_size
+        self.entries = {}     # (category,level) -> dictionary of accumulated counts and costs
+        self.accepts_missing_statimg = True    # statistics computed without an image just have no product or pooling costs
+
+    def _poolfunc(self,label):
+        if not isinstance(self.poolfuncs,dict): return self.poolfuncs
+        return self.poolfuncs.get(label.temporal,next(iter(self.poolfuncs.values())))
+
+    # Called for each statistic as it is evaluated (only does some cheap arithmetic so it adds little to the measured times)
+    def __call__(self,stat,label,statimg):
+        key = (label.weight_category,label.level)
+        e = self.entries.get(key)
+        if e is None:
+            e = self.entries[key] = {'count':0,'values':0,'product_flops':0,'product_bytes':0,'pool_flops':0,'pool_bytes':0}
+        e['count'] += 1
+        e['values'] += stat.numel()
+        if statimg is None: return    # computed without a statistic image (eg GrayscaleStatistics' whole-image fast path)
+        (flops_per,reads) = PRODUCT_COSTS.get(label.weight_category,DEFAULT_PRODUCT_COST)
+        numel = statimg.numel()
+        e['product_flops'] += flops_per*numel
+        if reads > 0: e['product_bytes'] += (reads+1)*numel*statimg.element_size()
+        (flops,traffic) = self._poolfunc(label).pooling_cost(statimg,self.original_size)
+        e['pool_flops'] += flops
+        e['pool_bytes'] += traffic
+
+""#END-CLASS------------------------------------
+
+# Combines the estimated costs, measured times, and (optionally) loss contributions into a per-(category,level) report
+class StatCostReport():
+
+    def __init__(self,recorder,profiler=None):
+        self.entries = {key:dict(e) for key,e in recorder.entries.items()}
+        self.timer = None
+        self.pyramid_ms = None      # Time to build the pyramids (shared by all statistics)
+        if profiler is not None:
+            summary = profiler.summary()
+            self.timer = f"{summary['timer']} on {summary['device']}"
+            if 'pyramid build' in summary['stages']: self.pyramid_ms = summary['stages']['pyramid build']['total_ms']
+            for key,e in self.entries.items():
+                times = profiler.category_level_totals.get(key,{})
+                e['product_ms'] = times['statistic products'][1] if 'statistic products' in times else 0.0
+                e['pool_ms'] = times['pooling'][1] if 'pooling' in times else 0.0
+        self.has_losses = False
+
+    # Set the loss contributions from a dictionary mapping (category,level) to loss (eg from MetamerImageSolver.compute_loss_groups)
+    def set_losses(self,losses):
+        total = sum(losses.values())
+        for key,e in self.entries.items():
+            e['loss'] = float(losses.get(key,0))
+            e['loss_fraction'] = e['loss']/total if total > 0 else 0.0
+        self.has_losses = True
+
+    def _sorted_keys(self):
+        return sorted(self.entries,key=lambda k:(k[0],-1 if k[1] is None else (k[1] if isinstance(k[1],int) else min(k[1])),str(k[1])))
+
+    def print_report(self):
+        timed = self.timer is not None
+        total_ms = sum(e.get('product_ms',0)+e.get('pool_ms',0) for e in self.entries.values()) or 1
+        header = f"  {'category':<22}{'level':>6}{'count':>7}{'values':>9}{'prod MFLOP':>12}{'prod MB':>10}{'pool MFLOP':>12}{'pool MB':>10}"
+        if timed: header += f"{'prod ms':>10}{'pool ms':>10}{'time %':>8}"
+        if self.has_losses: header += f"{'loss':>12}{'loss %':>8}"
+        print('Statistic costs by category and level' + (f' ({self.timer})' if timed else ''))
+        if self.pyramid_ms is not None: print(f'  Pyramid building (shared by all statistics): {self.pyramid_ms:.1f} ms')
+        print(header)
+        for key in self._sorted_keys():
+            e = self.entries[key]
+            line = (f"  {key[0]:<22}{level_to_str(key[1]):>6}{e['count']:>7}{e['values']:>9}{e['product_flops']/1e6:>12.2f}{e['product_bytes']/1e6:>10.2f}"
+                    f"{e['pool_flops']/1e6:>12.2f}{e['pool_bytes']/1e6:>10.2f}")
+            if timed: line += f"{e['product_ms']:>10.2f}{e['pool_ms']:>10.2f}{100*(e['product_ms']+e['pool_ms'])/total_ms:>7.1f}%"
+            if self.has_losses: line += f"{e['loss']:>12.4g}{100*e['loss_fraction']:>7.1f}%"
+            print(line)
+
+    # Returns the report as a json-compatible dictionary (keyed by "category level" strings)
+    def to_dict(self):
+        return {'timer':self.timer,
+                'pyramid_ms':self.pyramid_ms,
+                'statistics':{f'{key[0]} {level_to_str(key[1])}':dict(e,category=key[0],level=key[1]) for key,e in self.entries.items()}}
+
+    def save_json(self,filename):
+        with open(filename,'w') as f:
+            json.dump(self.to_dict(),f,indent=1)
+        print(f'Statistic costs written to {filename}')
+
+""#END-CLASS------------------------------------
@@ -19,7 +19,11 @@ strings.
 # Released under an open-source MIT license, see LICENSE file for details
 
 import sys
-sys.path.append('../poolstatmetamer')  # Hack to allow importing from poolstatmetamer sibling package/directory
+try:
+    import poolstatmetamer   # installed package (eg via "pip install -e ." in the Metamers directory)
+    sys.path.append(poolstatmetamer.package_dir)   # its modules import each other by their bare names
+except ImportError:
+    sys.path.append('../poolstatmetamer')  # Hack to allow importing from poolstatmetamer sibling package/directory
 from metamerconfig import MetamerConfig, generate_image_schedule, seed_const_half
 
 import matplotlib.pyplot as plt
@@ -86,7 +90,8 @@ iters = 300
 #generate_image_schedule('../sampleimages/cat256.png',FreemanWarpSched,color=True,max_iters=iters,basename='cat')
 
 
-generate_image_schedule('../sampleimages/shashi.jpg', OurGazeWarpSched, color=True, max_iters=iters, basename='good1')
-generate_image_schedule('../sampleimages/bigben.jpg', OurGazeWarpSched, color=True, max_iters=iters, basename='good2')
-generate_image_schedule('../sampleimages/EIN.jpg', OurGazeWarpSched, color=True, max_iters=iters, basename='good3')
-generate_image_schedule('../sampleimages/buffon.png', OurGazeWarpSched, color=True, max_iters=iters, basename='good4')
\ No newline at end of file
+if __name__ == "__main__":   # only generate the metamers when run as a script
+    generate_image_schedule('../sampleimages/shashi.jpg', OurGazeWarpSched, color=True, max_iters=iters, basename='good1')
+    generate_image_schedule('../sampleimages/bigben.jpg', OurGazeWarpSched, color=True, max_iters=iters, basename='good2')
+    generate_image_schedule('../sampleimages/EIN.jpg', OurGazeWarpSched, color=True, max_iters=iters, basename='good3')
+    generate_image_schedule('../sampleimages/buffon.png', OurGazeWarpSched, color=True, max_iters=iters, basename='good4')
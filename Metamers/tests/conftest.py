@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+# Shared setup for the tests, which compare the optimized code paths against the original ones on tiny images (cpu only)
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','poolstatmetamer'))  # allow importing from the sibling poolstatmetamer directory
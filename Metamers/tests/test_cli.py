@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Tests for the batch-generation command line interface (see cli.py)
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import os
+import io
+import sys
+import subprocess
+import contextlib
+import torch
+import cli
+from image_utils import save_image, load_image_rgb
+
+def test_multigaze_manifest_with_copy_original(tmp_path):
+    save_image(torch.rand(1,3,64,64,generator=torch.Generator().manual_seed(0)),str(tmp_path/'target.png'),verbose=False)
+    (tmp_path/'manifest.txt').write_text('target.png tgt 0.5,0.5 0.3,0.6\n')
+    outdir = tmp_path/'out'
+    args = ['-m',str(tmp_path/'manifest.txt'),'-o',str(outdir),'--iters','1','--device','cpu','--copy-original',
+            '--pooling','32:Kern=Trig:mesa=1/2:stride=1/2:Bound=wrap_x','--pyramid','UBbbbL_6:Ori=4:Bound=wrap_x','--warping','FS_gaze_warp']
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert cli.main(args) == 0
+    options = {'pyramid':'UBbbbL_6:Ori=4:Bound=wrap_x','pooling':'32','warping':'FS_gaze_warp','stats':'','suffix':'_pmet',
+               'seed':'random','randseed':0,'copy_original':True,'device':'cpu','verbose':False}
+    job = cli.read_manifest(str(tmp_path/'manifest.txt'))[0]
+    outputs = cli.expected_outputs(job,cli.build_schedule(options),str(outdir))
+    assert len(outputs) == 4     # the copy and the metamer for each of the two gaze points
+    assert all(os.path.exists(f) for f in outputs)
+    original = load_image_rgb(str(tmp_path/'target.png'))
+    assert torch.equal(load_image_rgb(str(outdir/'tgt_original_gaze1.png')),original)
+
+def test_package_import_leaves_search_path_alone():
+    metamers_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..')
+    code = ('import sys,poolstatmetamer; assert poolstatmetamer.package_dir not in sys.path; '
+            'import poolstatmetamer.cli; assert poolstatmetamer.package_dir in sys.path')
+    subprocess.run([sys.executable,'-c',code],cwd=metamers_dir,check=True)
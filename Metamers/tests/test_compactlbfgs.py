@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Tests for the L-BFGS optimizer with compact history storage (see compactlbfgs.py)
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import pytest
+import torch
+from compactlbfgs import CompactLBFGS
+from test_metamersolver import solve
+
+# Minimize a random convex quadratic, returning the loss at each step and the final solution
+def minimize_quadratic(make_optimizer,steps=15):
+    gen = torch.Generator().manual_seed(0)
+    A = torch.randn(50,50,generator=gen)
+    A = A@A.T/50 + 0.1*torch.eye(50)
+    b = torch.randn(50,generator=gen)
+    x = torch.zeros(50,requires_grad=True)
+    optimizer = make_optimizer([x])
+    def closure():
+        optimizer.zero_grad()
+        loss = 0.5*x@A@x - b@x
+        loss.backward()
+        return loss
+    losses = torch.tensor([float(optimizer.step(closure)) for _ in range(steps)])
+    return (losses,x.detach())
+
+@pytest.mark.parametrize('max_iter',[1,20])
+def test_float32_history_matches_torch_lbfgs(max_iter):
+    (expected_losses,expected_x) = minimize_quadratic(lambda p: torch.optim.LBFGS(p,max_iter=max_iter,history_size=10,tolerance_grad=1e-9))
+    (losses,x) = minimize_quadratic(lambda p: CompactLBFGS(p,max_iter=max_iter,history_size=10,tolerance_grad=1e-9))
+    assert torch.allclose(losses,expected_losses)
+    assert torch.allclose(x,expected_x)
+
+def test_bfloat16_history_converges():
+    (expected_losses,_) = minimize_quadratic(lambda p: torch.optim.LBFGS(p,max_iter=1,history_size=10,tolerance_grad=1e-9))
+    (losses,_) = minimize_quadratic(lambda p: CompactLBFGS(p,max_iter=1,history_size=10,tolerance_grad=1e-9,
+                                                           history_dtype='bfloat16',chunk_size=7))   # small chunks to exercise the chunking
+    assert abs(losses[-1]-expected_losses[-1]) < 1e-3*abs(expected_losses[-1])
+
+def test_solver_history_modes():
+    gen = torch.Generator().manual_seed(0)
+    target = torch.rand(1,1,64,64,generator=gen)
+    seed = torch.rand(1,1,64,64,generator=gen)
+    default = solve(target,seed,4)
+    # float32 history on the same device takes the CompactLBFGS path but should follow torch's LBFGS
+    compact = solve(target,seed,4,lbfgs_history_device='cpu')
+    assert torch.allclose(torch.tensor(compact.loss_history),torch.tensor(default.loss_history),rtol=1e-4)
+    reduced = solve(target,seed,4,lbfgs_history_dtype='bfloat16')
+    assert reduced.loss_history[-1] < 0.5*reduced.loss_history[0]
+
+# 'cpu:0' does not compare equal to the parameters' 'cpu' device, so it exercises the offloading code without a gpu
+@pytest.mark.parametrize('history_device',['cpu','cpu:0'] + (['cuda'] if torch.cuda.is_available() else []))
+def test_history_device_with_other_dtype(history_device):
+    (expected_losses,expected_x) = minimize_quadratic(lambda p: torch.optim.LBFGS(p,max_iter=1,history_size=10,tolerance_grad=1e-9))
+    optimizers = []
+    def make_optimizer(params):
+        optimizers.append(CompactLBFGS(params,max_iter=1,history_size=10,tolerance_grad=1e-9,history_dtype='bfloat16',
+                                       history_device=history_device,chunk_size=7))
+        return optimizers[0]
+    (losses,x) = minimize_quadratic(make_optimizer)
+    optimizer = optimizers[0]
+    assert optimizer._offloading() == (history_device != 'cpu')
+    assert optimizer.device_history_element_size == (0 if optimizer._offloading() else 2)
+    stored = optimizer.state[optimizer._params[0]]['old_dirs']
+    assert stored and all(v.dtype == torch.bfloat16 and v.device.type == torch.device(history_device).type for v in stored)
+    assert x.device == torch.device('cpu')
+    assert abs(losses[-1]-expected_losses[-1]) < 1e-3*abs(expected_losses[-1])
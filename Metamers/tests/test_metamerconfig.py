@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Tests for metamer configurations (see metamerconfig.py)
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import io
+import contextlib
+import torch
+import pytest
+import poolingregions as pool
+import outputsinks
+from metamerconfig import MetamerConfig, seed_const_half, seed_motion_compensated, estimate_block_motion
+
+def test_multigaze_copy_original_writes_target():
+    sink = outputsinks.ArraySink()
+    config = MetamerConfig('_original',copy_original=True,warping='warp=0.75:anisotropy=2',pyramid='UBbbbbbL_8_:Ori=4:Bound=wrap_x',
+                           device='cpu',output_sink=sink)
+    target = torch.rand(1,3,64,64)
+    gazes = [pool.NormalizedPoint(0.5,0.5),pool.NormalizedPoint(0.3,0.6)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        config.generate_multigaze_metamers(target,gazes,32,outfile='copy.png')
+    for k in range(len(gazes)):
+        assert torch.equal(sink.images[f'copy_gaze{k}.png'],target)
+        assert f'copy_gaze{k}.png.unwarped.png' in sink.images
+
+def _warped_config(sink):
+    return MetamerConfig('',warping='warp=0.75:anisotropy=2',pyramid='UBbbbbbL_8_:Ori=4:Bound=wrap_x',device='cpu',output_sink=sink)
+
+def test_multigaze_matches_single_gaze_solves():
+    torch.manual_seed(0)
+    target = torch.rand(1,1,64,64)
+    gazes = [pool.NormalizedPoint(0.5,0.5),pool.NormalizedPoint(0.3,0.6)]
+    sink = outputsinks.ArraySink()
+    with contextlib.redirect_stdout(io.StringIO()):
+        _warped_config(sink).generate_multigaze_metamers(target,gazes,32,seed_image=seed_const_half,max_iters=1,outfile='multi.png')
+        singles = []
+        for gaze in gazes:
+            single_sink = outputsinks.ArraySink()
+            _warped_config(single_sink).generate_image_metamer(target,32,seed_image=seed_const_half,max_iters=1,gaze_point=gaze,outfile='single.png')
+            singles.append(single_sink.images['single.png'])
+    # the batch shares one optimizer so only the first step is identical to separate solves (later steps share the line search)
+    for k,single in enumerate(singles):
+        assert torch.allclose(sink.images[f'multi_gaze{k}.png'],single,atol=1e-3)
+    assert not torch.allclose(singles[0],singles[1],atol=1e-1)
+
+def test_multigaze_rejects_gaze_centric_pooling():
+    gazes = [pool.NormalizedPoint(0.5,0.5),pool.NormalizedPoint(0.3,0.6)]
+    with pytest.raises(ValueError,match='same pooling'):
+        _warped_config(outputsinks.NullSink()).generate_multigaze_metamers(torch.rand(1,1,64,64),gazes,[16,32],outfile=None)
+
+def smooth_image(seed,size=64):
+    noise = torch.rand(1,1,size//4,size//4,generator=torch.Generator().manual_seed(seed))
+    return torch.nn.functional.interpolate(noise,size=(size,size),mode='bicubic',align_corners=False)
+
+def test_block_motion_recovers_integer_shift():
+    (dx,dy) = (3,-2)
+    previous = smooth_image(3)
+    current = torch.roll(previous,(-dy,-dx),(-2,-1))     # current(p) = previous(p + (dx,dy)) away from the wrapped borders
+    motion = estimate_block_motion(previous,current)
+    inner = (0,0,slice(16,-16),slice(16,-16))
+    assert torch.all(motion[0,0,16:-16,16:-16] == dx) and torch.all(motion[0,1,16:-16,16:-16] == dy)
+    prev_metamer = smooth_image(4)
+    seed = seed_motion_compensated(current,metamer_prior_frames=[prev_metamer],target_prior_frames=[previous])
+    expected = torch.roll(prev_metamer,(-dy,-dx),(-2,-1))
+    assert torch.allclose(seed[inner],expected[inner],atol=1e-5)
+
+# Records the number of prior metamer frames given to each frame of a movie
+class PriorFramesRecorder(MetamerConfig):
+    def generate_image_metamer(self,target_image,*args,metamer_prior_frames=(),**kwargs):
+        self.prior_counts.append(len(metamer_prior_frames))
+        return super().generate_image_metamer(target_image,*args,metamer_prior_frames=metamer_prior_frames,**kwargs)
+
+def test_movie_keeps_prior_frames_only_when_needed(tmp_path):
+    frames = [smooth_image(k) for k in range(3)]
+    counts = {}
+    for mode in (True,'motion'):
+        config = PriorFramesRecorder('',device='cpu',output_sink=outputsinks.NullSink())
+        config.prior_counts = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            config.generate_movie_metamer(frames,32,max_iters=0,outbasename=None,outdir=str(tmp_path),use_prior_as_seed=mode)
+        counts[mode] = config.prior_counts
+    assert counts[True] == [0,0,0]        # still statistics use no prior frames, so none are kept for seeding either
+    assert counts['motion'] == [0,1,1]
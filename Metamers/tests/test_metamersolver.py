@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Tests for the metamer solver (see metamersolver.py)
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import io
+import contextlib
+import torch
+from metamersolver import make_solver, MetamerImage
+
+QUIET_MODES = {'print_num_statistics':False,'print_elapsed_time':False,'print_loss':False,'step_print_loss':False}
+
+def solve(target,seed,iterations,copymask=None,**modes):
+    with contextlib.redirect_stdout(io.StringIO()):
+        solver = make_solver(target,32,outfile=None)
+        for (mode,value) in {**QUIET_MODES,'device':'cpu',**modes}.items(): solver.set_mode(mode,value)
+        return solver.solve_for_metamer(target,iterations,seed.clone(),copy_target_mask=copymask)
+
+def center_mask(size,radius):
+    (ys,xs) = torch.meshgrid(torch.arange(size[-2]),torch.arange(size[-1]),indexing='ij')
+    return (((ys-size[-2]/2)**2 + (xs-size[-1]/2)**2) < radius**2).expand(size)
+
+def test_pack_unpack_round_trip():
+    image = torch.rand(1,3,16,16)
+    mask = center_mask(image.shape,5)
+    met = MetamerImage(image.clone())
+    met.copy_and_freeze_pixels_(torch.zeros_like(image),mask)
+    expected = met().detach().clone()
+    met.pack_trainable_pixels_()
+    assert met.trainable_tensor() is met.packed
+    assert met.packed.numel() == int((~mask).sum())
+    assert torch.equal(met(),expected)
+    met.unpack_trainable_pixels_()
+    assert met.packed is None and met.learned.requires_grad
+    assert torch.equal(met(),expected)
+
+def test_packed_solve_matches_unpacked():
+    gen = torch.Generator().manual_seed(0)
+    target = torch.rand(1,1,64,64,generator=gen)
+    seed = torch.rand(1,1,64,64,generator=gen)
+    mask = center_mask(target.shape,12)
+    packed = solve(target,seed,4,mask,pack_trainable_pixels=True)
+    unpacked = solve(target,seed,4,mask,pack_trainable_pixels=False)
+    assert packed.packed is not None and unpacked.packed is None
+    assert torch.allclose(torch.tensor(packed.loss_history),torch.tensor(unpacked.loss_history),rtol=1e-3)
+    assert torch.allclose(packed.get_image(),unpacked.get_image(),atol=1e-3)
+    assert torch.equal(packed.get_image()[mask],target[mask])     # the frozen pixels are copied from the target
+    assert torch.equal(unpacked.get_image()[mask],target[mask])
+
+def test_memory_budget_prefers_bfloat16_history():
+    gen = torch.Generator().manual_seed(0)
+    target = torch.rand(1,1,64,64,generator=gen)
+    seed = torch.rand(1,1,64,64,generator=gen)
+    peak = solve(target,seed,0,memory_budget=1000.0).memory_usage['estimated_peak']
+    # a bfloat16 history saves 2 bytes per element for each of the 2*30 history vectors
+    halved = solve(target,seed,2,memory_budget=(peak - 2*30*64*64)/2**30).memory_usage
+    assert halved['history_dtype'] == 'torch.bfloat16' and halved['history_size'] == 30
+    assert halved['estimated_peak'] < peak
+    # the history is only shortened when the bfloat16 history alone does not fit
+    shortened = solve(target,seed,2,memory_budget=(peak - 4*2*30*64*64)/2**30).memory_usage
+    assert shortened['history_dtype'] == 'torch.bfloat16' and 5 <= shortened['history_size'] < 30
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Tests for the statistics evaluators and their prior-frame cache (see metamerstateval.py)
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import io
+import contextlib
+import torch
+import poolingregions as pool
+import metamerstateval as meval
+from metamersolver import make_solver
+
+# An evaluator with a current-frame channel, a previous-frame channel, and a weighted average of the two frames
+def make_temporal_evaluator(image):
+    with contextlib.redirect_stdout(io.StringIO()):
+        solver = make_solver(image,pool.PoolingParams(32),outfile=None)
+    still = solver.get_statistics_evaluator().temporal_evals[0]
+    def channel(name,temporal_filter):
+        return meval.FrameChannelStatisticsEvaluator(name,temporal_filter,still.channel_stats,still.poolfunc,still.builder)
+    return meval.StatisticsEvaluator([still,channel('prev',1),channel('avg',[0.5,0.5])]).double()
+
+def random_frames(count,seed):
+    generator = torch.Generator().manual_seed(seed)
+    return [torch.rand(1,1,64,64,dtype=torch.float64,generator=generator) for _ in range(count)]
+
+def test_cached_prior_frames_match_uncached():
+    frames = random_frames(3,0)
+    evaluator = make_temporal_evaluator(frames[0])
+    with torch.no_grad():
+        evaluator([frames[0],frames[2]],frame_keys=[None,2])     # fills the cache for prior frame 2
+        cached = evaluator([frames[1],frames[2]],frame_keys=[None,2])
+        for teval in evaluator.temporal_evals: teval.cache_prior_frames = False
+        uncached = evaluator([frames[1],frames[2]],frame_keys=[None,2])
+    assert len(cached) == len(uncached)
+    for (a,b) in zip(cached,uncached):
+        assert torch.allclose(a,b,rtol=1e-9,atol=1e-12)
+
+def test_frame_cache_discards_oldest_entries():
+    frames = random_frames(4,1)
+    evaluator = make_temporal_evaluator(frames[0])
+    prev = evaluator.temporal_evals[1]
+    prev.frame_cache_size = 2
+    with torch.no_grad():
+        for key in (1,2,3):
+            evaluator([frames[0],frames[key]],frame_keys=[None,key])
+    assert list(prev._frame_cache) == [('stats',(2,)),('stats',(3,))]
+    evaluator.clear_frame_cache()
+    assert all(len(teval._frame_cache) == 0 for teval in evaluator.temporal_evals)
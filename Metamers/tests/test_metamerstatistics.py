@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Tests for the image statistics (see metamerstatistics.py)
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import io
+import math
+import contextlib
+import torch
+import poolingregions as pool
+import metamerstatistics as mstat
+import memoryestimate
+from metamersolver import make_solver
+
+def make_whole_image_evaluator(image):
+    with contextlib.redirect_stdout(io.StringIO()):
+        solver = make_solver(image,pool.PoolingParams(math.inf),outfile=None)
+    evaluator = solver.get_statistics_evaluator().double()
+    grayscale = [s for s in evaluator.stat_objects() if isinstance(s,mstat.GrayscaleStatistics)]
+    return (evaluator,grayscale)
+
+def evaluate(evaluator,image,callback=None):
+    with torch.no_grad():
+        stats = evaluator([image],create_labels=True,statlabel_callback=callback)
+    return (stats,list(evaluator.statlabels))
+
+def test_global_fast_path_matches_generic_path():
+    image = torch.rand(1,3,64,64,dtype=torch.float64,generator=torch.Generator().manual_seed(0))
+    (evaluator,grayscale) = make_whole_image_evaluator(image)
+    (fast,fast_labels) = evaluate(evaluator,image)
+    for s in grayscale: s.global_fast_path = False
+    (generic,generic_labels) = evaluate(evaluator,image)
+    assert fast_labels == generic_labels
+    assert len(fast) == len(generic)
+    for (a,b) in zip(fast,generic):
+        assert a.shape == b.shape
+        assert torch.allclose(a,b,rtol=1e-9,atol=1e-12)
+
+def test_statlabel_callback_gets_statistic_images():
+    image = torch.rand(1,1,32,32,dtype=torch.float64,generator=torch.Generator().manual_seed(1))
+    (evaluator,grayscale) = make_whole_image_evaluator(image)
+    received = []
+    evaluate(evaluator,image,lambda stat,label,statimg: received.append(statimg))
+    assert received and all(img is not None for img in received)
+    # the memory estimate's recorder accepts statistics without images (so the fast path is still used when estimating)
+    recorder = memoryestimate.StatImageSizeRecorder()
+    assert mstat.accepts_missing_statimg(recorder)
+    assert not mstat.accepts_missing_statimg(memoryestimate.StatImageSizeRecorder(lambda stat,label,statimg: None))
+
+def test_batch_statistics_match_single_images():
+    images = torch.rand(2,1,64,64,dtype=torch.float64,generator=torch.Generator().manual_seed(2))
+    with contextlib.redirect_stdout(io.StringIO()):
+        evaluator = make_solver(images,pool.PoolingParams(32),outfile=None).get_statistics_evaluator().double()
+    (batch,batch_labels) = evaluate(evaluator,images)
+    for n in range(images.size(0)):
+        (single,single_labels) = evaluate(evaluator,images.narrow(0,n,1))
+        assert batch_labels == single_labels     # same statistics in the same order regardless of the batch size
+        for (b,s) in zip(batch,single):
+            assert torch.allclose(b[n],s[0],rtol=1e-9,atol=1e-12)
+
+def enabled_statistics(stats):
+    return {name[len('stat_'):] for (name,value) in vars(stats).items() if name.startswith('stat_') and value is True}
+
+# Regression test: ps_all had a blank entry in place of ps_coefficientcorrelation, so enabling it raised a NameError
+def test_ps_all_group_includes_coefficient_correlation():
+    stats = mstat.GrayscaleStatistics()
+    stats.set_all_stats(False)
+    stats.set_stat_group('ps_all',True)
+    expected = set()
+    for group in ('ps_marginalstatistics','ps_coefficientcorrelation','ps_magnitudecorrelation','ps_crossscalephase'):
+        expected |= set(stats.named_stat_groups[group])
+    assert enabled_statistics(stats) == expected
+    assert {'low_variance','low_autocorrelation'} <= enabled_statistics(stats)
+
+def test_named_stat_groups_can_be_enabled():
+    stats = mstat.GrayscaleStatistics()
+    for group in stats.named_stat_groups:
+        stats.set_all_stats(False)
+        stats.set_stat_group(group,True)
+        assert enabled_statistics(stats)
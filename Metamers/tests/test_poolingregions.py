@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Tests for the pooling regions (see poolingregions.py)
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import io
+import contextlib
+import pytest
+import torch
+import poolingregions as pool
+
+def make_gaze_pooling(image,sparse):
+    with contextlib.redirect_stdout(io.StringIO()):
+        (pooling,copymask) = pool.make_gaze_centric_pooling([16,32,64],image,pool.NormalizedPoint(0.3,0.45),0.5,sparse=sparse)
+    pooling.configure_for_downsampling(4)
+    return pooling.double()
+
+# The dense result of a pooling list with its zero-weight (inactive) regions removed, which is what sparse pooling returns
+def active_dense_stats(pooling,image,original_size):
+    stats = []
+    for (p,weight) in zip(pooling.pool_list,pooling.weights):
+        stat = p.pool_stats(image,original_size)*weight
+        stats.append(stat[weight.expand_as(stat) != 0])
+    return torch.cat(stats)
+
+@pytest.mark.parametrize('reduction',[1,2,4])
+def test_sparse_pooling_matches_dense(reduction):
+    image = torch.rand(1,1,64,64,dtype=torch.float64,generator=torch.Generator().manual_seed(0))
+    dense = make_gaze_pooling(image,sparse=False)
+    sparse = make_gaze_pooling(image,sparse=True)
+    statimg = torch.rand(1,1,64//reduction,64//reduction,dtype=torch.float64,requires_grad=True)
+    expected = active_dense_stats(dense,statimg,image.size())
+    result = sparse.pool_stats(statimg,image.size())
+    assert torch.allclose(result,expected)
+    (expected_grad,) = torch.autograd.grad(expected.sum(),statimg)
+    (grad,) = torch.autograd.grad(result.sum(),statimg)
+    assert torch.allclose(grad,expected_grad)
+    # batches give the same result as pooling each image separately
+    batch = sparse.pool_stats_batch(torch.cat((statimg,2*statimg)).detach(),image.size())
+    assert len(batch) == 2
+    assert torch.allclose(batch[0],result) and torch.allclose(batch[1],2*result)
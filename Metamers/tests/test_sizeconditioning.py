@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Tests for size conditioning (see sizeconditioning.py and make_solver's size_conditioning option)
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import io
+import contextlib
+import pytest
+import torch
+import poolingregions as pool
+from sizeconditioning import SizeConditioner
+from metamersolver import make_solver
+from metamerconfig import MetamerConfig
+
+QUIET_MODES = {'print_num_statistics':False,'print_elapsed_time':False,'print_loss':False,'step_print_loss':False}
+
+def test_pad_round_trip():
+    image = torch.rand(1,3,37,50)
+    cond = SizeConditioner(image.size(),8,'pad')
+    padded = cond.condition(image)
+    assert tuple(padded.shape[-2:]) == cond.size == (40,56)
+    assert torch.equal(cond.restore(padded),image)
+    mask = cond.valid_mask()
+    assert mask.sum() == 37*50
+    assert torch.equal(cond.restore(mask),torch.ones(1,1,37,50))
+
+def test_crop_round_trip():
+    image = torch.rand(1,3,37,50)
+    cond = SizeConditioner(image.size(),8,'crop')
+    cropped = cond.condition(image)
+    assert tuple(cropped.shape[-2:]) == cond.size == (32,48)
+    (left,right,top,bottom) = cond.margins
+    assert torch.equal(cropped,image[...,top:top+32,left:left+48])
+    assert torch.equal(cond.condition(cropped),cropped)   # already cropped images are passed through
+    
+def test_condition_rejects_wrong_size():
+    cond = SizeConditioner((37,50),8,'pad')
+    with pytest.raises(ValueError):
+        cond.condition(torch.rand(1,3,40,56))
+
+@pytest.mark.parametrize('mode',['pad','crop'])
+def test_solve_two_frames_with_conditioning(mode):
+    torch.manual_seed(0)
+    frames = [torch.rand(1,1,37,45) for _ in range(2)]
+    config = MetamerConfig(solver_kwargs={'size_conditioning':mode},solver_modes=QUIET_MODES,device='cpu')
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        # the second frame is seeded with the first frame's result (and uses it as a prior frame)
+        config.generate_movie_metamer(frames,16,max_iters=2,outbasename=None)
+        res = config.generate_image_metamer(frames[0],16,max_iters=2,outfile=None)
+    assert 'Conditioning image size' in log.getvalue()
+    size = tuple(res.clone_image().shape[-2:])
+    assert tuple(res.get_image().shape[-2:]) == size
+    if mode == 'pad':
+        assert size == (37,45)      # padding is removed again
+    else:
+        assert size[0] < 37 and size[1] < 45
+
+def test_conditioning_rejects_size_specific_pooling():
+    weights = [torch.ones(1,1,4,4)]
+    pooling = pool.RegionPoolingList([pool.Trigezoid(16)],weights)
+    with contextlib.redirect_stdout(io.StringIO()):
+        with pytest.raises(ValueError):
+            make_solver(torch.rand(1,1,37,45),pooling,outfile=None,size_conditioning='pad')
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Tests for the steerable pyramid builders (see spyramid.py)
+# This code is part of the PooledStatisticsMetamers project
+# Released under an open-source MIT license, see LICENSE file for details
+
+import pytest
+import torch
+import spyramid as sp
+
+COMPONENTS = ('band_pass_image','low_pass_image','edge_real_images','edge_imag_images','edge_magnitude_images',
+              'coarser_magnitude_images','dphase_real_images','dphase_imag_images')
+
+# Largest relative (L2) difference between corresponding components of two pyramids
+def max_relative_difference(pyr_a,pyr_b,params):
+    uparams = sp.SPyramidParams.union(params)
+    worst = 0
+    for name in COMPONENTS:
+        levels = uparams.bandpass_range() if name == 'band_pass_image' else uparams.lowpass_range() if name == 'low_pass_image' else uparams.edge_range()
+        for i in levels:
+            (a,b) = (getattr(pyr_a,name)(i),getattr(pyr_b,name)(i))
+            assert (a is None) == (b is None), (name,i)
+            if a is None: continue
+            assert a.shape == b.shape, (name,i)
+            worst = max(worst,float((a-b).norm()/a.norm()))
+    return worst
+
+def build_both(size,pyramid,method):
+    image = torch.rand(1,1,*size,dtype=torch.float64,generator=torch.Generator().manual_seed(0))
+    params = sp.SPyramidParams.from_str(pyramid)
+    fourier = sp.SPyramidFourierBuilder(image,params,max_downsample_factor=8).double()
+    spatial = sp.SPyramidConvolutionalBuilder(image,params,max_downsample_factor=8,method=method,kernel_energy=0.9999).double()
+    return (fourier.build_spyramid(image),spatial.build_spyramid(image),params,spatial)
+
+# With wraparound boundaries both builders compute circular convolutions, so they differ only by the trimming of the kernels
+# (with zero boundaries the fourier builder's filters wrap around within its padding, which differs at the coarse levels)
+@pytest.mark.parametrize('size',[(64,64),(64,96)])
+def test_spatial_builder_matches_fourier(size):
+    (fourier,spatial,params,builder) = build_both(size,'UBbbL_5:Ori=4:Bound=wrap','spatial')
+    assert all(m == 'spatial' for m in builder.level_methods)
+    assert max_relative_difference(fourier,spatial,params) < 0.05
+
+def test_auto_builder_matches_fourier():
+    (fourier,spatial,params,builder) = build_both((128,96),'UEeeeee_7_:Ori=6:RadK=gauss','auto')
+    assert 'spatial' in builder.level_methods
+    assert max_relative_difference(fourier,spatial,params) < 0.02
+
+# The extra fft-friendly padding changes the results near zero boundaries, so the default keeps the minimal padding
+def test_fft_friendly_padding_is_opt_in():
+    image = torch.rand(1,1,100,76,dtype=torch.float64,generator=torch.Generator().manual_seed(0))
+    params = sp.SPyramidParams.from_str('UBbbL_5:Ori=4')
+    pad = 2**(params.max_stop_level()-1)
+    assert sp.SPyramidFourierBuilder(image,params,max_downsample_factor=4).padding == (pad,pad,pad,pad)
+    friendly = sp.SPyramidFourierBuilder(image,params,max_downsample_factor=4,fft_friendly_padding=True).padding
+    (width,height) = (76+friendly[0]+friendly[1],100+friendly[2]+friendly[3])
+    assert all(p >= pad and p % 4 == 0 for p in friendly)
+    assert sp.fft_friendly_size(width) == width and sp.fft_friendly_size(height) == height